@@ -0,0 +1,369 @@
+from objects import Card, Deck
+from catalog import CATALOG
+from spatial import CARD_WIDTH, CARD_HEIGHT
+from metrics import ACTION_SECONDS, ACTION_ERRORS
+import tracing
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+import math
+import random
+import time
+import uuid
+
+# Actions clients can send, and the args each one takes. Every action is
+# registered with a schema of arg fields that is checked before the handler
+# runs, so a bad message is turned away with an error for the sender instead of
+# failing halfway through a Room method.
+
+###
+### Arg fields
+###
+REQUIRED = object()
+
+# most actions one batch message can carry
+MAX_BATCH = 256
+
+# table coordinates go from -MAX_COORDINATE to MAX_COORDINATE. anything bigger
+# is a bad client, and huge ints can't be sent to anyone once they're in the room
+MAX_COORDINATE = 1_000_000
+
+class ArgError(ValueError):
+    pass
+
+# raised inside a batch when one of its actions is rejected
+class BatchError(Exception):
+    def __init__(self, index, error):
+        super().__init__(error["message"])
+        self.index = index
+        self.error = error
+
+class Field(ABC):
+    def __init__(self, default=REQUIRED):
+        self.default = default
+
+    #returns the checked value or raises ArgError
+    @abstractmethod
+    def check(self, name, value):
+        ...
+
+class Str(Field):
+    def check(self, name, value):
+        if not isinstance(value, str):
+            raise ArgError(f"{name} must be a string")
+        return value
+
+class Int(Field):
+    def __init__(self, default=REQUIRED, min=None):
+        super().__init__(default)
+        self.min = min
+
+    def check(self, name, value):
+        if not isinstance(value, int) or isinstance(value, bool):
+            raise ArgError(f"{name} must be an integer")
+        if self.min is not None and value < self.min:
+            raise ArgError(f"{name} must be at least {self.min}")
+        return value
+
+#True for a finite int or float within MAX_COORDINATE of 0
+def is_coordinate(value) -> bool:
+    if not isinstance(value, (int, float)) or isinstance(value, bool):
+        return False
+    return math.isfinite(value) and -MAX_COORDINATE <= value <= MAX_COORDINATE
+
+# a table coordinate
+class Number(Field):
+    def check(self, name, value):
+        if not is_coordinate(value):
+            raise ArgError(f"{name} must be a number from -{MAX_COORDINATE} to {MAX_COORDINATE}")
+        return value
+
+class Bool(Field):
+    #arg1 default value
+    #arg2 bool for if null is allowed
+    def __init__(self, default=REQUIRED, nullable=False):
+        super().__init__(default)
+        self.nullable = nullable
+
+    def check(self, name, value):
+        if value is None and self.nullable:
+            return None
+        if not isinstance(value, bool):
+            raise ArgError(f"{name} must be true or false")
+        return value
+
+# an [x, y] pair
+class Position(Field):
+    def check(self, name, value):
+        if not isinstance(value, (list, tuple)) or len(value) != 2:
+            raise ArgError(f"{name} must be [x, y]")
+        for n in value:
+            if not is_coordinate(n):
+                raise ArgError(f"{name} must be [x, y] with numbers from -{MAX_COORDINATE} to {MAX_COORDINATE}")
+        return list(value)
+
+# a list of action messages, for batch
+class ActionList(Field):
+    def check(self, name, value):
+        if not isinstance(value, list):
+            raise ArgError(f"{name} must be a list of actions")
+        if len(value) > MAX_BATCH:
+            raise ArgError(f"{name} can have at most {MAX_BATCH} actions")
+        return value
+
+class CardArg(Field):
+    def check(self, name, value):
+        if not isinstance(value, dict):
+            raise ArgError(f"{name} must be a card")
+        try:
+            card = Card.from_wire(value)
+        except ValueError:
+            raise ArgError(f"{name} must be a card")
+        # interned now, so a face the catalog can't take is turned away before the action runs
+        try:
+            CATALOG.code(card.card_front, card.card_back)
+        except ValueError as e:
+            raise ArgError(f"{name}: {e}")
+        return card
+
+# The fields of one action, turned into a list of (name, field, default) once
+# when the action is registered so checking a message is a single loop.
+# Args the schema doesn't know are ignored.
+class Schema:
+    def __init__(self, fields: dict):
+        self.fields = [(name, field, field.default) for name, field in fields.items()]
+
+    def check(self, args) -> dict:
+        if not isinstance(args, dict):
+            raise ArgError("args must be an object")
+        out = {}
+        for name, field, default in self.fields:
+            value = args.get(name, default)
+            if value is REQUIRED:
+                raise ArgError(f"missing {name}")
+            out[name] = value if value is default else field.check(name, value)
+        return out
+
+###
+### Dispatcher
+###
+@dataclass
+class ActionStats:
+    calls: int = 0
+    errors: int = 0
+    seconds: float = 0.0
+    max_seconds: float = 0.0
+
+@dataclass
+class Action:
+    name: str
+    handler: callable
+    schema: Schema
+
+class Dispatcher:
+    def __init__(self):
+        self.actions = {}
+        self.stats = {}
+
+    #registers a handler. used as a decorator
+    #arg1 action name
+    #kwargs arg name to Field
+    #the handler gets the room and the checked args as keywords and returns the new room
+    def action(self, name, **fields):
+        def register(handler):
+            self.actions[name] = Action(name, handler, Schema(fields))
+            self.stats[name] = ActionStats()
+            return handler
+        return register
+
+    #applies one action message to a room
+    #arg3 optional. True for the actions in a batch, which are left out of /metrics so
+    #that one message is one observation there. they're still in stats
+    #returns the new room (the same room if nothing changed) and an error message for the sender, or None
+    def dispatch(self, room, message, nested=False) -> tuple:
+        if not isinstance(message, dict):
+            if not nested:
+                ACTION_ERRORS.inc("", "invalid_message")
+            return room, error_message(None, "invalid_message", "message must be an object")
+        name = message.get("action")
+        action = self.actions.get(name) if isinstance(name, str) else None
+        if action is None:
+            # not labelled with the name, so clients can't make up new series
+            if not nested:
+                ACTION_ERRORS.inc("", "unknown_action")
+            return room, error_message(name, "unknown_action", f"unknown action {name!r}")
+
+        stats = self.stats[name]
+        start = time.perf_counter()
+        checked = None
+        error = None
+        try:
+            args = action.schema.check(message.get("args", {}))
+            checked = time.perf_counter()
+            room = action.handler(room, **args)
+        except ArgError as e:
+            error = error_message(name, "invalid_args", str(e))
+        except BatchError as e:
+            error = error_message(name, e.error["error"], f"actions[{e.index}] ({e.error['action']}): {e.error['message']}")
+            error["index"] = e.index
+        except (KeyError, IndexError) as e:
+            error = error_message(name, "not_found", f"no such deck, hand or card: {e}")
+        except Exception as e:
+            error = error_message(name, "failed", str(e))
+        elapsed = time.perf_counter() - start
+
+        stats.calls += 1
+        stats.seconds += elapsed
+        stats.max_seconds = max(stats.max_seconds, elapsed)
+        if not nested:
+            ACTION_SECONDS.observe(elapsed, name)
+        if tracing.current is not None:
+            # a batch's own call ends last, so its times replace those of the actions in it
+            tracing.current.set("validate", (checked or start + elapsed) - start)
+            if checked is not None:
+                tracing.current.set("apply", start + elapsed - checked)
+        if error is not None:
+            stats.errors += 1
+            if not nested:
+                ACTION_ERRORS.inc(name, error["error"])
+        return room, error
+
+    #per action counters, for profiling
+    def stats_snapshot(self) -> dict:
+        return {
+            name: {"calls": s.calls, "errors": s.errors, "seconds": s.seconds, "max_seconds": s.max_seconds}
+            for name, s in self.stats.items()
+        }
+
+def error_message(action, error, message) -> dict:
+    return {"type": "error", "action": action, "error": error, "message": message}
+
+DISPATCHER = Dispatcher()
+action = DISPATCHER.action
+
+###
+### Actions. see format.md
+###
+@action("draw_card", hand_id=Str(), deck_id=Str(), n=Int(1, min=1), from_bottom=Bool(False))
+def draw_card(room, hand_id, deck_id, n, from_bottom):
+    return room.draw_card(hand_id, deck_id, n, from_bottom)
+
+@action("initialize_deck", pos=Position([0, 0]), deck_type=Str("standard52"))
+def initialize_deck(room, pos, deck_type):
+    return room.initialize_deck(list(pos), deck_type)[0]
+
+@action("initialize_hand", hand_type=Str("empty"), owner=Str(""))
+def initialize_hand(room, hand_type, owner):
+    return room.initialize_hand(hand_type, owner)[0]
+
+@action("split_deck", deck_id=Str(), n=Int(min=1), pos=Position())
+def split_deck(room, deck_id, n, pos):
+    return room.split_deck(deck_id, n, pos)[0]
+
+@action("shuffle", deck_id=Str(), seed=Int(None))
+def shuffle(room, deck_id, seed):
+    return room.shuffle(deck_id, seed)
+
+@action("remove_top", deck_id=Str(), n=Int(1, min=1))
+def remove_top(room, deck_id, n):
+    return room.remove_top(deck_id, n)
+
+@action("add_top", deck_id=Str(), card=CardArg())
+def add_top(room, deck_id, card):
+    return room.add_top(deck_id, card)
+
+@action("flip_deck_card", deck_id=Str(), idx=Int(0), face_up=Bool(None, nullable=True))
+def flip_deck_card(room, deck_id, idx, face_up):
+    return room.flip_deck_card(deck_id, idx, face_up)
+
+@action("flip_deck", deck_id=Str())
+def flip_deck(room, deck_id):
+    return room.flip_deck(deck_id)
+
+@action("move_deck", deck_id=Str(), x=Number(), y=Number())
+def move_deck(room, deck_id, x, y):
+    return room.move_deck(deck_id, x, y)
+
+@action("remove_nth", hand_id=Str(), n=Int())
+def remove_nth(room, hand_id, n):
+    return room.remove_nth(hand_id, n)
+
+@action("add_card_to_hand", hand_id=Str(), card=CardArg())
+def add_card_to_hand(room, hand_id, card):
+    return room.add_card_to_hand(hand_id, card)
+
+@action("flip_hand_card", hand_id=Str(), idx=Int(), face_up=Bool(None, nullable=True))
+def flip_hand_card(room, hand_id, idx, face_up):
+    return room.flip_hand_card(hand_id, idx, face_up)
+
+#takes a card out of a deck and puts it down on its own as a new one card deck
+@action("move_card", deck_id=Str(), card_index=Int(), new_position=Position(), new_deck_id=Str(None))
+def move_card(room, deck_id, card_index, new_position, new_deck_id):
+    room, removed_card = room.remove_card_from_deck(deck_id, card_index)
+    if removed_card is None:
+        return room
+    new_deck_id = new_deck_id or f"card_{uuid.uuid4()}"
+    return room.add_deck(Deck(id=new_deck_id, position=new_position, cards=[removed_card]))
+
+@action("combine_cards_into_deck", dragged_deck_id=Str(), dragged_card_index=Int(), target_deck_id=Str(), target_card_index=Int())
+def combine_cards_into_deck(room, dragged_deck_id, dragged_card_index, target_deck_id, target_card_index):
+    return room.combine_cards_into_deck(dragged_deck_id, dragged_card_index, target_deck_id, target_card_index)
+
+@action("merge_decks", dragged_deck_id=Str(), target_deck_id=Str())
+def merge_decks(room, dragged_deck_id, target_deck_id):
+    return room.merge_decks(dragged_deck_id, target_deck_id)
+
+#drops a deck, or one card of it, with its top left corner at x, y and lets the server work out what it
+#landed on, like the client does: a card counts as dropped where its middle is, a deck where its corner is.
+#on a deck it's combined into that deck (merge_decks or combine_cards_into_deck), otherwise it's just moved
+@action("drop_at", deck_id=Str(), card_index=Int(None), x=Number(), y=Number(), new_deck_id=Str(None))
+def drop_at(room, deck_id, card_index, x, y, new_deck_id):
+    if card_index is None:
+        target_id, _ = room.deck_at(x, y, exclude=deck_id)
+        if target_id is None:
+            return room.move_deck(deck_id, x, y)
+        return room.merge_decks(deck_id, target_id)
+    target_id, target_index = room.deck_at(x + CARD_WIDTH / 2, y + CARD_HEIGHT / 2)
+    if target_id is None:
+        return move_card(room, deck_id, card_index, [x, y], new_deck_id)
+    return room.combine_cards_into_deck(deck_id, card_index, target_id, target_index)
+
+#applies a list of actions in order as one change. if any of them is rejected
+#none of them are applied, and the error says which one it was
+@action("batch", actions=ActionList())
+def batch(room, actions):
+    for i, message in enumerate(actions):
+        if isinstance(message, dict) and message.get("action") == "batch":
+            raise BatchError(i, error_message("batch", "invalid_args", "batches can't be nested"))
+        room, error = DISPATCHER.dispatch(room, message, nested=True)
+        if error is not None:
+            raise BatchError(i, error)
+    return room
+
+###
+### Stamping
+###
+# Servers that replay the same actions (see backends.py) have to end up with the
+# same room, so whatever an action would pick at random is picked once by the
+# server that received it and written into the action before it is sent on.
+# Choices the client already made are kept, so stamping twice changes nothing.
+def _stamp_seed(args):
+    if args.get("seed") is None:
+        args["seed"] = random.getrandbits(32)
+
+def _stamp_new_deck_id(args):
+    if not args.get("new_deck_id"):
+        args["new_deck_id"] = f"card_{uuid.uuid4()}"
+
+STAMPS = {"shuffle": _stamp_seed, "move_card": _stamp_new_deck_id, "drop_at": _stamp_new_deck_id}
+
+#returns a copy of an action message with its random choices filled in
+def stamp(message):
+    if not isinstance(message, dict) or not isinstance(message.get("args"), dict):
+        return message
+    message = dict(message, args=dict(message["args"]))
+    name = message.get("action")
+    if name == "batch" and isinstance(message["args"].get("actions"), list):
+        message["args"]["actions"] = [stamp(m) for m in message["args"]["actions"]]
+    elif name in STAMPS:
+        STAMPS[name](message["args"])
+    return message
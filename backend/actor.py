@@ -0,0 +1,178 @@
+from coalesce import MoveCoalescer, MOVE_WINDOW
+from bigroom import BigRoom
+from persist import RoomLog
+from broadcast import RoomChannel, SEND_QUEUE_SIZE, SLOW_CLIENT_POLICY
+from tracing import TRACER
+import asyncio
+import time
+import traceback
+import tracing
+
+# Runs one room. Every change to the room goes through a single task that takes
+# commands off a queue one at a time, so actions apply in the order they were
+# received, each gets the next version, and everything that follows from it
+# (broadcasts, errors, joins and leaves) happens before the next command starts.
+# Receive loops only queue commands and never wait on the room or its sockets.
+#
+# Commands are tuples of a kind and its args:
+# ("join", socket, player name, mode, encoding[, (resume epoch, resume version)[, view]])
+# ("leave", socket, player name)
+# ("action", socket, action message[, received]) received is from tracing.received()
+# ("watch", socket, encoding) adds a spectator, who isn't a player
+# ("unwatch", socket)
+# ("resync", socket)
+# ("error", socket, error message) sends an error to one socket
+# ("tick",) applies held move_deck actions
+# ("open", None) does nothing. sets up a new room so it's tracked (see registry.py)
+# ("save", None, reply) calls reply(BigRoom) with the room as of this point in the queue
+# ("load", None, load) calls load(BigRoom) to replace the room with one saved elsewhere, then sends everyone the new state
+# socket is None for players connected to another server sharing the room
+# (see backends.py). their joins, leaves and actions change the room but have
+# no socket here to add, remove or send errors to.
+class RoomActor:
+    #arg1 BigRoom
+    #arg2 RoomChannel for the room
+    #arg3 move_deck coalescing window in seconds
+    #arg4 optional. the room's id, for traces and profiles
+    def __init__(self, bigroom, channel, move_window=MOVE_WINDOW, room_id=None):
+        self.room_id = room_id
+        self.bigroom = bigroom
+        self.channel = channel
+        self.mover = MoveCoalescer(bigroom, channel, move_window, on_tick=lambda: self.submit("tick"))
+        self.queue = asyncio.Queue()
+        self.task = None
+        self.submitted = 0
+        self.processed = 0
+        # time.monotonic() of the last command, for evicting idle rooms
+        self.last_active = time.monotonic()
+        # the BigRoom being loaded by recover, None once the room is ready
+        self.loading = None
+
+    #queues a command. never blocks. starts the room's task if it isn't running
+    def submit(self, kind, *args):
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+        self.submitted += 1
+        self.last_active = time.monotonic()
+        self.queue.put_nowait((kind, args))
+
+    #loads the room with job() on another thread, so reading it from disk doesn't hold up other rooms.
+    #commands queue up meanwhile and are handled once it's loaded
+    #arg1 callable returning the BigRoom
+    def recover(self, job):
+        self.loading = asyncio.get_running_loop().run_in_executor(None, job)
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+
+    async def run(self):
+        if self.loading is not None:
+            try:
+                self.replace(await self.loading)
+            except Exception:
+                # the room goes on empty and isn't saved. its files are left as they were
+                traceback.print_exc()
+            self.loading = None
+        while True:
+            kind, args = await self.queue.get()
+            tracing.enter(self.room_id)
+            try:
+                self.handle(kind, *args)
+            except Exception:
+                # one bad command shouldn't stop the room
+                traceback.print_exc()
+            tracing.leave(self.room_id)
+            self.processed += 1
+
+    #applies one command. never awaits, so nothing else touches the room meanwhile
+    def handle(self, kind, *args):
+        match kind:
+            case "join":
+                self.join(*args)
+            case "leave":
+                socket, player_name = args
+                self.bigroom.removePlayer(player_name)
+                if socket is not None:
+                    self.channel.remove(socket)
+                self.channel.broadcast(to_full=False)
+            case "watch":
+                socket, encoding = args
+                self.channel.watch(socket, encoding)
+            case "unwatch":
+                socket, = args
+                self.channel.remove(socket)
+            case "resync":
+                socket, = args
+                if socket in self.channel.connections:
+                    self.channel.resync(socket)
+            case "action":
+                self.apply(*args)
+            case "error":
+                socket, message = args
+                self.channel.send_to(socket, message)
+            case "tick":
+                self.mover.tick()
+            case "open":
+                pass
+            case "save":
+                socket, reply = args
+                reply(self.bigroom)
+            case "load":
+                socket, load = args
+                load(self.bigroom)
+                self.channel.reload()
+
+    #swaps in the room recover loaded
+    def replace(self, bigroom):
+        self.bigroom = self.channel.bigroom = self.mover.bigroom = bigroom
+        self.channel.reload()
+
+    #arg5 optional. (epoch, version) a reconnecting socket last saw (see RoomChannel.add)
+    #arg6 optional. "player" (default) sends only what this player can see, "all" the whole table
+    def join(self, socket, player_name, mode, encoding, resume=None, view="player"):
+        self.bigroom.addPlayer(player_name)
+        self.channel.broadcast(to_full=False)
+        if socket is not None:
+            self.channel.add(socket, mode, encoding, resume, None if view == "all" else player_name)
+
+    #arg3 optional. when the action's frame came in (see tracing.received)
+    def apply(self, socket, action, received=None):
+        if self.mover.add(socket, action):
+            return
+        trace = tracing.current = TRACER.start(self.room_id, action, received)
+        try:
+            moved = self.mover.flush()
+            error = self.bigroom.updateState(action)
+            if error is not None:
+                self.channel.send_to(socket, error)
+                if trace is not None:
+                    trace.error = error["error"]
+                if moved:
+                    self.channel.broadcast()
+                return
+            self.channel.broadcast()
+        finally:
+            if trace is not None:
+                tracing.current = None
+                TRACER.finish(trace)
+
+    #stops the room's task. for rooms being evicted
+    def close(self):
+        if self.mover.timer is not None:
+            self.mover.timer.cancel()
+        if self.task is not None:
+            self.task.cancel()
+
+    #waits until every command queued so far has been handled
+    async def idle(self):
+        while self.loading is not None or self.processed < self.submitted:
+            await asyncio.sleep(0)
+
+#a new room and the actor that runs it
+#if data_dir is given the room is loaded from it, off the event loop, and its actions are saved there
+def new_room_actor(room_id, send_queue_size=SEND_QUEUE_SIZE, slow_client_policy=SLOW_CLIENT_POLICY, move_window=MOVE_WINDOW, data_dir=None) -> RoomActor:
+    log = RoomLog(data_dir, room_id) if data_dir else None
+    bigroom = BigRoom()
+    actor = RoomActor(bigroom, RoomChannel(bigroom, send_queue_size, slow_client_policy), move_window, room_id)
+    if log is not None:
+        actor.recover(log.recover)
+    return actor
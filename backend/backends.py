@@ -0,0 +1,522 @@
+from actor import new_room_actor
+from registry import RoomRegistry, IDLE_TTL, MEMORY_BUDGET
+from actions import stamp, error_message
+from persist import saved_rooms, snapshot_to_wire, snapshot_from_wire
+from broadcast import SEND_QUEUE_SIZE, SLOW_CLIENT_POLICY
+from coalesce import MOVE_WINDOW
+from codec import dumps, loads
+from metrics import snapshot
+from tracing import TRACER, start_profile, profile_path
+import asyncio
+import hmac
+import itertools
+import uuid
+
+# Where rooms live. main.py hands every command for a room to a backend with
+# submit(room id, kind, socket, *args), using the RoomActor command kinds.
+# A backend also has start() and stop(), called when the server starts and stops,
+# stats() with room counts and memory totals (see registry.py), metrics(), a
+# coroutine giving the metrics snapshot and gauges for /metrics (see metrics.py),
+# trace(rate, directory) and profile(room id, mode, seconds, directory) for the
+# admin endpoints (see tracing.py), and on_evict, which main.py sets to a callable that is given the id of every
+# evicted room. A BrokerBackend also has on_open, set the same way and given the invite code of every room
+# opened on another server.
+#
+# InMemoryBackend  every room runs in this process (the default)
+# ShardRouter      rooms are spread over worker processes (shard.py)
+# BrokerBackend    rooms are shared by several servers through a Broker, so
+#                  players connected to different servers play at the same table
+
+class InMemoryBackend:
+    #data_dir is where rooms are saved (see persist.py). None keeps them only in memory
+    #idle_ttl, memory_budget and pinned are for evicting rooms (see RoomRegistry)
+    def __init__(self, send_queue_size=SEND_QUEUE_SIZE, slow_client_policy=SLOW_CLIENT_POLICY, move_window=MOVE_WINDOW, data_dir=None,
+                 idle_ttl=IDLE_TTL, memory_budget=MEMORY_BUDGET, pinned=()):
+        self.send_queue_size = send_queue_size
+        self.slow_client_policy = slow_client_policy
+        self.move_window = move_window
+        self.data_dir = data_dir
+        self.on_evict = None
+        self.rooms = RoomRegistry(self.new_actor, idle_ttl, memory_budget, pinned, on_evict=self.evicted)
+
+    @property
+    def actors(self) -> dict:
+        return self.rooms.actors
+
+    #loads every saved room
+    def start(self):
+        if self.data_dir:
+            for room_id in saved_rooms(self.data_dir):
+                self.actor(room_id)
+        self.rooms.start()
+
+    def stop(self):
+        self.rooms.stop()
+
+    def new_actor(self, room_id):
+        return new_room_actor(room_id, self.send_queue_size, self.slow_client_policy, self.move_window, self.data_dir)
+
+    #the room's actor, set up the first time the room is used
+    def actor(self, room_id):
+        return self.rooms.get(room_id)
+
+    def evicted(self, room_id):
+        if self.on_evict is not None:
+            self.on_evict(room_id)
+
+    def stats(self) -> dict:
+        return self.rooms.stats()
+
+    async def metrics(self) -> tuple[dict, dict]:
+        return snapshot(), self.rooms.gauges()
+
+    #traces a share of actions from now on
+    def trace(self, rate, directory):
+        TRACER.configure(rate, directory)
+
+    #starts a profile of one room, or of everything if room_id is None
+    #returns the files that will be written. raises ProfileBusy if one is running
+    def profile(self, room_id, mode, seconds, directory) -> list:
+        path = profile_path(directory, room_id, mode)
+        start_profile(mode, seconds, path, room_id)
+        return [path]
+
+    def submit(self, room_id, kind, socket, *args):
+        self.actor(room_id).submit(kind, socket, *args)
+
+###
+### Broker
+###
+# Every server sharing rooms connects to one broker over TCP. Servers publish
+# the joins, leaves and actions they receive, and the broker puts each room's
+# commands in a single order and sends them to every server subscribed to the
+# room, the publisher included. Each server applies them in that order to its
+# own copy of the room, so all copies stay the same. Nothing a server does to a
+# room may depend on timing, so move_deck coalescing happens before publishing
+# instead of in the room (see BrokerBackend.hold).
+#
+# Every COMPACT_EVERY commands the broker asks the server that published the
+# last one for the room's state after it, and then drops the commands that
+# state covers. A server that subscribes late, or comes back after losing its
+# connection, is sent that state and the commands after it.
+#
+# Each server numbers its publishes. The broker answers a hello with the last
+# number it took from that server and ignores numbers it has already taken, so
+# a server that reconnects can send again everything it hasn't seen come back
+# and nothing is applied twice.
+#
+# Invite codes go through the broker too. A server tells the broker about every
+# room it opens, the broker tells every other server, and a server that
+# connects is told every code so far, so a code made on one server works on all
+# of them.
+#
+# The broker only keeps rooms in memory. Nothing is saved or evicted, so it
+# grows with every room ever opened and a restart loses every table.
+#
+# If the broker is started with a token, a server has to say it first or is
+# disconnected. Anyone who can reach a broker without one can join any room.
+#
+# Lines of JSON, server to broker:
+# {"op": "hello", "token": token, "server": server id}   first line on every connection
+# {"op": "subscribe", "room": room id, "after": last seq the server has, -1 for none}
+# {"op": "publish", "room": room id, "id": publish number, "command": [kind, connection id, *args]}
+# {"op": "snapshot", "room": room id, "seq": seq, "state": room state after seq}
+# {"op": "open", "room": invite code}
+# broker to server:
+# {"published": last publish number taken from the server, -1 for none, "opened": [every invite code]}   answer to hello
+# {"opened": invite code}   a room another server opened
+# {"room": room id, "seq": position in the room's order, "command": [kind, connection id, *args], "server": server id, "id": publish number}
+#     "server" and "id" are left out when a late subscriber catches up
+# {"room": room id, "seq": seq, "state": room state after seq}
+# {"room": room id, "seq": seq, "save": true}   asks for the room's state after seq
+# where a room state is the snapshot form of persist.py with "players" added.
+COMPACT_EVERY = 1000
+
+# seconds a server waits before connecting again, doubled after every failed try
+RECONNECT_DELAY = 0.1
+RECONNECT_MAX_DELAY = 5
+
+# One room at the broker
+class BrokerRoom:
+    def __init__(self):
+        # commands since the state. the first one has seq first
+        self.commands = []
+        self.first = 0
+        # room state after seq first - 1, or None if nothing was dropped yet
+        self.state = None
+        self.subscribers = set()
+
+    #arg1 last seq the subscriber has
+    #returns the lines that bring it up to date
+    def since(self, room_id, after) -> list:
+        lines = []
+        if after < self.first - 1:
+            lines.append(Broker.encode(room_id, self.first - 1, state=self.state))
+            after = self.first - 1
+        for seq in range(after + 1, self.first + len(self.commands)):
+            lines.append(Broker.encode(room_id, seq, command=self.commands[seq - self.first]))
+        return lines
+
+    #drops the commands a room state covers. does nothing for states older than the one kept
+    def compact(self, seq, state):
+        if self.first <= seq < self.first + len(self.commands):
+            del self.commands[:seq + 1 - self.first]
+            self.first = seq + 1
+            self.state = state
+
+class Broker:
+    #arg3 optional. token servers have to send before anything else. default None lets anyone in
+    #arg4 commands between room states
+    def __init__(self, host="127.0.0.1", port=0, token=None, compact_every=COMPACT_EVERY):
+        self.host = host
+        self.port = port
+        self.token = token
+        self.compact_every = compact_every
+        self.rooms = {}
+        # server id -> last publish number taken from it
+        self.published = {}
+        # invite codes servers have opened
+        self.opened = set()
+        # every server's connection, after its hello
+        self.servers = set()
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.serve, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    def authorized(self, hello) -> bool:
+        if self.token is None:
+            return True
+        token = hello.get("token") if isinstance(hello, dict) and hello.get("op") == "hello" else None
+        return isinstance(token, str) and hmac.compare_digest(token.encode(), self.token.encode())
+
+    async def serve(self, reader, writer):
+        rooms = set()
+        try:
+            hello = loads(await reader.readline())
+            if not self.authorized(hello):
+                return
+            server_id = hello.get("server") if isinstance(hello, dict) else None
+            writer.write((dumps({"published": self.published.get(server_id, -1), "opened": list(self.opened)}) + "\n").encode())
+            self.servers.add(writer)
+            while line := await reader.readline():
+                message = loads(line)
+                room_id = message["room"]
+                if message["op"] == "open":
+                    if room_id not in self.opened:
+                        self.opened.add(room_id)
+                        out = (dumps({"opened": room_id}) + "\n").encode()
+                        for server in self.servers:
+                            if server is not writer:
+                                server.write(out)
+                    continue
+                room = self.rooms.setdefault(room_id, BrokerRoom())
+                if message["op"] == "subscribe":
+                    rooms.add(room_id)
+                    room.subscribers.add(writer)
+                    writer.writelines(room.since(room_id, message.get("after", -1)))
+                elif message["op"] == "publish":
+                    number = message.get("id")
+                    if number is not None and server_id is not None:
+                        if number <= self.published.get(server_id, -1):
+                            # sent again after a reconnect
+                            continue
+                        self.published[server_id] = number
+                    room.commands.append(message["command"])
+                    seq = room.first + len(room.commands) - 1
+                    out = self.encode(room_id, seq, command=message["command"], server=server_id, id=number)
+                    for subscriber in room.subscribers:
+                        subscriber.write(out)
+                    if len(room.commands) % self.compact_every == 0:
+                        # the publisher has the room, or will once this command reaches it.
+                        # if the server asked never answers, one is asked again after another compact_every
+                        asked = writer if writer in room.subscribers else next(iter(room.subscribers), None)
+                        if asked is not None:
+                            asked.write(self.encode(room_id, seq, save=True))
+                elif message["op"] == "snapshot":
+                    room.compact(message["seq"], message["state"])
+                await writer.drain()
+        except (ConnectionError, ValueError, KeyError, TypeError):
+            pass
+        finally:
+            self.servers.discard(writer)
+            for room_id in rooms:
+                self.rooms[room_id].subscribers.discard(writer)
+            writer.close()
+
+    @staticmethod
+    def encode(room_id, seq, **fields) -> bytes:
+        return (dumps({"room": room_id, "seq": seq, **fields}) + "\n").encode()
+
+#a room in the broker's state form
+def room_state(bigroom) -> dict:
+    state = snapshot_to_wire(bigroom.version, bigroom.room, bigroom.history.kept())
+    state["players"] = list(bigroom.players)
+    return state
+
+#replaces a BigRoom's contents with a state from room_state
+def load_room_state(bigroom, state):
+    snapshot_from_wire(bigroom, state)
+    bigroom.players = list(state["players"])
+
+# A server's side of the broker. Commands from this server's sockets are sent
+# to the broker with a connection id, and only applied when they come back, so
+# this server sees the same order as every other one. Commands from players on
+# other servers are applied with no socket.
+#
+# If the connection drops, the server connects again (waiting longer after each
+# failed try), subscribes to its rooms again from the last seq it applied, skips
+# anything it is sent twice, and publishes again what the broker didn't get.
+class BrokerBackend(InMemoryBackend):
+    #arg1 broker host
+    #arg2 broker port
+    #arg3 optional. the broker's token
+    #rooms aren't saved or evicted, here or at the broker, which keeps every room in memory.
+    #raises ValueError for a data_dir
+    def __init__(self, host, port, token=None, **settings):
+        if settings.get("data_dir"):
+            raise ValueError("rooms can't be saved with a broker")
+        # every copy of a room has to apply the same moves, so they are coalesced here before publishing
+        self.publish_window = settings.get("move_window", MOVE_WINDOW)
+        settings.update(data_dir=None, idle_ttl=None, memory_budget=None, move_window=0)
+        super().__init__(**settings)
+        self.host = host
+        self.port = port
+        self.token = token
+        self.server_id = uuid.uuid4().hex[:8]
+        self.ids = itertools.count()
+        self.conn_ids = {}
+        self.sockets = {}
+        self.subscribed = set()
+        # room id -> last seq applied
+        self.seqs = {}
+        # room id -> {deck id: publish line} of moves waiting for the move window to end
+        self.held = {}
+        self.timers = {}
+        self.delay = RECONNECT_DELAY
+        self.publish_ids = itertools.count()
+        # invite codes opened on this server, told to the broker again after a reconnect
+        self.opened = set()
+        self.on_open = None
+        # publish number -> line, for publishes that haven't come back yet
+        self.unconfirmed = {}
+        self.outbox = asyncio.Queue()
+        self.tasks = []
+
+    def start(self):
+        self.tasks = [asyncio.create_task(self.run())]
+
+    def stop(self):
+        super().stop()
+        for timer in self.timers.values():
+            timer.cancel()
+        for task in self.tasks:
+            task.cancel()
+
+    async def run(self):
+        while True:
+            try:
+                reader, writer = await asyncio.open_connection(self.host, self.port)
+            except OSError:
+                await self.wait_to_reconnect()
+                continue
+            writer.write(self.line({"op": "hello", "token": self.token or "", "server": self.server_id}))
+            try:
+                hello = loads(await reader.readline())
+                published = hello["published"]
+            except (ConnectionError, ValueError, KeyError):
+                # turned away
+                writer.close()
+                await self.wait_to_reconnect()
+                continue
+            for room_id in hello.get("opened", ()):
+                self.opened_elsewhere(room_id)
+            for room_id in self.opened:
+                writer.write(self.line({"op": "open", "room": room_id}))
+            for room_id in self.subscribed:
+                writer.write(self.line(self.subscription(room_id)))
+            # ones still in the outbox are sent again after these, and ignored by the broker
+            for number, line in list(self.unconfirmed.items()):
+                if number <= published:
+                    del self.unconfirmed[number]
+                else:
+                    writer.write(line)
+            reading = asyncio.create_task(self.read(reader))
+            writing = asyncio.create_task(self.write(writer))
+            try:
+                # reading ends when the broker closes the connection, writing when a write fails
+                await asyncio.wait((reading, writing), return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                reading.cancel()
+                writing.cancel()
+                writer.close()
+            print(f"lost the broker at {self.host}:{self.port}, reconnecting")
+            await self.wait_to_reconnect()
+
+    async def wait_to_reconnect(self):
+        await asyncio.sleep(self.delay)
+        self.delay = min(self.delay * 2, RECONNECT_MAX_DELAY)
+
+    async def read(self, reader):
+        try:
+            while line := await reader.readline():
+                self.delay = RECONNECT_DELAY
+                self.receive(loads(line))
+        except ConnectionError:
+            pass
+
+    async def write(self, writer):
+        try:
+            while True:
+                writer.write(await self.outbox.get())
+                await writer.drain()
+        except ConnectionError:
+            pass
+
+    #handles a line from the broker
+    def receive(self, message):
+        if "opened" in message:
+            self.opened_elsewhere(message["opened"])
+            return
+        room_id, seq = message["room"], message["seq"]
+        if "save" in message:
+            if self.seqs.get(room_id) == seq:
+                # the actor gets to it after the command at seq, so the state is the one right after it
+                self.actor(room_id).submit("save", None, lambda bigroom: self.send(
+                    {"op": "snapshot", "room": room_id, "seq": seq, "state": room_state(bigroom)}))
+            return
+        if message.get("server") == self.server_id:
+            self.unconfirmed.pop(message["id"], None)
+        if seq <= self.seqs.get(room_id, -1):
+            # sent again after a reconnect
+            return
+        self.seqs[room_id] = seq
+        if "state" in message:
+            self.actor(room_id).submit("load", None, lambda bigroom: load_room_state(bigroom, message["state"]))
+        else:
+            self.apply(room_id, message["command"])
+
+    @staticmethod
+    def line(message) -> bytes:
+        return (dumps(message) + "\n").encode()
+
+    def send(self, message):
+        self.outbox.put_nowait(self.line(message))
+
+    def subscription(self, room_id) -> dict:
+        return {"op": "subscribe", "room": room_id, "after": self.seqs.get(room_id, -1)}
+
+    def subscribe(self, room_id):
+        if room_id not in self.subscribed:
+            self.subscribed.add(room_id)
+            self.send(self.subscription(room_id))
+
+    #raises TypeError if the command can't be sent as JSON
+    def publish(self, room_id, command):
+        # checked now, so a held move can't fail when it's sent
+        self.line({"op": "publish", "room": room_id, "command": command})
+        self.subscribe(room_id)
+        if not self.hold(room_id, command):
+            self.release(room_id)
+            self.send_publish(room_id, command)
+
+    #numbers a publish and sends it. it's kept until it comes back
+    def send_publish(self, room_id, command):
+        number = next(self.publish_ids)
+        line = self.unconfirmed[number] = self.line({"op": "publish", "room": room_id, "id": number, "command": command})
+        self.outbox.put_nowait(line)
+
+    #keeps a move_deck action back until the move window ends. a later move of the same deck replaces it
+    #returns True if it was held
+    def hold(self, room_id, command) -> bool:
+        kind, conn_id, *args = command
+        action = args[0] if kind == "action" else None
+        if self.publish_window <= 0 or not isinstance(action, dict) or action.get("action") != "move_deck":
+            return False
+        deck_id = action["args"].get("deck_id") if isinstance(action.get("args"), dict) else None
+        if not isinstance(deck_id, str):
+            return False
+        held = self.held.setdefault(room_id, {})
+        held.pop(deck_id, None)
+        held[deck_id] = command
+        if room_id not in self.timers:
+            self.timers[room_id] = asyncio.get_running_loop().call_later(self.publish_window, self.release, room_id)
+        return True
+
+    #publishes a room's held moves, in the order the decks were last moved
+    def release(self, room_id):
+        timer = self.timers.pop(room_id, None)
+        if timer is not None:
+            timer.cancel()
+        for command in self.held.pop(room_id, {}).values():
+            self.send_publish(room_id, command)
+
+    #tells main.py about a room another server opened
+    def opened_elsewhere(self, room_id):
+        if room_id not in self.opened and self.on_open is not None:
+            self.on_open(room_id)
+
+    def submit(self, room_id, kind, socket, *args):
+        if kind == "open":
+            # the room itself is set up when someone joins. other servers only need the code
+            if room_id not in self.opened:
+                self.opened.add(room_id)
+                self.send({"op": "open", "room": room_id})
+            return
+        if kind in ("watch", "unwatch"):
+            # spectators don't change the room, so other servers don't need to hear about them
+            self.subscribe(room_id)
+            self.actor(room_id).submit(kind, socket, *args)
+            return
+        if kind == "join":
+            conn_id = f"{self.server_id}:{next(self.ids)}"
+            self.conn_ids[socket] = conn_id
+            self.sockets[conn_id] = socket
+        conn_id = self.conn_ids.get(socket)
+        if conn_id is None:
+            return
+        if kind in ("resync", "error"):
+            # only this server has the socket
+            self.actor(room_id).submit(kind, socket, *args)
+            return
+        if kind == "action":
+            # when the frame came in means nothing to other servers, so it isn't published
+            args = (stamp(args[0]),)
+        if kind == "leave":
+            del self.conn_ids[socket]
+        try:
+            self.publish(room_id, [kind, conn_id, *args])
+        except TypeError:
+            self.actor(room_id).submit("error", socket, error_message(None, "invalid_message", "could not decode message"))
+
+    #applies a command in the broker's order
+    def apply(self, room_id, command):
+        kind, conn_id, *args = command
+        socket = self.sockets.get(conn_id)
+        if kind == "leave":
+            self.sockets.pop(conn_id, None)
+        self.actor(room_id).submit(kind, socket, *args)
+
+### Run a broker with: python backends.py [port]
+### then start each server with BROKER=host:port. set BROKER_TOKEN to the same
+### secret on the broker and every server
+if __name__ == "__main__":
+    import os
+    import sys
+
+    async def main():
+        token = os.environ.get("BROKER_TOKEN")
+        broker = Broker("0.0.0.0", int(sys.argv[1]) if len(sys.argv) > 1 else 9000, token)
+        await broker.start()
+        print(f"broker listening on port {broker.port}")
+        if token is None:
+            print("BROKER_TOKEN isn't set. anyone who can reach this port can join any room")
+        print("rooms are only kept in memory. stopping the broker loses every table")
+        await broker.server.serve_forever()
+
+    asyncio.run(main())
@@ -0,0 +1,53 @@
+import asyncio
+import time
+from bigroom import BigRoom
+from broadcast import RoomChannel
+
+### Measures the cost of one action + broadcast as the number of players grows.
+### Run with: python bench_broadcast.py
+
+class NullSocket:
+    async def send_text(self, text):
+        pass
+
+    async def send_json(self, data):
+        pass
+
+def make_room(n_decks=4):
+    bigroom = BigRoom()
+    for i in range(n_decks):
+        bigroom.updateState({"action": "initialize_deck", "args": {"pos": [i * 10, 0]}})
+    return bigroom
+
+#the old loop: serialize the whole room once per socket
+async def per_socket(bigroom, sockets, actions):
+    for action in actions:
+        bigroom.updateState(action)
+        for socket in sockets:
+            await socket.send_json(bigroom.to_wire())
+
+#the broadcast layer: one encode per version, same frame for every socket
+async def per_version(bigroom, sockets, actions):
+    channel = RoomChannel(bigroom)
+    for socket in sockets:
+        channel.add(socket)
+    for action in actions:
+        bigroom.updateState(action)
+        channel.broadcast()
+        # let the writer tasks send
+        await asyncio.sleep(0)
+
+def run(fn, n_players, n_actions=50):
+    bigroom = make_room()
+    sockets = [NullSocket() for _ in range(n_players)]
+    actions = [{"action": "move_deck", "args": {"deck_id": "standard_52_0", "x": i, "y": i}} for i in range(n_actions)]
+    start = time.perf_counter()
+    asyncio.run(fn(bigroom, sockets, actions))
+    return (time.perf_counter() - start) / n_actions
+
+if __name__ == "__main__":
+    print(f"{'players':>8} {'per socket (ms)':>16} {'per version (ms)':>17}")
+    for n_players in [1, 2, 4, 8, 16, 32]:
+        old = run(per_socket, n_players) * 1000
+        new = run(per_version, n_players) * 1000
+        print(f"{n_players:>8} {old:>16.3f} {new:>17.3f}")
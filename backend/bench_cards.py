@@ -0,0 +1,50 @@
+import copy
+import time
+import tracemalloc
+from objects import Card, CardList
+from catalog import CATALOG
+
+### Memory and copy cost of a 52-card deck stored as Card objects vs a CardList.
+### Run with: python bench_cards.py
+
+def card_objects():
+    return [Card(card_front=front, card_back=back) for front, back in (CATALOG.face(p) for p in CATALOG.new_deck("standard52"))]
+
+def card_list():
+    return CardList(codes=CATALOG.new_deck("standard52"))
+
+def memory(make, n=1000):
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    decks = [make() for _ in range(n)]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    total = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    return total / n
+
+def timeit(fn, repeat=2000):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+if __name__ == "__main__":
+    objects, packed = card_objects(), card_list()
+    print(f"{'':>22} {'Card objects':>14} {'CardList':>10}")
+    print(f"{'bytes per deck':>22} {memory(card_objects):>14.0f} {memory(card_list):>10.0f}")
+    print(f"{'build deck (us)':>22} {timeit(card_objects):>14.2f} {timeit(card_list):>10.2f}")
+    print(f"{'deepcopy (us)':>22} {timeit(lambda: copy.deepcopy(objects)):>14.2f} {timeit(lambda: copy.deepcopy(packed)):>10.2f}")
+    print(f"{'remove top 5 (us)':>22} {timeit(lambda: objects[:-5]):>14.2f} {timeit(lambda: packed[:-5]):>10.2f}")
+    print()
+
+    ### Per-action cost should not grow with the deck: draw 5 cards into a
+    ### 100-card hand from decks of growing size
+    from room import Room
+    from objects import Deck, Hand
+    print(f"{'deck size':>22} {'draw 5 (us)':>14} {'add top (us)':>14}")
+    for size in [52, 520, 5200, 52000]:
+        codes = CATALOG.new_deck("standard52") * (size // 52)
+        room = Room(decks={"d": Deck(id="d", cards=CardList(codes=codes))},
+                    hands={"h": Hand(hand_id="h", cards=CardList(codes=codes[:100]))})
+        card = Card(card_front="HA")
+        print(f"{size:>22} {timeit(lambda: room.draw_card('h', 'd', 5)):>14.2f} {timeit(lambda: room.add_top('d', card)):>14.2f}")
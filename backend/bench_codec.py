@@ -0,0 +1,76 @@
+import json
+import time
+from bigroom import BigRoom
+from codec import dumps, loads, orjson
+from dataclasses import dataclass, field
+from dataclasses_serialization.json import JSONSerializer
+from typing import Dict, List
+
+### Compares the hand-written codec against dataclasses_serialization.
+### Run with: python bench_codec.py
+
+# The room as plain dataclasses with lists of cards, the way it was when it was
+# serialized with dataclasses_serialization. Kept here so the old side still
+# runs now that cards are packed in a CardList, which it can't serialize.
+@dataclass
+class OldCard:
+    card_front: str = ""
+    card_back: str = ""
+    face_up: bool = False
+
+@dataclass
+class OldDeck:
+    id: str = ""
+    position: List[int] = field(default_factory=list)
+    cards: List[OldCard] = field(default_factory=list)
+
+@dataclass
+class OldHand:
+    cards: List[OldCard] = field(default_factory=list)
+    hand_id: str = ""
+
+@dataclass
+class OldRoom:
+    players: List[str] = field(default_factory=list)
+    decks: Dict[str, OldDeck] = field(default_factory=dict)
+    hands: Dict[str, OldHand] = field(default_factory=dict)
+
+@dataclass
+class OldBigRoom:
+    players: List[str] = field(default_factory=list)
+    room: OldRoom = field(default_factory=OldRoom)
+    version: int = 0
+
+def make_room(n_decks):
+    bigroom = BigRoom(players=["Evan", "Ben", "Roshan", "Nathan"])
+    for i in range(n_decks):
+        bigroom.updateState({"action": "initialize_deck", "args": {"pos": [i, i]}})
+    return bigroom
+
+def timeit(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1000
+
+#ms per encode and decode, old and new, for each number of decks
+def run(sizes=(1, 10, 100), repeat=300) -> dict:
+    results = {}
+    for n_decks in sizes:
+        bigroom = make_room(n_decks)
+        old = JSONSerializer.deserialize(OldBigRoom, bigroom.to_wire())
+        text = dumps(bigroom.to_wire())
+        times = max(3, repeat // n_decks)
+        results[n_decks] = {
+            "old_encode": timeit(lambda: json.dumps(JSONSerializer.serialize(old), separators=(",", ":")), times),
+            "new_encode": timeit(lambda: dumps(bigroom.to_wire()), times),
+            "old_decode": timeit(lambda: JSONSerializer.deserialize(OldBigRoom, json.loads(text)), times),
+            "new_decode": timeit(lambda: BigRoom.from_wire(loads(text)), times),
+        }
+    return results
+
+if __name__ == "__main__":
+    print(f"backend: {'orjson' if orjson else 'json'}")
+    print(f"{'decks':>6} {'old encode (ms)':>16} {'new encode (ms)':>16} {'old decode (ms)':>16} {'new decode (ms)':>16}")
+    for n_decks, result in run().items():
+        print(f"{n_decks:>6} {result['old_encode']:>16.3f} {result['new_encode']:>16.3f} {result['old_decode']:>16.3f} {result['new_decode']:>16.3f}")
@@ -0,0 +1,69 @@
+import gc
+import sys
+import time
+from actions import stamp
+from bigroom import BigRoom
+
+### Memory kept by undo history. Each kept version is an old Room that shares
+### everything an action didn't touch with the rooms around it, so the cost per
+### version is what the action changed, not the size of the table.
+### Run with: python bench_history.py
+
+DECKS = 20
+ACTIONS = 200
+
+#bytes of every object reachable from the given ones, each object counted once
+def retained_bytes(*roots) -> int:
+    seen = set()
+    stack = list(roots)
+    total = 0
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, type) or type(obj).__name__ in ("module", "function"):
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        stack.extend(gc.get_referents(obj))
+    return total
+
+def actions(n, decks=DECKS):
+    for i in range(n):
+        deck_id = f"standard_52_{i % decks}"
+        match i % 4:
+            case 0:
+                yield stamp({"action": "shuffle", "args": {"deck_id": deck_id}})
+            case 1:
+                yield {"action": "move_deck", "args": {"deck_id": deck_id, "x": i, "y": i}}
+            case 2:
+                yield {"action": "flip_deck", "args": {"deck_id": deck_id}}
+            case 3:
+                yield {"action": "flip_deck_card", "args": {"deck_id": deck_id, "idx": i % 52}}
+
+def run(n=ACTIONS, decks=DECKS) -> dict:
+    bigroom = BigRoom()
+    for i in range(decks):
+        bigroom.updateState({"action": "initialize_deck", "args": {"pos": [i * 10, 0]}})
+    bigroom.history.reset(bigroom.version)
+    for action in actions(n, decks):
+        bigroom.updateState(action)
+
+    kept = len(bigroom.history.past)
+    room_bytes = retained_bytes(bigroom.room)
+    with_history = retained_bytes(bigroom.room, list(bigroom.history.past))
+    start = time.perf_counter()
+    for _ in range(kept):
+        bigroom.updateState({"action": "undo"})
+    undo_seconds = (time.perf_counter() - start) / kept
+    return {
+        "kept": kept,
+        "room_bytes": room_bytes,
+        "bytes_per_version": (with_history - room_bytes) / kept,
+        "undo_seconds": undo_seconds,
+    }
+
+if __name__ == "__main__":
+    result = run()
+    print(f"{result['kept']} versions kept, {DECKS} decks of 52")
+    print(f"one room           {result['room_bytes']:>10} bytes (what a deep copy per version would cost)")
+    print(f"per kept version   {result['bytes_per_version']:>10.0f} bytes")
+    print(f"undo               {result['undo_seconds'] * 1e6:>10.1f} us")
@@ -0,0 +1,316 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+import websockets
+
+### End to end load test. Starts the server (or uses one that's already running),
+### fills R rooms with P players each and has every player play like a person
+### would: drag their deck around, shuffle it, draw and play cards, split it and
+### merge it back. Reports action to broadcast latency, messages per second and
+### the server's CPU time.
+### Run with: python bench_load.py --rooms 50 --players 4 --seconds 30
+### The server is set up from the environment like main.py, e.g.
+### SHARDS=4 python bench_load.py runs it on 4 shards.
+###
+### Every player only touches its own deck and hand, so the first broadcast that
+### changes them after an action was sent is that action's. Each player has one
+### action in flight at a time and waits a random think time (1 / RATE on average)
+### before the next. Latency is measured from sending an action to receiving it back.
+
+ROOMS = 10
+PLAYERS = 4
+SECONDS = 10
+RATE = 5
+# how long a player waits for its action to come back before counting a timeout
+TIMEOUT = 10
+# share of each kind of action. "draw" draws a card while the hand has fewer
+# than HAND_SIZE cards and plays one back onto the deck after that
+MIX = {"drag": 0.5, "shuffle": 0.2, "draw": 0.2, "split": 0.1}
+HAND_SIZE = 5
+# each player's deck stays in its own AREA x AREA square of the table
+AREA = 1000
+
+class Player:
+    #arg1 server url, like ws://127.0.0.1:8000
+    #arg2 room code
+    #arg3 index of the player in the room. it owns deck standard_52_{index} and hand empty_{index}
+    def __init__(self, url, room_id, index, mode, rng):
+        self.url = f"{url}/ws/{room_id}?mode={mode}"
+        self.name = f"p{index}"
+        self.deck = f"standard_52_{index}"
+        self.split = self.deck + "_copy"
+        self.hand = f"empty_{index}"
+        self.origin = [AREA * index, 0]
+        self.rng = rng
+        # wire form of each pile this player owns, None if it doesn't exist
+        self.piles = {self.deck: None, self.split: None, self.hand: None}
+        self.done = asyncio.Event()
+        self.frames = 0
+        self.errors = 0
+
+    async def connect(self):
+        self.ws = await websockets.connect(self.url, max_size=None)
+        await self.ws.send(self.name)
+        self.apply(json.loads(await self.ws.recv()))
+        self.reader = asyncio.create_task(self.read())
+
+    async def close(self):
+        self.reader.cancel()
+        await self.ws.close()
+
+    #counts every frame and wakes up the sender when its action comes back
+    async def read(self):
+        try:
+            async for frame in self.ws:
+                self.frames += 1
+                message = json.loads(frame)
+                if message.get("type") == "error":
+                    self.errors += 1
+                    self.done.set()
+                elif self.apply(message):
+                    self.done.set()
+        except websockets.ConnectionClosed:
+            pass
+
+    #updates this player's piles from a full state, snapshot or patch
+    #returns True if any of them changed
+    def apply(self, message) -> bool:
+        kind = message.get("type")
+        if kind == "patch":
+            changed = False
+            for key in ("decks", "hands"):
+                for pile_id, pile in message.get(key, {}).items():
+                    if pile_id in self.piles:
+                        self.piles[pile_id] = pile
+                        changed = True
+            for pile_id, position in message.get("deck_moves", {}).items():
+                if pile_id in self.piles:
+                    self.piles[pile_id] = dict(self.piles[pile_id], position=position)
+                    changed = True
+            return changed
+        room = (message["state"] if kind == "snapshot" else message)["room"]
+        piles = {pile_id: room["decks"].get(pile_id, room["hands"].get(pile_id)) for pile_id in self.piles}
+        changed = piles != self.piles
+        self.piles = piles
+        return changed
+
+    #sends an action and waits for it to come back. returns the latency, or None on a timeout
+    async def act(self, message):
+        self.done.clear()
+        start = time.perf_counter()
+        await self.ws.send(json.dumps(message))
+        try:
+            await asyncio.wait_for(self.done.wait(), TIMEOUT)
+        except asyncio.TimeoutError:
+            return None
+        return time.perf_counter() - start
+
+    def position(self):
+        return [self.origin[0] + self.rng.uniform(0, AREA - 200), self.origin[1] + self.rng.uniform(0, AREA - 200)]
+
+    #sets up this player's deck and hand. players of a room have to do this one at a time
+    #the deck is turned face up so a shuffle of it shows up in the frames the player gets back
+    async def setup(self):
+        await self.act({"action": "initialize_deck", "args": {"pos": self.position()}})
+        await self.act({"action": "flip_deck", "args": {"deck_id": self.deck}})
+        await self.act({"action": "initialize_hand", "args": {"owner": self.name}})
+
+    #the next action and what kind it is
+    def next_action(self):
+        deck, hand = self.piles[self.deck], self.piles[self.hand]
+        if self.piles[self.split] is not None:
+            return "merge", {"action": "merge_decks", "args": {"dragged_deck_id": self.split, "target_deck_id": self.deck}}
+        kind = self.rng.choices(list(MIX), weights=list(MIX.values()))[0]
+        if kind == "drag":
+            x, y = self.position()
+            return kind, {"action": "move_deck", "args": {"deck_id": self.deck, "x": x, "y": y}}
+        if kind == "shuffle":
+            return kind, {"action": "shuffle", "args": {"deck_id": self.deck}}
+        if kind == "draw":
+            if len(hand["cards"]) < HAND_SIZE and len(deck["cards"]) > 1:
+                return kind, {"action": "draw_card", "args": {"hand_id": self.hand, "deck_id": self.deck}}
+            return "play", {"action": "batch", "args": {"actions": [
+                {"action": "remove_nth", "args": {"hand_id": self.hand, "n": 0}},
+                {"action": "add_top", "args": {"deck_id": self.deck, "card": hand["cards"][0]}},
+            ]}}
+        n = self.rng.randint(1, len(deck["cards"]) - 1)
+        return kind, {"action": "split_deck", "args": {"deck_id": self.deck, "n": n, "pos": self.position()}}
+
+    #plays until the deadline. returns {kind: [latencies]} and the number of timeouts
+    async def play(self, rate, deadline):
+        latencies = {}
+        timeouts = 0
+        while True:
+            await asyncio.sleep(self.rng.expovariate(rate))
+            if time.perf_counter() >= deadline:
+                break
+            kind, message = self.next_action()
+            latency = await self.act(message)
+            if latency is None:
+                timeouts += 1
+            else:
+                latencies.setdefault(kind, []).append(latency)
+        return latencies, timeouts
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100 * len(values)))] if values else None
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def wait_for(url, timeout=15):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            urllib.request.urlopen(url + "/").read()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+def create_room(url) -> str:
+    with urllib.request.urlopen(url + "/create-room") as response:
+        return json.loads(response.read())["code"]
+
+# CPU time of a server process and its workers, from /proc. None where there is no /proc
+def process_cpu(pid):
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            children = [int(child) for child in f.read().split()]
+    except OSError:
+        return None
+    total = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    return total + sum(process_cpu(child) or 0 for child in children)
+
+class LocalServer:
+    #runs main:app with uvicorn in a separate process
+    def __init__(self):
+        self.port = free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--port", str(self.port), "--log-level", "warning"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        )
+        wait_for(self.url)
+
+    def cpu(self):
+        return process_cpu(self.process.pid)
+
+    def stop(self):
+        self.process.terminate()
+        self.process.wait()
+
+class ThreadServer:
+    #runs main:app with uvicorn on a thread of this process. quicker to start, but shares the GIL with the players
+    def __init__(self):
+        import uvicorn
+        from main import app
+        self.port = free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.server = uvicorn.Server(uvicorn.Config(app, port=self.port, log_level="warning"))
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+        self.thread.start()
+        wait_for(self.url)
+
+    def cpu(self):
+        return time.clock_gettime(time.pthread_getcpuclockid(self.thread.ident))
+
+    def stop(self):
+        self.server.should_exit = True
+        self.thread.join()
+
+class RemoteServer:
+    #a server that's already running. its CPU time isn't known
+    def __init__(self, url):
+        self.url = url.rstrip("/")
+
+    def cpu(self):
+        return None
+
+    def stop(self):
+        pass
+
+#arg1 server to load, like LocalServer(). stopped at the end
+#returns the numbers printed by report
+async def load(server, rooms=ROOMS, players=PLAYERS, seconds=SECONDS, rate=RATE, mode="delta", seed=0):
+    rng = random.Random(seed)
+    ws_url = "ws" + server.url[len("http"):]
+    room_players = []
+    try:
+        for _ in range(rooms):
+            room_id = create_room(server.url)
+            group = [Player(ws_url, room_id, i, mode, random.Random(rng.random())) for i in range(players)]
+            for player in group:
+                await player.connect()
+                await player.setup()
+            room_players.append(group)
+        everyone = [player for group in room_players for player in group]
+        frames = sum(player.frames for player in everyone)
+        cpu = server.cpu()
+        start = time.perf_counter()
+        results = await asyncio.gather(*(player.play(rate, start + seconds) for player in everyone))
+        elapsed = time.perf_counter() - start
+        frames = sum(player.frames for player in everyone) - frames
+        cpu = None if cpu is None else server.cpu() - cpu
+        for player in everyone:
+            await player.close()
+    finally:
+        server.stop()
+
+    latencies = {}
+    for kinds, _ in results:
+        for kind, values in kinds.items():
+            latencies.setdefault(kind, []).extend(values)
+    every = [value for values in latencies.values() for value in values]
+    return {
+        "rooms": rooms,
+        "players": players,
+        "seconds": elapsed,
+        "actions": len(every),
+        "actions_per_sec": len(every) / elapsed,
+        "messages_per_sec": frames / elapsed,
+        "timeouts": sum(timeouts for _, timeouts in results),
+        "errors": sum(player.errors for player in everyone),
+        "server_cpu": cpu,
+        "latency": {kind: {p: percentile(values, p) for p in (50, 95, 99)} for kind, values in [("all", every), *sorted(latencies.items())]},
+    }
+
+def report(results):
+    print(f"{results['rooms']} rooms x {results['players']} players for {results['seconds']:.1f}s")
+    print(f"{results['actions']} actions, {results['actions_per_sec']:.0f} actions/s, {results['messages_per_sec']:.0f} messages/s, "
+          f"{results['timeouts']} timeouts, {results['errors']} errors")
+    if results["server_cpu"] is not None:
+        print(f"server CPU {results['server_cpu']:.2f}s ({100 * results['server_cpu'] / results['seconds']:.0f}% of a core)")
+    print(f"{'action':>8} {'p50 (ms)':>9} {'p95 (ms)':>9} {'p99 (ms)':>9}")
+    for kind, ps in results["latency"].items():
+        if ps[50] is not None:
+            print(f"{kind:>8} {ps[50] * 1e3:>9.2f} {ps[95] * 1e3:>9.2f} {ps[99] * 1e3:>9.2f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="End to end load test")
+    parser.add_argument("--rooms", type=int, default=ROOMS)
+    parser.add_argument("--players", type=int, default=PLAYERS, help="players per room")
+    parser.add_argument("--seconds", type=float, default=SECONDS)
+    parser.add_argument("--rate", type=float, default=RATE, help="actions per second per player, on average")
+    parser.add_argument("--mode", choices=["delta", "full"], default="delta")
+    parser.add_argument("--url", help="load a server that's already running, like http://127.0.0.1:8000")
+    parser.add_argument("--in-process", action="store_true", help="run the server on a thread of this process")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = parser.parse_args()
+    server = RemoteServer(args.url) if args.url else ThreadServer() if args.in_process else LocalServer()
+    results = asyncio.run(load(server, args.rooms, args.players, args.seconds, args.rate, args.mode))
+    print(json.dumps(results, indent=2)) if args.json else report(results)
@@ -0,0 +1,66 @@
+import argparse
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+from actions import stamp
+from bigroom import BigRoom
+from persist import RoomLog, WRITER
+
+### Cost of saving rooms: time per action with and without a RoomLog.
+### The log's share of the event loop's time has to stay under TARGET amortized
+### over many actions, snapshots included. fsyncs and snapshot writes are done
+### by the writer thread, and how long it takes to get everything on disk is
+### reported too.
+### Run with: python bench_persist.py [--dir DIR] [--fsync-interval SECONDS]
+### The files go next to this script by default and not in /tmp, which is often
+### a tmpfs where fsync does nothing.
+
+ACTIONS = 20000
+TARGET = 100e-6
+
+def actions(n):
+    yield {"action": "initialize_deck"}
+    yield {"action": "initialize_deck"}
+    for i in range(n - 2):
+        if i % 4 == 0:
+            yield stamp({"action": "shuffle", "args": {"deck_id": f"standard_52_{i % 8 // 4}"}})
+        else:
+            yield {"action": "move_deck", "args": {"deck_id": "standard_52_0", "x": i, "y": i}}
+
+async def per_action(bigroom, n) -> float:
+    messages = list(actions(n))
+    start = time.perf_counter()
+    for i, message in enumerate(messages):
+        bigroom.updateState(message)
+        if i % 100 == 0:
+            # let the group commit timer fire like it would between messages
+            await asyncio.sleep(0)
+    if bigroom.log is not None:
+        bigroom.log.close()
+    return (time.perf_counter() - start) / n
+
+#arg4 where the files go. a new directory next to this script by default
+async def run(n=ACTIONS, fsync_interval=None, snapshot_every=None, parent=None) -> dict:
+    directory = tempfile.mkdtemp(dir=parent or os.path.dirname(os.path.abspath(__file__)))
+    try:
+        settings = {k: v for k, v in (("fsync_interval", fsync_interval), ("snapshot_every", snapshot_every)) if v is not None}
+        plain = await per_action(BigRoom(), n)
+        start = time.perf_counter()
+        logged = await per_action(RoomLog(directory, "bench", **settings).recover(), n)
+        WRITER.drain()
+        on_disk = (time.perf_counter() - start) / n
+    finally:
+        shutil.rmtree(directory)
+    return {"plain": plain, "logged": logged, "overhead": logged - plain, "on disk": on_disk}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cost of saving rooms")
+    parser.add_argument("--dir", help="directory to write in. use one on the disk the server would use")
+    parser.add_argument("--fsync-interval", type=float, help="seconds between fsyncs. 0 syncs after every action")
+    args = parser.parse_args()
+    result = asyncio.run(run(fsync_interval=args.fsync_interval, parent=args.dir))
+    for name, seconds in result.items():
+        print(f"{name:>10} {seconds * 1e6:>8.1f} us/action")
+    print("ok" if result["overhead"] < TARGET else f"over the {TARGET * 1e6:.0f} us target")
@@ -0,0 +1,67 @@
+import time
+from room import Room
+from objects import Deck, Hand, Card, CardList
+from catalog import CATALOG
+
+### Cost of each Room operation on 52, 520 and 5200 card decks.
+### Run with: python bench_room.py
+### test_bench_room.py uses the same numbers to catch operations that start
+### copying whole decks again.
+
+SIZES = [52, 520, 5200]
+
+#a room with a "main" deck of the given size, a 52 card "other" deck and a 10 card hand
+def make_room(size) -> Room:
+    codes = CATALOG.new_deck("standard52") * (size // 52)
+    return Room(
+        players=["Evan"],
+        decks={
+            "main": Deck(id="main", position=[0, 0], cards=CardList(codes=codes)),
+            "other": Deck(id="other", position=[200, 0], cards=CardList(codes=CATALOG.new_deck("standard52"))),
+        },
+        hands={"h": Hand(hand_id="h", cards=CardList(codes=codes[:10]))},
+    )
+
+CARD = Card(card_front="HA")
+
+OPERATIONS = {
+    "draw_card": lambda room: room.draw_card("h", "main", 5),
+    "draw_card bottom": lambda room: room.draw_card("h", "main", 5, True),
+    "split_deck": lambda room: room.split_deck("main", 10, [50, 50]),
+    "shuffle": lambda room: room.shuffle("main"),
+    "remove_top": lambda room: room.remove_top("main", 5),
+    "add_top": lambda room: room.add_top("main", CARD),
+    "flip_deck_card": lambda room: room.flip_deck_card("main", len(room.decks["main"].cards) // 2),
+    "flip_deck": lambda room: room.flip_deck("main"),
+    "move_deck": lambda room: room.move_deck("main", 10, 10),
+    "merge_decks": lambda room: room.merge_decks("other", "main"),
+    "remove_card_from_deck": lambda room: room.remove_card_from_deck("main", len(room.decks["main"].cards) // 2),
+    "combine_cards_into_deck": lambda room: room.combine_cards_into_deck("main", 3, "other", 0),
+    "remove_nth": lambda room: room.remove_nth("h", 3),
+    "add_card_to_hand": lambda room: room.add_card_to_hand("h", CARD),
+    "flip_hand_card": lambda room: room.flip_hand_card("h", 3),
+}
+
+# these have to look at every card, so they are expected to grow with the deck
+LINEAR = {"shuffle"}
+
+#best time of a few runs, in microseconds per call
+def measure(operation, room, repeat=200, runs=5) -> float:
+    best = float("inf")
+    for _ in range(runs):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            operation(room)
+        best = min(best, (time.perf_counter() - start) / repeat)
+    return best * 1e6
+
+#returns {operation name: {deck size: microseconds}}
+def run(sizes=SIZES, repeat=200, operations=OPERATIONS) -> dict:
+    rooms = {size: make_room(size) for size in sizes}
+    return {name: {size: measure(op, rooms[size], repeat) for size in sizes} for name, op in operations.items()}
+
+if __name__ == "__main__":
+    results = run()
+    print(f"{'operation':>24}" + "".join(f"{str(size) + ' (us)':>12}" for size in SIZES))
+    for name, times in results.items():
+        print(f"{name:>24}" + "".join(f"{times[size]:>12.2f}" for size in SIZES))
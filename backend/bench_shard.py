@@ -0,0 +1,51 @@
+import asyncio
+import os
+import time
+from shard import ShardRouter, ProcessShard
+
+### Throughput of CPU heavy rooms with 1 shard vs one shard per core.
+### Every room builds 20 decks and shuffles them over and over.
+### Run with: python bench_shard.py
+
+ROOMS = 16
+SHUFFLES = 100
+
+class CountingSocket:
+    def __init__(self):
+        self.frames = 0
+
+    async def send_text(self, text):
+        self.frames += 1
+
+    async def send_bytes(self, data):
+        self.frames += 1
+
+    async def close(self, code=1000):
+        pass
+
+async def run(shards) -> float:
+    router = ShardRouter(shards, make_shard=ProcessShard, max_queue=10**6, send_queue_size=10**6)
+    router.start()
+    sockets = []
+    for i in range(ROOMS):
+        socket = CountingSocket()
+        sockets.append(socket)
+        router.submit(f"room{i}", "join", socket, "bench", "full", "json")
+        for _ in range(20):
+            router.submit(f"room{i}", "action", socket, {"action": "initialize_deck"})
+    expected = 1 + 20 + SHUFFLES
+    await asyncio.sleep(1)
+    start = time.perf_counter()
+    for n in range(SHUFFLES):
+        for i, socket in enumerate(sockets):
+            router.submit(f"room{i}", "action", socket, {"action": "shuffle", "args": {"deck_id": f"standard_52_{n % 20}"}})
+    while any(socket.frames < expected for socket in sockets):
+        await asyncio.sleep(0.005)
+    elapsed = time.perf_counter() - start
+    router.stop()
+    return ROOMS * SHUFFLES / elapsed
+
+if __name__ == "__main__":
+    cores = os.cpu_count() or 1
+    for shards in sorted({1, 2, cores}):
+        print(f"{shards:>3} shards {asyncio.run(run(shards)):>10.0f} actions/s")
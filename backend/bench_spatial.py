@@ -0,0 +1,50 @@
+import random
+import time
+from catalog import CATALOG
+from objects import Deck, CardList
+from room import Room
+
+### Finding the deck under a point with the grid vs looking at every deck,
+### as tables grow to hundreds of piles.
+### Run with: python bench_spatial.py
+
+SIZES = [10, 100, 1000]
+QUERIES = 2000
+
+def make_room(n, rng) -> Room:
+    codes = CATALOG.new_deck("standard52")
+    decks = {
+        f"d{i}": Deck(id=f"d{i}", position=[rng.uniform(0, 4000), rng.uniform(0, 4000)], cards=CardList(codes=codes[:rng.randint(1, 52)]))
+        for i in range(n)
+    }
+    return Room(decks=decks)
+
+#every deck's box, top deck first. what a client without an index does
+def scan(room, x, y):
+    for deck_id, deck in reversed(room.decks.items()):
+        left, top = deck.position
+        spread = 2 * (len(deck.cards) - 1)
+        if left <= x <= left + 120 + spread and top <= y <= top + 168 + spread:
+            return deck_id
+    return None
+
+def run(sizes=SIZES, queries=QUERIES) -> dict:
+    rng = random.Random(1)
+    results = {}
+    for n in sizes:
+        room = make_room(n, rng)
+        points = [(rng.uniform(0, 4000), rng.uniform(0, 4000)) for _ in range(queries)]
+        start = time.perf_counter()
+        for x, y in points:
+            room.deck_at(x, y)
+        grid = (time.perf_counter() - start) / queries
+        start = time.perf_counter()
+        for x, y in points:
+            scan(room, x, y)
+        results[n] = {"grid": grid, "scan": (time.perf_counter() - start) / queries}
+    return results
+
+if __name__ == "__main__":
+    print(f"{'decks':>6} {'grid (us)':>10} {'scan (us)':>10}")
+    for n, times in run().items():
+        print(f"{n:>6} {times['grid'] * 1e6:>10.2f} {times['scan'] * 1e6:>10.2f}")
@@ -0,0 +1,245 @@
+from delta import DeltaTracker, make_snapshot
+from codec import encode
+from projection import ALL, PUBLIC, hand_owners, view_class, project_message
+from metrics import ENCODE_SECONDS, FRAME_BYTES, BROADCAST_SECONDS, FRAMES_DROPPED, SLOW_DISCONNECTS
+from collections import deque
+import asyncio
+import time
+import tracing
+
+# Slow consumer policies
+# "latest": when a socket's queue is full, drop everything queued and send the
+#           current state once the socket catches up
+# "disconnect": when a socket's queue is full, close it
+SEND_QUEUE_SIZE = 32
+SLOW_CLIENT_POLICY = "latest"
+
+# patches kept per room for delta sockets that reconnect and resume
+PATCH_HISTORY = 256
+
+# marks a queue slot that is filled with the current state at write time
+RESYNC = object()
+
+# One socket's outbound side. Frames are queued without waiting and a writer
+# task drains the queue, so a slow client only ever delays itself.
+class Connection:
+    def __init__(self, socket, mode, encoding, resync, max_queue=SEND_QUEUE_SIZE, policy=SLOW_CLIENT_POLICY, viewer=None):
+        self.socket = socket
+        self.mode = mode
+        self.encoding = encoding
+        # player name the room is projected for, or None to send everything (see projection.py)
+        self.viewer = viewer
+        self.resync = resync
+        self.max_queue = max_queue
+        self.policy = policy
+        self.queue = deque()
+        self.ready = asyncio.Event()
+        self.closed = False
+        self.dropped = 0
+        self.skip_through = -1
+        self.task = asyncio.create_task(self.writer())
+
+    #queues a frame for the socket. never blocks
+    #arg1 room version the frame is for, or None for frames that are never skipped
+    #arg2 encoded frame (text or bytes), or RESYNC to send whatever the state is at write time
+    def send(self, version, frame):
+        if self.closed:
+            return
+        if len(self.queue) >= self.max_queue:
+            if self.policy == "disconnect":
+                SLOW_DISCONNECTS.inc()
+                self.close(code=1013)
+                return
+            self.dropped += len(self.queue)
+            FRAMES_DROPPED.inc(amount=len(self.queue))
+            self.queue.clear()
+            frame = RESYNC
+        self.queue.append((version, frame))
+        self.ready.set()
+
+    async def writer(self):
+        try:
+            while True:
+                while not self.queue:
+                    self.ready.clear()
+                    await self.ready.wait()
+                version, frame = self.queue.popleft()
+                if frame is RESYNC:
+                    # frames queued behind this that are older than the state we send are skipped.
+                    # a patch to the same version is already in the snapshot too
+                    version, frame = self.resync()
+                    self.skip_through = version
+                elif version is None:
+                    pass
+                elif version < self.skip_through:
+                    continue
+                elif version == self.skip_through and self.mode == "delta":
+                    continue
+                if isinstance(frame, bytes):
+                    await self.socket.send_bytes(frame)
+                else:
+                    await self.socket.send_text(frame)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # the socket is gone. the receive loop cleans up the player
+            self.closed = True
+
+    def close(self, code=None):
+        if self.closed:
+            return
+        self.closed = True
+        self.task.cancel()
+        if code is not None:
+            asyncio.create_task(self.socket.close(code=code))
+
+#encodes a message, timing it and recording its size for /metrics
+#arg3 "full", "snapshot" or "patch"
+def encode_frame(message, encoding, kind) -> str | bytes:
+    start = time.perf_counter()
+    frame = encode(message, encoding)
+    elapsed = time.perf_counter() - start
+    ENCODE_SECONDS.observe(elapsed, kind, encoding)
+    if tracing.current is not None:
+        tracing.current.add("encode", elapsed)
+    # bytes on the wire. JSON is sent as UTF-8, one byte per character unless it has non-ASCII text
+    FRAME_BYTES.observe(len(frame) if not isinstance(frame, str) or frame.isascii() else len(frame.encode()), kind, encoding)
+    return frame
+
+# Everything needed to push one room's state out to its sockets.
+# Frames are encoded once per room version, encoding and visibility class, and
+# the same frame is queued on every socket, so a broadcast costs one
+# serialization per encoding and class in use no matter how many players are
+# connected, and never waits on any of them.
+class RoomChannel:
+    #arg4 number of recent patches kept for resuming. default PATCH_HISTORY
+    def __init__(self, bigroom, max_queue=SEND_QUEUE_SIZE, policy=SLOW_CLIENT_POLICY, history=PATCH_HISTORY):
+        self.bigroom = bigroom
+        self.max_queue = max_queue
+        self.policy = policy
+        self.connections = {}
+        self.tracker = DeltaTracker(bigroom)
+        self.frames_version = None
+        self.frames = {}
+        # (patch, {encoding: frame}) for each broadcast, oldest first. each patch's base is the version of the one before
+        self.history = deque(maxlen=history)
+
+    #registers a socket and queues its first frame
+    #arg1 websocket
+    #arg2 "full" or "delta"
+    #arg3 "json" or "msgpack"
+    #arg4 optional. (epoch, version) a reconnecting delta socket last saw. it gets the
+    #     patches it missed instead of a snapshot, if they are from this epoch and still kept
+    #arg5 optional. player name to only send what that player can see. default None sends everything
+    #max_queue and policy default to the channel's
+    def add(self, socket, mode="full", encoding="json", resume=None, viewer=None, max_queue=None, policy=None):
+        connection = Connection(socket, mode, encoding, lambda: self.initial_frame(connection),
+                                max_queue or self.max_queue, policy or self.policy, viewer)
+        self.connections[socket] = connection
+        missed = self.patches_since(*resume) if mode == "delta" and resume is not None else None
+        if missed is None:
+            connection.send(*self.initial_frame(connection))
+        else:
+            cls = view_class(hand_owners(self.bigroom.room), viewer)
+            for patch, frames in missed:
+                connection.send(patch["version"], self.patch_frame(frames, patch, encoding, cls))
+        return connection
+
+    #the kept patches that take a client from a version to the last broadcast one.
+    #changes since then reach it with the next broadcast like every other socket
+    #returns None if they aren't all kept anymore, or the version isn't one this room had in this epoch
+    def patches_since(self, epoch, version) -> list | None:
+        if epoch != self.tracker.epoch:
+            return None
+        if version == self.tracker.version:
+            return []
+        for i, (patch, _) in enumerate(self.history):
+            if patch["base"] == version:
+                return list(self.history)[i:]
+        return None
+
+    def record(self, patch):
+        if patch is not None:
+            self.history.append((patch, {}))
+
+    #a patch encoded for one encoding and visibility class, cached in frames
+    @staticmethod
+    def patch_frame(frames, patch, encoding, cls=ALL) -> str | bytes:
+        key = (encoding, cls)
+        if key not in frames:
+            frames[key] = encode_frame(project_message(patch, cls), encoding, "patch")
+        return frames[key]
+
+    #registers a spectator. it gets the public view in full mode and only ever waits on
+    #the latest state: a frame that comes in while one is queued replaces it
+    #arg2 "json" or "msgpack"
+    def watch(self, socket, encoding="json"):
+        return self.add(socket, "full", encoding, viewer=PUBLIC, max_queue=1, policy="latest")
+
+    def remove(self, socket):
+        self.connections.pop(socket).close()
+
+    #queues the current state for a socket that asked for a resync
+    def resync(self, socket):
+        connection = self.connections[socket]
+        connection.send(*self.initial_frame(connection))
+
+    #for when the room was replaced by one saved elsewhere. the versions sockets have
+    #may mean something else now, so a new epoch starts and every socket gets the current state
+    def reload(self):
+        self.tracker = DeltaTracker(self.bigroom)
+        self.history.clear()
+        self.frames_version = None
+        for socket in self.connections:
+            self.resync(socket)
+
+    #queues a message for one socket only, like an error for the client that sent a bad action
+    #does nothing if the socket has left
+    def send_to(self, socket, message):
+        connection = self.connections.get(socket)
+        if connection is not None:
+            connection.send(None, encode(message, connection.encoding))
+
+    #full state ("full") or snapshot ("delta") frame for the current version, as a visibility class sees it
+    #cached until the room changes
+    def frame(self, mode="full", encoding="json", cls=ALL) -> str | bytes:
+        if self.frames_version != self.bigroom.version:
+            self.frames = {}
+            self.frames_version = self.bigroom.version
+        key = (mode, encoding, cls)
+        if key not in self.frames:
+            if mode == "delta":
+                self.frames[key] = encode_frame(project_message(make_snapshot(self.bigroom, self.tracker.epoch), cls), encoding, "snapshot")
+            else:
+                self.frames[key] = encode_frame(project_message(self.bigroom.to_wire(), cls), encoding, "full")
+        return self.frames[key]
+
+    def full_frame(self) -> str:
+        return self.frame("full")
+
+    #version and frame a connection gets when it joins or falls behind
+    def initial_frame(self, connection) -> tuple[int, str | bytes]:
+        return self.bigroom.version, self.frame(connection.mode, connection.encoding, view_class(hand_owners(self.bigroom.room), connection.viewer))
+
+    #queues the latest state on every socket
+    #delta sockets get a patch since the last broadcast, the rest get the full state
+    #arg1 bool for if full state sockets should be sent to. default True
+    #patches are made even with no delta sockets, so sockets that reconnect can resume
+    def broadcast(self, to_full=True):
+        start = time.perf_counter()
+        version = self.bigroom.version
+        patch = self.tracker.advance(self.bigroom)
+        self.record(patch)
+        patch_frames = self.history[-1][1] if patch is not None else None
+        owners = hand_owners(self.bigroom.room)
+        for connection in list(self.connections.values()):
+            cls = view_class(owners, connection.viewer)
+            if connection.mode == "delta":
+                if patch is not None:
+                    connection.send(version, self.patch_frame(patch_frames, patch, connection.encoding, cls))
+            elif to_full:
+                connection.send(version, self.frame("full", connection.encoding, cls))
+        elapsed = time.perf_counter() - start
+        BROADCAST_SECONDS.observe(elapsed)
+        if tracing.current is not None:
+            tracing.current.set("fanout", elapsed - tracing.current.spans.get("encode", 0.0))
@@ -0,0 +1,70 @@
+from array import array
+import sys
+
+# Interns card faces. A face is a (card_front, card_back) pair and gets a small
+# int code the first time it is seen. Decks and hands store each card as one
+# packed int, (code << 1) | face_up, instead of a Card object with two strings.
+#
+# Codes are shared by every room in the process and are never freed, since any
+# room or kept undo state may still hold them. So the catalog is bounded: at
+# most MAX_FACES faces with sides of at most MAX_FACE_LENGTH characters. Once
+# it is full, cards with faces it hasn't seen are turned away.
+MAX_FACES = 65536
+MAX_FACE_LENGTH = 64
+# approximate bytes a face takes besides its strings: the tuple, the dict entry and the list slot
+FACE_BYTES = 180
+
+class CatalogFull(ValueError):
+    pass
+
+class CardCatalog:
+    #arg1 most faces kept. default MAX_FACES
+    def __init__(self, max_faces=MAX_FACES):
+        self.max_faces = max_faces
+        self.codes = {}
+        self.faces = []
+        self.deck_types = {}
+        # approximate memory taken by the faces
+        self.bytes = 0
+
+    #returns the code for a face, adding it if it's new
+    #raises ValueError if a side is too long, CatalogFull if there's no room for a new face
+    def code(self, card_front: str, card_back: str = "") -> int:
+        face = (card_front, card_back)
+        code = self.codes.get(face)
+        if code is None:
+            if len(card_front) > MAX_FACE_LENGTH or len(card_back) > MAX_FACE_LENGTH:
+                raise ValueError(f"card faces can be at most {MAX_FACE_LENGTH} characters")
+            if len(self.faces) >= self.max_faces:
+                raise CatalogFull(f"no room for more than {self.max_faces} different cards")
+            code = self.codes[face] = len(self.faces)
+            self.faces.append(face)
+            self.bytes += FACE_BYTES + sys.getsizeof(card_front) + sys.getsizeof(card_back)
+        return code
+
+    def pack(self, card_front: str, card_back: str = "", face_up: bool = False) -> int:
+        return (self.code(card_front, card_back) << 1) | (1 if face_up else 0)
+
+    #returns the (card_front, card_back) of a packed card
+    def face(self, packed: int) -> tuple:
+        return self.faces[packed >> 1]
+
+    #registers the cards a deck type starts with, all face down
+    #arg1 name of deck type
+    #arg2 list of (card_front, card_back) from bottom to top
+    def add_deck_type(self, deck_type: str, faces):
+        self.deck_types[deck_type] = array("I", (self.pack(front, back) for front, back in faces))
+
+    #returns a fresh packed array for a new deck of this type
+    def new_deck(self, deck_type: str) -> array:
+        return array("I", self.deck_types[deck_type])
+
+def rank_to_str(rank):
+    return {11: "J", 12: "Q", 13: "K", 14: "A"}.get(rank, str(rank))
+
+CATALOG = CardCatalog()
+CATALOG.add_deck_type("standard52", [
+    (suit + rank_to_str(rank), "")
+    for rank in range(2, 15)
+    for suit in ["H", "D", "S", "C"]
+])
@@ -0,0 +1,58 @@
+import asyncio
+
+# How long move_deck actions are held so a drag becomes one update, in seconds.
+# 0 applies every move as it comes in
+MOVE_WINDOW = 0.025
+
+# Holds move_deck actions for a short window and applies only the latest
+# position for each deck, so a client streaming pointer moves costs one room
+# copy and one broadcast per window instead of one per event. Any other action
+# flushes the held moves first so actions still apply in the order they came.
+class MoveCoalescer:
+    #arg1 BigRoom
+    #arg2 RoomChannel for the room, used to broadcast and to send errors
+    #arg3 window in seconds. default MOVE_WINDOW
+    #arg4 optional. called when the window ends instead of tick, for owners that want to run tick themselves
+    def __init__(self, bigroom, channel, window=MOVE_WINDOW, on_tick=None):
+        self.bigroom = bigroom
+        self.channel = channel
+        self.window = window
+        self.on_tick = on_tick or self.tick
+        self.pending = {}
+        self.timer = None
+
+    #holds the action if it is a move. returns True if it was taken
+    #arg1 socket that sent it, for errors
+    #arg2 action message
+    def add(self, socket, action) -> bool:
+        if self.window <= 0 or not isinstance(action, dict) or action.get("action") != "move_deck":
+            return False
+        args = action.get("args")
+        if not isinstance(args, dict) or not isinstance(args.get("deck_id"), str):
+            return False
+        # the latest move goes to the back so decks are moved in the order they were last dragged
+        self.pending.pop(args["deck_id"], None)
+        self.pending[args["deck_id"]] = (socket, action)
+        if self.timer is None:
+            self.timer = asyncio.get_running_loop().call_later(self.window, self.on_tick)
+        return True
+
+    #applies the held moves. returns True if the room changed
+    def flush(self) -> bool:
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if not self.pending:
+            return False
+        pending, self.pending = self.pending, {}
+        version = self.bigroom.version
+        for socket, action in pending.values():
+            error = self.bigroom.updateState(action)
+            if error is not None:
+                self.channel.send_to(socket, error)
+        return self.bigroom.version != version
+
+    def tick(self):
+        self.timer = None
+        if self.flush():
+            self.channel.broadcast()
@@ -0,0 +1,138 @@
+import json
+
+# Encoding for messages sent over the websocket. Rooms are turned into plain
+# dicts by their to_wire methods, then dumped here. orjson is used when it is
+# installed, otherwise the standard library. Both produce the same compact
+# JSON that WebSocket.send_json would.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# msgpack is in requirements.txt. a server without it still runs and every client gets JSON
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+if orjson is not None:
+    #orjson refuses some values the standard library takes, like ints over 64
+    #bits. those messages go through the standard library instead of failing
+    def dumps(message) -> str:
+        try:
+            return orjson.dumps(message).decode()
+        except TypeError:
+            return json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+
+    def loads(text):
+        return orjson.loads(text)
+else:
+    def dumps(message) -> str:
+        return json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+
+    def loads(text):
+        return json.loads(text)
+
+ENCODINGS = ["json", "msgpack"] if msgpack is not None else ["json"]
+
+#picks the encoding for a new connection
+#arg1 encoding asked for in the query string, or None
+#arg2 websocket subprotocols offered by the client
+#returns the encoding and the subprotocol to accept (None if no subprotocol was used)
+def negotiate(requested, subprotocols) -> tuple[str, str | None]:
+    for subprotocol in subprotocols:
+        if subprotocol in ENCODINGS:
+            return subprotocol, subprotocol
+    if requested in ENCODINGS:
+        return requested, None
+    return "json", None
+
+#encodes a message for a connection's encoding
+#json gives text, msgpack gives bytes with cards in the compact form
+def encode(message, encoding="json") -> str | bytes:
+    if encoding == "msgpack":
+        return msgpack.packb(compact(message))
+    return dumps(message)
+
+def decode(frame, encoding="json"):
+    if encoding == "msgpack":
+        return expand(msgpack.unpackb(frame))
+    return loads(frame)
+
+#decodes a message from a client. binary frames are msgpack, text frames are JSON
+def decode_action(frame: str | bytes):
+    if isinstance(frame, bytes) and msgpack is not None:
+        return msgpack.unpackb(frame)
+    return loads(frame)
+
+###
+### Compact card form
+###
+# Every deck or hand "cards" list of {"card_front", "card_back", "face_up"}
+# dicts becomes a list of ints. Each message carries a "faces" table of
+# [card_front, card_back] pairs and a card is (index in faces) * 2 + face_up.
+
+class FaceTable:
+    def __init__(self):
+        self.codes = {}
+        self.faces = []
+
+    def code(self, card: dict) -> int:
+        face = (card["card_front"], card["card_back"])
+        code = self.codes.get(face)
+        if code is None:
+            code = self.codes[face] = len(self.faces)
+            self.faces.append(list(face))
+        return code * 2 + (1 if card["face_up"] else 0)
+
+def _compact_piles(piles: dict, table: FaceTable) -> dict:
+    out = {}
+    for pile_id, pile in piles.items():
+        if pile is not None:
+            pile = dict(pile, cards=[table.code(card) for card in pile["cards"]])
+        out[pile_id] = pile
+    return out
+
+def _compact_room(room: dict, table: FaceTable) -> dict:
+    return dict(room, decks=_compact_piles(room["decks"], table), hands=_compact_piles(room["hands"], table))
+
+#turns a full state, snapshot or patch message into the compact card form
+def compact(message: dict) -> dict:
+    table = FaceTable()
+    message = dict(message)
+    if "room" in message:
+        message["room"] = _compact_room(message["room"], table)
+    if "state" in message:
+        message["state"] = dict(message["state"], room=_compact_room(message["state"]["room"], table))
+    for key in ("decks", "hands"):
+        if key in message:
+            message[key] = _compact_piles(message[key], table)
+    message["faces"] = table.faces
+    return message
+
+def _expand_piles(piles: dict, faces: list) -> dict:
+    out = {}
+    for pile_id, pile in piles.items():
+        if pile is not None:
+            pile = dict(pile, cards=[
+                {"card_front": faces[code >> 1][0], "card_back": faces[code >> 1][1], "face_up": bool(code & 1)}
+                for code in pile["cards"]
+            ])
+        out[pile_id] = pile
+    return out
+
+def _expand_room(room: dict, faces: list) -> dict:
+    return dict(room, decks=_expand_piles(room["decks"], faces), hands=_expand_piles(room["hands"], faces))
+
+#inverse of compact
+def expand(message: dict) -> dict:
+    message = dict(message)
+    faces = message.pop("faces", [])
+    if "room" in message:
+        message["room"] = _expand_room(message["room"], faces)
+    if "state" in message:
+        message["state"] = dict(message["state"], room=_expand_room(message["state"]["room"], faces))
+    for key in ("decks", "hands"):
+        if key in message:
+            message[key] = _expand_piles(message[key], faces)
+    return message
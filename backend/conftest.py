@@ -0,0 +1,21 @@
+import pytest
+
+# Tests marked bench time things against the wall clock, which is too noisy on a
+# busy machine to run with everything else. They only run with --bench.
+
+
+def pytest_addoption(parser):
+    parser.addoption("--bench", action="store_true", help="also run the timing tests marked bench")
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "bench: timing test, only run with --bench")
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption("--bench"):
+        return
+    skip = pytest.mark.skip(reason="timing test, run with --bench")
+    for item in items:
+        if "bench" in item.keywords:
+            item.add_marker(skip)
@@ -0,0 +1,129 @@
+from room import Room
+import copy
+import uuid
+
+# Room methods copy-on-write, so a deck or hand that an action didn't touch is
+# the exact same object in the old and new Room. Comparing by identity tells us
+# what changed without walking any cards.
+
+#computes the patch that turns one room state into another
+#arg1 room before the change
+#arg2 room after the change
+#returns a dict with only the changed parts. empty dict if nothing changed
+def diff_rooms(old: Room, new: Room) -> dict:
+    patch = {}
+    if old.players != new.players:
+        patch["room_players"] = list(new.players)
+
+    if old.decks is not new.decks:
+        decks = {}
+        moves = {}
+        for deck_id, deck in new.decks.items():
+            old_deck = old.decks.get(deck_id)
+            if old_deck is deck:
+                continue
+            if old_deck is not None and old_deck.cards is deck.cards and old_deck.id == deck.id:
+                if old_deck.position != deck.position:
+                    moves[deck_id] = deck.position
+                continue
+            decks[deck_id] = deck.to_wire()
+        for deck_id in old.decks:
+            if deck_id not in new.decks:
+                decks[deck_id] = None
+        if decks:
+            patch["decks"] = decks
+        if moves:
+            patch["deck_moves"] = moves
+
+    if old.hands is not new.hands:
+        hands = {}
+        for hand_id, hand in new.hands.items():
+            if old.hands.get(hand_id) is not hand:
+                hands[hand_id] = hand.to_wire()
+        for hand_id in old.hands:
+            if hand_id not in new.hands:
+                hands[hand_id] = None
+        if hands:
+            patch["hands"] = hands
+    return patch
+
+#builds a versioned patch message between two BigRoom states
+#arg1 players list before
+#arg2 room before
+#arg3 version before
+#arg4 the BigRoom now
+#arg5 optional. epoch of the versions (see DeltaTracker)
+#returns None if the state didn't change
+def make_patch(old_players, old_room, old_version, bigroom, epoch=None) -> dict | None:
+    if old_version == bigroom.version:
+        return None
+    patch = {"type": "patch", "base": old_version, "version": bigroom.version}
+    if epoch is not None:
+        patch["epoch"] = epoch
+    if old_players != bigroom.players:
+        patch["players"] = list(bigroom.players)
+    patch.update(diff_rooms(old_room, bigroom.room))
+    return patch
+
+#builds the full snapshot message sent on join or resync
+#arg2 optional. epoch of the versions (see DeltaTracker)
+def make_snapshot(bigroom, epoch=None) -> dict:
+    snapshot = {"type": "snapshot", "version": bigroom.version, "state": bigroom.to_wire()}
+    if epoch is not None:
+        snapshot["epoch"] = epoch
+    return snapshot
+
+#applies a patch to a serialized BigRoom (the dict a client holds)
+#returns a new dict, the input is not modified
+#raises ValueError if the patch doesn't start from the state's version
+def apply_patch(state: dict, patch: dict) -> dict:
+    if state.get("version") != patch["base"]:
+        raise ValueError(f"patch base {patch['base']} does not match state version {state.get('version')}")
+    state = copy.copy(state)
+    room = copy.copy(state["room"])
+    state["room"] = room
+    state["version"] = patch["version"]
+    if "players" in patch:
+        state["players"] = patch["players"]
+    if "room_players" in patch:
+        room["players"] = patch["room_players"]
+    if "decks" in patch or "deck_moves" in patch:
+        room["decks"] = copy.copy(room["decks"])
+        for deck_id, deck in patch.get("decks", {}).items():
+            if deck is None:
+                room["decks"].pop(deck_id, None)
+            else:
+                room["decks"][deck_id] = deck
+        for deck_id, pos in patch.get("deck_moves", {}).items():
+            room["decks"][deck_id] = dict(room["decks"][deck_id], position=pos)
+    if "hands" in patch:
+        room["hands"] = copy.copy(room["hands"])
+        for hand_id, hand in patch["hands"].items():
+            if hand is None:
+                room["hands"].pop(hand_id, None)
+            else:
+                room["hands"][hand_id] = hand
+    return state
+
+# Keeps the state that was last broadcast for a room so the next broadcast only
+# has to describe what changed since then.
+#
+# Versions only mean something within one run of a room. A room that is loaded
+# again after a restart or an eviction can reach the same version with other
+# contents, so each tracker gets a new random epoch that is sent with its
+# snapshots and patches, and a version is only resumed from in the same epoch.
+class DeltaTracker:
+    def __init__(self, bigroom):
+        self.epoch = uuid.uuid4().hex[:12]
+        self.reset(bigroom)
+
+    def reset(self, bigroom):
+        self.players = list(bigroom.players)
+        self.room = bigroom.room
+        self.version = bigroom.version
+
+    #returns the patch since the last call (or None) and moves the baseline forward
+    def advance(self, bigroom) -> dict | None:
+        patch = make_patch(self.players, self.room, self.version, bigroom, self.epoch)
+        self.reset(bigroom)
+        return patch
@@ -0,0 +1,111 @@
+from actions import ArgError, Int, Schema, error_message
+from collections import deque
+
+# Undo and redo for a room. Room methods never change a Room in place, so an
+# older state is just the old Room object, and the decks and cards it shares
+# with newer rooms are stored once. Going back puts the old object back without
+# copying or serializing anything, and the next broadcast only sends what differs.
+#
+# Undoing still moves the room version forward, so clients apply it like any
+# other change.
+
+# most earlier room states kept per room. the oldest is dropped first
+HISTORY_SIZE = 200
+
+# actions handled here instead of by the dispatcher. they can't be batched
+SCHEMAS = {
+    "undo": Schema({}),
+    "redo": Schema({}),
+    "jump_to_version": Schema({"version": Int(min=0)}),
+}
+
+class RoomHistory:
+    #arg1 most earlier states to keep. default HISTORY_SIZE
+    def __init__(self, size=HISTORY_SIZE):
+        # (version the room was made at, Room), oldest first
+        self.past = deque(maxlen=size)
+        # states undone, most recently undone last
+        self.future = []
+        # version the current room was made at
+        self.since = 0
+
+    #starts over from a room loaded at a version
+    def reset(self, version):
+        self.past.clear()
+        self.future.clear()
+        self.since = version
+
+    #starts over from states loaded from a snapshot (see persist.py)
+    #arg2 (version, Room) pairs, oldest first
+    #arg3 (version, Room) pairs, most recently undone last
+    def load(self, since, past, future):
+        self.reset(since)
+        self.past.extend(past)
+        self.future.extend(future)
+
+    #(since, past, future) copied, so they can be saved while the room goes on
+    def kept(self) -> tuple:
+        return self.since, list(self.past), list(self.future)
+
+    #called when an action replaced the room. anything undone can't be redone after this
+    #arg1 room before the action
+    #arg2 version after the action
+    def record(self, room, version):
+        self.past.append((self.since, room))
+        self.since = version
+        self.future.clear()
+
+    #applies undo, redo or jump_to_version, like Dispatcher.dispatch
+    #arg1 current room
+    #arg2 current version
+    #arg3 action message
+    #returns the room to put back (the same room if nothing changed) and an error message for the sender, or None
+    def apply(self, room, version, message) -> tuple:
+        name = message["action"]
+        try:
+            args = SCHEMAS[name].check(message.get("args", {}))
+        except ArgError as e:
+            return room, error_message(name, "invalid_args", str(e))
+        if name == "undo":
+            restored = self.undo(room)
+        elif name == "redo":
+            restored = self.redo(room)
+        else:
+            restored = self.jump(room, args["version"], version)
+        if restored is None:
+            return room, error_message(name, "no_history", self.missing(name, args))
+        return restored, None
+
+    #returns the room before, or None if nothing is kept
+    def undo(self, room):
+        if not self.past:
+            return None
+        self.future.append((self.since, room))
+        self.since, room = self.past.pop()
+        return room
+
+    def redo(self, room):
+        if not self.future:
+            return None
+        self.past.append((self.since, room))
+        self.since, room = self.future.pop()
+        return room
+
+    #the room as it was at a version, undoing or redoing as far as needed
+    #returns None (and changes nothing) if that version isn't kept
+    #arg3 the room's current version
+    def jump(self, room, version, latest):
+        if version > latest or version < (self.past[0][0] if self.past else self.since):
+            return None
+        while self.past and self.since > version:
+            room = self.undo(room)
+        while self.future and self.future[-1][0] <= version:
+            room = self.redo(room)
+        return room
+
+    def missing(self, name, args) -> str:
+        if name == "undo":
+            return "nothing to undo"
+        if name == "redo":
+            return "nothing to redo"
+        return f"version {args['version']} is not kept"
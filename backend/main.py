@@ -1,12 +1,33 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Header
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from functions import get_room_id
-from bigroom import BigRoom
 from models import JoinRoomRequest
-from dataclasses_serialization.json import JSONSerializer
-import json
+from codec import decode_action, negotiate
+from actions import DISPATCHER, error_message, stamp
+from broadcast import SEND_QUEUE_SIZE, SLOW_CLIENT_POLICY
+from coalesce import MOVE_WINDOW
+from shard import ShardRouter
+from backends import InMemoryBackend, BrokerBackend
+from persist import saved_rooms
+from registry import IDLE_TTL, MEMORY_BUDGET
+from metrics import CONTENT_TYPE, render
+from tracing import TRACE_SAMPLE, PROFILE_DIR, PROFILE_SECONDS, MAX_PROFILE_SECONDS, PROFILE_MODES, ProfileBusy, received
+from contextlib import asynccontextmanager
+import hmac
+import os
+import time
 
-app = FastAPI()
+#starts and stops the room backend
+@asynccontextmanager
+async def lifespan(app):
+    backend.start()
+    if trace_sample:
+        backend.trace(trace_sample, profile_dir)
+    yield
+    backend.stop()
+
+app = FastAPI(lifespan=lifespan)
 origins = [
     "ws://127.0.0.1:8000/ws"
 ]
@@ -19,51 +40,195 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-room_ids = {}
-rooms = {}
-room_sockets = {}
+send_queue_size = int(os.environ.get("SEND_QUEUE_SIZE", SEND_QUEUE_SIZE))
+slow_client_policy = os.environ.get("SLOW_CLIENT_POLICY", SLOW_CLIENT_POLICY)
+move_window = float(os.environ.get("MOVE_COALESCE_MS", MOVE_WINDOW * 1000)) / 1000
+# empty rooms are evicted after ROOM_IDLE_TTL seconds, or sooner once rooms take more than ROOM_MEMORY_MB.
+# 0 turns either off
+idle_ttl = float(os.environ.get("ROOM_IDLE_TTL", IDLE_TTL)) or None
+memory_budget = int(float(os.environ.get("ROOM_MEMORY_MB", MEMORY_BUDGET / 2**20)) * 2**20) or None
+# TRACE_SAMPLE is the share of actions traced, written under PROFILE_DIR with profiles (see tracing.py).
+# the /admin endpoints need ADMIN_TOKEN in an X-Admin-Token header, and are off without it
+trace_sample = float(os.environ.get("TRACE_SAMPLE", TRACE_SAMPLE))
+profile_dir = os.environ.get("PROFILE_DIR", PROFILE_DIR)
+admin_token = os.environ.get("ADMIN_TOKEN")
+# the preset invite codes. always open and never evicted
 id_list = ["mcI5j0Kw", "mcI5j0Kx", "mcI5j0Ky", "mcI5j0Kz"]
+# DATA_DIR saves rooms there so they survive a restart
+settings = {"send_queue_size": send_queue_size, "slow_client_policy": slow_client_policy, "move_window": move_window,
+            "data_dir": os.environ.get("DATA_DIR"), "idle_ttl": idle_ttl, "memory_budget": memory_budget, "pinned": id_list}
+
+# where rooms run. BROKER=host:port shares rooms with other servers through a broker (see backends.py),
+# with BROKER_TOKEN if the broker has one. SHARDS=n runs them on n worker processes, otherwise they all run here.
+# with a broker, rooms are only kept in the broker's memory. they aren't saved or evicted, so the broker grows
+# with every room ever opened and loses them all when it restarts. DATA_DIR, ROOM_IDLE_TTL and ROOM_MEMORY_MB
+# can't be used with it
+if os.environ.get("BROKER"):
+    for name in ("DATA_DIR", "ROOM_IDLE_TTL", "ROOM_MEMORY_MB"):
+        if os.environ.get(name) not in (None, "", "0"):
+            raise ValueError(f"{name} can't be used with BROKER. rooms are only kept in the broker's memory")
+    broker_host, broker_port = os.environ["BROKER"].rsplit(":", 1)
+    backend = BrokerBackend(broker_host, int(broker_port), os.environ.get("BROKER_TOKEN"), **settings)
+elif int(os.environ.get("SHARDS", 0)) > 0:
+    backend = ShardRouter(int(os.environ["SHARDS"]), **settings)
+else:
+    backend = InMemoryBackend(**settings)
+
+room_ids = {}
+
+#registers an invite code. the backend sets the room up when someone joins
+def open_room(room_id):
+    room_ids[room_id] = 1
+
+#an evicted room's invite code stops working, unless the room was saved and can come back
+def forget_room(room_id):
+    if not settings["data_dir"] and room_id not in id_list:
+        room_ids.pop(room_id, None)
+
+backend.on_evict = forget_room
+# with a broker, codes made on other servers work here too
+backend.on_open = open_room
+
+#queues a command for a room's actor, wherever it runs
+#actions get their random choices stamped in here so replaying them gives the same room
+def submit(room_id, kind, ws, *args):
+    if kind == "action":
+        args = (stamp(args[0]), *args[1:])
+    backend.submit(room_id, kind, ws, *args)
+
 for id in id_list:
-    room_ids[id] = 1
-    rooms[id] = BigRoom()
-    room_sockets[id] = []
+    open_room(id)
+if settings["data_dir"]:
+    for id in saved_rooms(settings["data_dir"]):
+        open_room(id)
 
 @app.get("/")
 def root():
     return {"message": "Hello World"}
 
 @app.get("/create-room")
-def create_room():
+async def create_room():
     invite_code = get_room_id(room_ids)
-    room_ids[invite_code] = 1
-    rooms[invite_code] = BigRoom()
+    open_room(invite_code)
+    # so a code nobody uses expires like an empty room
+    backend.submit(invite_code, "open", None)
     return {"code": invite_code}
 
+#call counts and timings for each action type
+@app.get("/action-stats")
+def action_stats():
+    return DISPATCHER.stats_snapshot()
+
+#rooms in memory, their approximate bytes and how many were evicted
+@app.get("/room-stats")
+def room_stats():
+    return dict(backend.stats(), codes=len(room_ids))
+
+#action, serialization and broadcast timings, frame sizes, rooms, sockets and queue
+#lengths in the Prometheus text format (see metrics.py)
+@app.get("/metrics")
+async def metrics():
+    snapshot, gauges = await backend.metrics()
+    return PlainTextResponse(render(snapshot, gauges), media_type=CONTENT_TYPE)
+
+def is_admin(token) -> bool:
+    return bool(admin_token) and hmac.compare_digest(token or "", admin_token)
+
+def check_admin(token):
+    if not is_admin(token):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+#traces this share of actions from now on, 0 to stop
+@app.post("/admin/trace")
+def admin_trace(rate: float, x_admin_token: str | None = Header(None)):
+    check_admin(x_admin_token)
+    if not 0 <= rate <= 1:
+        raise HTTPException(status_code=400, detail="rate must be between 0 and 1")
+    backend.trace(rate, profile_dir)
+    return {"rate": rate, "directory": profile_dir}
+
+#profiles one room, or the whole server without room_id, for some seconds
+#mode "cprofile" or "sample". returns the files that are written when it's done
+@app.post("/admin/profile")
+async def admin_profile(mode: str = "cprofile", seconds: float = PROFILE_SECONDS, room_id: str | None = None,
+                        x_admin_token: str | None = Header(None)):
+    check_admin(x_admin_token)
+    if mode not in PROFILE_MODES:
+        raise HTTPException(status_code=400, detail=f"mode must be one of {PROFILE_MODES}")
+    if not 0 < seconds <= MAX_PROFILE_SECONDS:
+        raise HTTPException(status_code=400, detail=f"seconds must be between 0 and {MAX_PROFILE_SECONDS}")
+    if room_id is not None and room_id not in room_ids:
+        raise HTTPException(status_code=400, detail="Room ID not found!")
+    try:
+        files = backend.profile(room_id, mode, seconds, profile_dir)
+    except ProfileBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {"files": files, "seconds": seconds}
+
 @app.post("/join-room")
 def join_room(request: JoinRoomRequest):
     if request.room_id not in room_ids:
         raise HTTPException(status_code=400, detail="Room ID not found!")
     return {"code": request.room_id}
 
+#waits for the next action from a client. text or binary frame
+#returns the action and when it came in (see tracing.received)
+async def receive_action(ws: WebSocket):
+    message = await ws.receive()
+    start = time.perf_counter()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000))
+    if message.get("bytes") is not None:
+        return decode_action(message["bytes"]), received(start)
+    return decode_action(message["text"]), received(start)
+
+#mode "full" (default) sends the whole room after every action
+#mode "delta" sends a snapshot on join and versioned patches after that
+#encoding "json" (default) or "msgpack", from the query string or a websocket subprotocol
+#resume and epoch: last version a reconnecting delta client saw, and the epoch it came with.
+#it gets the patches it missed instead of a snapshot
+#view "player" (default) sends only what this player can see (see projection.py). "all" sends the whole table,
+#face down cards and other players' hands included, and needs the admin token
 @app.websocket("/ws/{room_id}")
-async def websocket_endpoint(ws: WebSocket, room_id: str):
-    await ws.accept() 
+async def websocket_endpoint(ws: WebSocket, room_id: str, mode: str = "full", encoding: str = "json", resume: int | None = None,
+                             epoch: str | None = None, view: str = "player", x_admin_token: str | None = Header(None)):
+    encoding, subprotocol = negotiate(encoding, ws.scope.get("subprotocols", []))
+    await ws.accept(subprotocol=subprotocol)
     playerName = await ws.receive_text()
-    if room_id not in room_ids:
+    if room_id not in room_ids or (view == "all" and not is_admin(x_admin_token)):
         await ws.send_json({
             "status": "error"
         })
         await ws.close(code=1008)
         return
-    rooms[room_id].addPlayer(playerName)
-    room_sockets[room_id].append(ws)
-    await ws.send_json(JSONSerializer.serialize(rooms[room_id]))
+    submit(room_id, "join", ws, playerName, mode, encoding, None if resume is None else (epoch, resume), view)
     try:
         while True:
-            action = await ws.receive_json()
-            rooms[room_id].updateState(action)
-            for socket in room_sockets[room_id]:
-                await socket.send_json(JSONSerializer.serialize(rooms[room_id]))
+            try:
+                action, arrived = await receive_action(ws)
+            except ValueError:
+                submit(room_id, "error", ws, error_message(None, "invalid_message", "could not decode message"))
+                continue
+            if isinstance(action, dict) and action.get("action") == "resync":
+                submit(room_id, "resync", ws)
+                continue
+            submit(room_id, "action", ws, action, arrived)
     except WebSocketDisconnect:
-        rooms[room_id].removePlayer(playerName)
-        room_sockets[room_id].remove(ws)
+        submit(room_id, "leave", ws, playerName)
+
+#spectators get the room as a player without a hand sees it, in full mode, without joining.
+#a spectator that falls behind skips to the latest state. messages from it are ignored
+@app.websocket("/ws/{room_id}/watch")
+async def watch_endpoint(ws: WebSocket, room_id: str, encoding: str = "json"):
+    encoding, subprotocol = negotiate(encoding, ws.scope.get("subprotocols", []))
+    await ws.accept(subprotocol=subprotocol)
+    if room_id not in room_ids:
+        await ws.send_json({
+            "status": "error"
+        })
+        await ws.close(code=1008)
+        return
+    submit(room_id, "watch", ws, encoding)
+    while (await ws.receive())["type"] != "websocket.disconnect":
+        pass
+    submit(room_id, "unwatch", ws)
@@ -0,0 +1,136 @@
+from bisect import bisect_left
+
+# Metrics served at /metrics in the Prometheus text format. Kept by hand so
+# there is nothing to install: a counter or histogram is a dict from label
+# values to numbers, and recording one is a dict lookup and an add (plus a
+# bisect for histograms), cheap enough to leave on everywhere.
+#
+# Counters and histograms are recorded where things happen and belong to the
+# process. Gauges (rooms, sockets, queue depths) are counted from the rooms
+# when /metrics is read, so keeping them costs nothing in between. With
+# sharding each worker process has its own metrics, and the front asks every
+# shard for them (see ShardRouter.metrics).
+PREFIX = "sandbox_"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+SECONDS_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# every counter and histogram, in the order they are written out
+METRICS = []
+
+class Counter:
+    kind = "counter"
+
+    #arg1 name without PREFIX
+    #arg2 help text
+    #arg3 label names
+    def __init__(self, name, help, labels=()):
+        self.name = PREFIX + name
+        self.help = help
+        self.labels = labels
+        self.values = {}
+        METRICS.append(self)
+
+    #adds to the counter for one set of label values
+    def inc(self, *labels, amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    @staticmethod
+    def merge(a, b):
+        return a + b
+
+    def lines(self, values):
+        for labels, value in sorted(values.items()):
+            yield f"{self.name}{label_text(self.labels, labels)} {value}"
+
+class Histogram:
+    kind = "histogram"
+
+    #arg4 upper bounds of the buckets, smallest first. +Inf is added
+    def __init__(self, name, help, labels=(), buckets=SECONDS_BUCKETS):
+        self.name = PREFIX + name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        # label values -> [count in each bucket, not cumulative, then +Inf] + [sum]
+        self.values = {}
+        METRICS.append(self)
+
+    def observe(self, value, *labels):
+        counts = self.values.get(labels)
+        if counts is None:
+            counts = self.values[labels] = [0] * (len(self.buckets) + 2)
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    @staticmethod
+    def merge(a, b):
+        return [x + y for x, y in zip(a, b)]
+
+    def lines(self, values):
+        bounds = [*(str(bound) for bound in self.buckets), "+Inf"]
+        for labels, counts in sorted(values.items()):
+            total = 0
+            for bound, count in zip(bounds, counts):
+                total += count
+                yield f"{self.name}_bucket{label_text((*self.labels, 'le'), (*labels, bound))} {total}"
+            yield f"{self.name}_sum{label_text(self.labels, labels)} {counts[-1]}"
+            yield f"{self.name}_count{label_text(self.labels, labels)} {total}"
+
+def label_text(names, values) -> str:
+    if not names:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in values)
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, escaped)) + "}"
+
+ACTION_SECONDS = Histogram("action_seconds", "Time to apply an action to a room", ("action",))
+ACTION_ERRORS = Counter("action_errors_total", "Actions rejected, by error code", ("action", "error"))
+ENCODE_SECONDS = Histogram("encode_seconds", "Time to serialize a frame, once per version, encoding and view", ("kind", "encoding"))
+FRAME_BYTES = Histogram("frame_bytes", "Size of each serialized frame in bytes", ("kind", "encoding"), BYTES_BUCKETS)
+BROADCAST_SECONDS = Histogram("broadcast_seconds", "Time to diff, serialize and queue one room version for every socket")
+FRAMES_DROPPED = Counter("frames_dropped_total", "Queued frames dropped for slow sockets")
+SLOW_DISCONNECTS = Counter("slow_disconnects_total", "Sockets closed for falling behind")
+
+# name without PREFIX -> help, and how values from several processes are combined
+GAUGES = {
+    "rooms": ("Rooms in memory", sum),
+    "players": ("Players in rooms", sum),
+    "sockets": ("Open websockets, spectators included", sum),
+    "send_queue_frames": ("Frames waiting in send queues", sum),
+    "send_queue_max_frames": ("Longest send queue", max),
+    "command_queue_commands": ("Commands waiting for room actors", sum),
+}
+
+#the counters and histograms of this process, as plain dicts that can be sent to another process
+def snapshot() -> dict:
+    return {metric.name: {labels: list(value) if isinstance(value, list) else value for labels, value in metric.values.items()}
+            for metric in METRICS}
+
+#sums snapshots from several processes
+def merge(snapshots) -> dict:
+    total = {metric.name: {} for metric in METRICS}
+    for snap in snapshots:
+        for metric in METRICS:
+            values = total[metric.name]
+            for labels, value in snap.get(metric.name, {}).items():
+                values[labels] = metric.merge(values[labels], value) if labels in values else value
+    return total
+
+#combines gauges from several processes. gauges missing from one count as 0
+def merge_gauges(gauges) -> dict:
+    gauges = list(gauges)
+    return {name: combine([g.get(name, 0) for g in gauges] or [0]) for name, (_, combine) in GAUGES.items()}
+
+#the Prometheus text for a snapshot and gauges
+def render(snap, gauges) -> str:
+    out = []
+    for metric in METRICS:
+        out.append(f"# HELP {metric.name} {metric.help}")
+        out.append(f"# TYPE {metric.name} {metric.kind}")
+        out.extend(metric.lines(snap.get(metric.name, {})))
+    for name, (help, _) in GAUGES.items():
+        out.append(f"# HELP {PREFIX}{name} {help}")
+        out.append(f"# TYPE {PREFIX}{name} gauge")
+        out.append(f"{PREFIX}{name} {gauges.get(name, 0)}")
+    return "\n".join(out) + "\n"
@@ -2,6 +2,9 @@ from dataclasses import dataclass, field
 import random
 import copy
 from typing import Tuple, List
+from array import array
+from catalog import CATALOG
+import rope as ropes
     
 @dataclass
 class Deck:
@@ -12,24 +15,27 @@ class Deck:
     position: List[int] = field(default_factory=list)
     cards: List["Card"] = field(default_factory=list)
 
+    def __post_init__(self):
+        if not isinstance(self.cards, CardList):
+            self.cards = CardList(self.cards)
+
     ###
     ### Deck Manipulations
     ###
-    def shuffle(self) -> "Deck":
+    #arg1 optional. seed, so the same shuffle can be repeated
+    def shuffle(self, seed=None) -> "Deck":
         deck = copy.copy(self)
         deck.cards = copy.copy(deck.cards)
-        random.shuffle(deck.cards)
+        deck.cards.shuffle(random.Random(seed) if seed is not None else random)
         return deck
 
     def remove_top(self, n=1) -> "Deck":
         deck = copy.copy(self)
-        deck.cards = copy.copy(deck.cards)
         deck.cards = deck.cards[:-n]
         return deck
     
     def remove_bottom(self, n=1) -> "Deck":
         deck = copy.copy(self)
-        deck.cards = copy.copy(deck.cards)
         deck.cards = deck.cards[n:]
         return deck
     
@@ -45,12 +51,8 @@ class Deck:
         return deck
     
     def flip_deck(self) -> "Deck":
-        deck = copy.deepcopy(self)
-        deck.cards.reverse()
-        retdeck = []
-        for card in deck.cards:
-            retdeck.append(card.flip())
-        deck.cards = retdeck
+        deck = copy.copy(self)
+        deck.cards = deck.cards.flipped()
         return deck
 
     ###
@@ -64,6 +66,17 @@ class Deck:
         else:
             return copy.copy(self.cards[len(self.cards) - idx - 1])
 
+    ###
+    ### Deck Wire Format
+    ###
+    def to_wire(self) -> dict:
+        return {"id": self.id, "position": self.position, "cards": self.cards.to_wire()}
+
+    @staticmethod
+    def from_wire(wire: dict) -> "Deck":
+        return Deck(id=wire.get("id", ""), position=wire.get("position", []),
+                    cards=[Card.from_wire(card) for card in wire.get("cards", [])])
+
 
 
 @dataclass
@@ -73,6 +86,13 @@ class Hand:
     ###
     cards: List["Card"] = field(default_factory=list)
     hand_id: str = ""
+    # player whose hand it is. other players only see how many cards it has (see projection.py)
+    # "" for a hand everyone can see
+    owner: str = ""
+
+    def __post_init__(self):
+        if not isinstance(self.cards, CardList):
+            self.cards = CardList(self.cards)
 
     ###
     ### Hand Manipulations
@@ -89,6 +109,12 @@ class Hand:
         hand.cards.append(card)
         return hand
 
+    #adds several cards at once, in order
+    def add_cards(self, cards) -> "Hand":
+        hand = copy.copy(self)
+        hand.cards = hand.cards + cards
+        return hand
+
     ###
     ### Hand Inquires
     ###
@@ -97,6 +123,20 @@ class Hand:
             return None
         return copy.copy(self.cards[n])
 
+    ###
+    ### Hand Wire Format
+    ###
+    def to_wire(self) -> dict:
+        wire = {"cards": self.cards.to_wire(), "hand_id": self.hand_id}
+        if self.owner:
+            wire["owner"] = self.owner
+        return wire
+
+    @staticmethod
+    def from_wire(wire: dict) -> "Hand":
+        return Hand(cards=[Card.from_wire(card) for card in wire.get("cards", [])], hand_id=wire.get("hand_id", ""),
+                    owner=wire.get("owner", ""))
+
 @dataclass
 class Card:
     ###
@@ -120,3 +160,191 @@ class Card:
     ###
     ### Card Inquires
     ###
+
+    ###
+    ### Card Wire Format
+    ###
+    def to_wire(self) -> dict:
+        return {"card_front": self.card_front, "card_back": self.card_back, "face_up": self.face_up}
+
+    @staticmethod
+    def from_wire(wire: dict) -> "Card":
+        card_front = wire.get("card_front", "")
+        card_back = wire.get("card_back", "")
+        face_up = wire.get("face_up", False)
+        if not isinstance(card_front, str) or not isinstance(card_back, str) or not isinstance(face_up, bool):
+            raise ValueError(f"invalid card {wire!r}")
+        return Card(card_front=card_front, card_back=card_back, face_up=face_up)
+
+
+# List of cards used for Deck.cards and Hand.cards. Each card is stored as one
+# packed int from the card catalog, (face code << 1) | face_up, in a persistent
+# rope (see rope.py). Copying a CardList shares the rope, and every change
+# builds a new rope that shares everything it didn't touch with the old one, so
+# a copy is O(1), and adding, removing or slicing cards is O(log n).
+# Card objects are only created when a card is read out.
+#
+# A list can also be inverted: it reads as the rope from top to bottom with
+# every card turned over. Flipping a deck only toggles this, and every read or
+# change maps its indexes through it, so callers never see the stored order.
+class CardList:
+    __slots__ = ("rope", "inverted")
+
+    def __init__(self, cards=(), codes=None, rope=None, inverted=False):
+        if rope is None:
+            if codes is None:
+                codes = (CATALOG.pack(card.card_front, card.card_back, card.face_up) for card in cards)
+            rope = ropes.from_codes(codes)
+        self.rope = rope
+        self.inverted = inverted
+
+    @staticmethod
+    def unpack(packed: int) -> "Card":
+        card_front, card_back = CATALOG.faces[packed >> 1]
+        return Card(card_front=card_front, card_back=card_back, face_up=bool(packed & 1))
+
+    @staticmethod
+    def pack(card: "Card") -> int:
+        return CATALOG.pack(card.card_front, card.card_back, card.face_up)
+
+    #packed cards from bottom to top, as a new array
+    @property
+    def codes(self) -> array:
+        return array("I", self.packed())
+
+    #yields the packed cards from bottom to top
+    def packed(self):
+        if not self.inverted:
+            for leaf in ropes.leaves(self.rope):
+                yield from leaf
+            return
+        for leaf in reversed(list(ropes.leaves(self.rope))):
+            for packed in reversed(leaf):
+                yield packed ^ 1
+
+    #the same cards stored with the given orientation. O(n) if it has to change
+    def oriented(self, inverted: bool) -> "CardList":
+        if inverted == self.inverted:
+            return self
+        if not inverted:
+            return CardList(codes=self.packed())
+        return CardList(codes=(packed ^ 1 for packed in reversed(array("I", self.packed()))), inverted=True)
+
+    def _index(self, idx: int) -> int:
+        size = ropes.size(self.rope)
+        if idx < 0:
+            idx += size
+        if not 0 <= idx < size:
+            raise IndexError("card index out of range")
+        return size - idx - 1 if self.inverted else idx
+
+    ###
+    ### Sequence
+    ###
+    def __len__(self):
+        return ropes.size(self.rope)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            size = len(self)
+            start, stop, step = idx.indices(size)
+            if step != 1:
+                return CardList(codes=self.codes[idx])
+            if stop <= start:
+                return CardList()
+            if self.inverted:
+                start, stop = size - stop, size - start
+            rope = ropes.split(self.rope, stop)[0]
+            return CardList(rope=ropes.split(rope, start)[1], inverted=self.inverted)
+        return CardList.unpack(ropes.get(self.rope, self._index(idx)) ^ self.inverted)
+
+    def __iter__(self):
+        unpack = CardList.unpack
+        for packed in self.packed():
+            yield unpack(packed)
+
+    def __add__(self, other):
+        if not isinstance(other, CardList):
+            other = CardList(other)
+        if self.inverted == other.inverted:
+            if self.inverted:
+                return CardList(rope=ropes.concat(other.rope, self.rope), inverted=True)
+            return CardList(rope=ropes.concat(self.rope, other.rope))
+        # turn the shorter list to match the longer one
+        if len(other) <= len(self):
+            return self + other.oriented(self.inverted)
+        return self.oriented(other.inverted) + other
+
+    def __eq__(self, other):
+        if isinstance(other, CardList):
+            if self.rope is other.rope and self.inverted == other.inverted:
+                return True
+            return len(self) == len(other) and all(a == b for a, b in zip(self.packed(), other.packed()))
+        if isinstance(other, (list, tuple)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def __copy__(self):
+        return CardList(rope=self.rope, inverted=self.inverted)
+
+    def __deepcopy__(self, memo):
+        return self.__copy__()
+
+    #returns a new list in the opposite order. O(n)
+    def reversed(self) -> "CardList":
+        return CardList(codes=reversed(array("I", self.packed())))
+
+    #returns a new list in the opposite order with every card turned over. O(1)
+    def flipped(self) -> "CardList":
+        return CardList(rope=self.rope, inverted=not self.inverted)
+
+    ###
+    ### In place changes. these swap in a new rope, so copies made before are
+    ### never affected. callers still copy first, like they would a list
+    ###
+    def __setitem__(self, idx, card: "Card"):
+        self.rope = ropes.replace(self.rope, self._index(idx), CardList.pack(card) ^ self.inverted)
+
+    def append(self, card: "Card"):
+        packed = array("I", [CardList.pack(card) ^ self.inverted])
+        if self.inverted:
+            self.rope = ropes.concat(packed, self.rope)
+        else:
+            self.rope = ropes.concat(self.rope, packed)
+
+    def extend(self, cards):
+        extended = self + cards
+        self.rope, self.inverted = extended.rope, extended.inverted
+
+    def pop(self, idx=-1) -> "Card":
+        idx = self._index(idx)
+        removed = ropes.get(self.rope, idx)
+        before, rest = ropes.split(self.rope, idx)
+        self.rope = ropes.concat(before, ropes.split(rest, 1)[1])
+        return CardList.unpack(removed ^ self.inverted)
+
+    def reverse(self):
+        self.rope, self.inverted = self.reversed().rope, False
+
+    #arg1 optional. random.Random to shuffle with. default the random module
+    def shuffle(self, rng=random):
+        codes = array("I", ropes.to_array(self.rope))
+        rng.shuffle(codes)
+        if self.inverted:
+            codes = array("I", (packed ^ 1 for packed in codes))
+        self.rope, self.inverted = ropes.from_codes(codes), False
+
+    ###
+    ### Wire Format. always sent the right way up
+    ###
+    def to_wire(self) -> list:
+        faces = CATALOG.faces
+        return [
+            {"card_front": faces[packed >> 1][0], "card_back": faces[packed >> 1][1], "face_up": bool(packed & 1)}
+            for packed in self.packed()
+        ]
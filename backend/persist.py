@@ -0,0 +1,318 @@
+from bigroom import BigRoom
+from catalog import CATALOG
+from objects import CardList, Deck, Hand
+from room import Room
+from codec import dumps, loads
+import asyncio
+import atexit
+import os
+import queue
+import re
+import threading
+import traceback
+
+# Keeps rooms across restarts. Every action that changes a room is appended to
+# the room's log, and every SNAPSHOT_EVERY actions the whole room is written to
+# a snapshot and the log starts over. Recovering a room loads the snapshot and
+# replays the log after it.
+#
+# Undo, redo and jump_to_version are logged like any other action, and
+# snapshots keep the undo history along with the room, so replaying the log
+# after a snapshot undoes to the same rooms.
+#
+# Writes to the log are fsynced in groups: the first action after a sync starts
+# a FSYNC_INTERVAL timer and everything appended until it fires is synced
+# together, so a crash loses at most that window of actions (plus whatever is
+# still waiting for the writer thread).
+#
+# The event loop never waits on the disk. It only writes log lines into the
+# file's buffer and moves files around. Every fsync, and the snapshots
+# themselves, are done in order by one writer thread shared by every room in
+# the process (WRITER). A snapshot starts a new log, and the old one is kept as
+# {room id}.log.old until the snapshot is on disk.
+#
+# Files in the data directory, per room:
+# {room id}.log   one JSON line per action: {"version": room version after it, "action": action message}
+# {room id}.log.old  the log from before a snapshot that hasn't finished. read before {room id}.log
+# {room id}.snap  {
+#                   "version": version,
+#                   "faces": [[card_front, card_back], ...],
+#                   "cards": {key: [card, ...]},   a card is (index in faces) * 2 + face_up, like the compact form in codec.py
+#                   "decks": {key: {"id", "position", "cards": cards key}},
+#                   "hands": {key: {"hand_id", "owner", "cards": cards key}},
+#                   "current": room,
+#                   "history": {"since": version, "past": [[version, room], ...], "future": [[version, room], ...]}
+#                 } where a room is {"players": [...], "decks": {deck id: key}, "hands": {hand id: key}}.
+#                 Card lists, decks and hands shared by several of the rooms are written once.
+#                 (see RoomHistory for what since, past and future are)
+FSYNC_INTERVAL = 0.05
+SNAPSHOT_EVERY = 1000
+
+ROOM_ID = re.compile(r"^[A-Za-z0-9_-]+$")
+
+#ids of every room with something saved in a directory
+def saved_rooms(directory) -> list:
+    if not os.path.isdir(directory):
+        return []
+    names = (os.path.splitext(name.removesuffix(".old")) for name in os.listdir(directory))
+    return sorted({room_id for room_id, ext in names if ext in (".log", ".snap") and ROOM_ID.match(room_id)})
+
+# Runs disk writes on a thread, one at a time in the order they were submitted,
+# so a room's fsyncs, snapshot and close happen in the order it asked for them.
+class DiskWriter:
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    #queues job(*args). starts the thread the first time
+    def submit(self, job, *args):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="disk-writer", daemon=True)
+                self.thread.start()
+        self.queue.put((job, args))
+
+    def run(self):
+        while True:
+            job, args = self.queue.get()
+            try:
+                job(*args)
+            except Exception:
+                # the room's files are left as they were. recovering it still works
+                traceback.print_exc()
+            finally:
+                self.queue.task_done()
+
+    #blocks until everything submitted so far is done
+    def drain(self):
+        self.queue.join()
+
+WRITER = DiskWriter()
+# nothing queued is lost when the process exits normally
+atexit.register(WRITER.drain)
+
+def fsync_file(file):
+    os.fsync(file.fileno())
+
+def close_file(file):
+    os.fsync(file.fileno())
+    file.close()
+
+def fsync_directory(directory):
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+class RoomLog:
+    #arg1 data directory
+    #arg2 room id. used in the file names
+    #arg3 seconds between fsyncs. 0 syncs after every action
+    #arg4 actions between snapshots
+    def __init__(self, directory, room_id, fsync_interval=FSYNC_INTERVAL, snapshot_every=SNAPSHOT_EVERY):
+        if not ROOM_ID.match(room_id):
+            raise ValueError(f"can't save room {room_id!r}")
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.log_path = os.path.join(directory, room_id + ".log")
+        self.old_log_path = self.log_path + ".old"
+        self.snapshot_path = os.path.join(directory, room_id + ".snap")
+        self.fsync_interval = fsync_interval
+        self.snapshot_every = snapshot_every
+        self.file = None
+        self.entries = 0
+        self.timer = None
+        # True from when a snapshot is started until the writer thread is done with it
+        self.snapshotting = False
+
+    #loads the room from disk and attaches this log to it
+    def recover(self) -> BigRoom:
+        # a room evicted a moment ago may still be being written
+        WRITER.drain()
+        bigroom = BigRoom()
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, "rb") as f:
+                snapshot_from_wire(bigroom, loads(f.read()))
+        else:
+            bigroom.history.reset(bigroom.version)
+
+        unfinished = os.path.exists(self.old_log_path)
+        if unfinished:
+            self.replay(bigroom, self.old_log_path)
+        good = self.replay(bigroom, self.log_path)
+
+        self.file = open(self.log_path, "ab")
+        self.file.truncate(good)
+        if unfinished:
+            # the snapshot that was started never finished. the room has everything now, so it's written again
+            self.write_snapshot(None, bigroom.version, bigroom.room, bigroom.history.kept())
+            self.file.truncate(0)
+            self.entries = 0
+        bigroom.log = self
+        return bigroom
+
+    #applies the actions in a log file that are newer than the room
+    #returns the length of the file up to the first line cut off by a crash
+    def replay(self, bigroom, path) -> int:
+        good = 0
+        if not os.path.exists(path):
+            return good
+        with open(path, "rb") as f:
+            for line in f:
+                try:
+                    entry = loads(line)
+                except ValueError:
+                    # a write cut off by a crash. everything after it is dropped
+                    break
+                good += len(line)
+                self.entries += 1
+                if entry["version"] <= bigroom.version:
+                    continue
+                # joins and leaves aren't logged, so the version the action was applied at is set from the entry.
+                # jump_to_version checks against it
+                bigroom.version = entry["version"] - 1
+                bigroom.updateState(entry["action"])
+        return good
+
+    #records an action that changed the room
+    #arg1 BigRoom after the action
+    #arg2 action message
+    def append(self, bigroom, action):
+        self.file.write((dumps({"version": bigroom.version, "action": action}) + "\n").encode())
+        self.entries += 1
+        if self.entries < self.snapshot_every or not self.snapshot(bigroom):
+            self.schedule_sync()
+
+    def schedule_sync(self):
+        if self.fsync_interval <= 0:
+            self.sync()
+            return
+        if self.timer is None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                self.sync()
+                return
+            self.timer = loop.call_later(self.fsync_interval, self.sync)
+
+    #sends what was appended to the OS now and has the writer thread fsync it
+    def sync(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        self.file.flush()
+        WRITER.submit(fsync_file, self.file)
+
+    #starts writing the whole room and its undo history, and starts a new log.
+    #returns False (and does nothing) while the last snapshot is still being written
+    def snapshot(self, bigroom) -> bool:
+        if self.snapshotting or os.path.exists(self.old_log_path):
+            return False
+        self.snapshotting = True
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        self.file.flush()
+        old_file = self.file
+        os.replace(self.log_path, self.old_log_path)
+        self.file = open(self.log_path, "ab")
+        self.entries = 0
+        # rooms are never changed in place, so the writer can serialize them while the room goes on
+        WRITER.submit(self.write_snapshot, old_file, bigroom.version, bigroom.room, bigroom.history.kept())
+        return True
+
+    #on the writer thread: finishes the old log, writes the snapshot and then drops the old log
+    #arg1 the old log's file, or None if it's closed already
+    def write_snapshot(self, old_file, version, room, kept):
+        try:
+            if old_file is not None:
+                close_file(old_file)
+            data = dumps(snapshot_to_wire(version, room, kept)).encode()
+            temp_path = self.snapshot_path + ".tmp"
+            with open(temp_path, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.snapshot_path)
+            # the snapshot has to be on disk before the log it replaces is gone
+            fsync_directory(self.directory)
+            os.remove(self.old_log_path)
+        finally:
+            self.snapshotting = False
+
+    def close(self):
+        if self.file is not None and not self.file.closed:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+            self.file.flush()
+            WRITER.submit(close_file, self.file)
+            self.file = None
+
+#a room and its undo history in the snapshot form
+#arg3 RoomHistory.kept()
+def snapshot_to_wire(version, room, kept) -> dict:
+    faces = []
+    wire = {"version": version, "faces": faces, "cards": {}, "decks": {}, "hands": {}}
+    # catalog code -> index in faces
+    face_index = {}
+    # id of a card list, deck or hand -> its key, so anything shared by several rooms is written once
+    keys = {}
+
+    def key(obj, out, to_wire) -> str:
+        found = keys.get(id(obj))
+        if found is None:
+            found = keys[id(obj)] = str(len(keys))
+            out[found] = to_wire(obj)
+        return found
+
+    def cards_wire(cards) -> list:
+        out = []
+        for packed in cards.packed():
+            index = face_index.get(packed >> 1)
+            if index is None:
+                index = face_index[packed >> 1] = len(faces)
+                faces.append(list(CATALOG.faces[packed >> 1]))
+            out.append(index * 2 + (packed & 1))
+        return out
+
+    def deck_wire(deck) -> dict:
+        return {"id": deck.id, "position": deck.position, "cards": key(deck.cards, wire["cards"], cards_wire)}
+
+    def hand_wire(hand) -> dict:
+        return {"hand_id": hand.hand_id, "owner": hand.owner, "cards": key(hand.cards, wire["cards"], cards_wire)}
+
+    def room_wire(room) -> dict:
+        return {
+            "players": list(room.players),
+            "decks": {deck_id: key(deck, wire["decks"], deck_wire) for deck_id, deck in room.decks.items()},
+            "hands": {hand_id: key(hand, wire["hands"], hand_wire) for hand_id, hand in room.hands.items()},
+        }
+
+    since, past, future = kept
+    wire["current"] = room_wire(room)
+    wire["history"] = {
+        "since": since,
+        "past": [[version, room_wire(room)] for version, room in past],
+        "future": [[version, room_wire(room)] for version, room in future],
+    }
+    return wire
+
+#loads a snapshot into a BigRoom
+def snapshot_from_wire(bigroom, wire):
+    bigroom.version = wire["version"]
+    codes = [CATALOG.code(card_front, card_back) for card_front, card_back in wire["faces"]]
+    cards = {key: CardList(codes=[(codes[card >> 1] << 1) | (card & 1) for card in packed]) for key, packed in wire["cards"].items()}
+    decks = {key: Deck(id=deck["id"], position=deck["position"], cards=cards[deck["cards"]]) for key, deck in wire["decks"].items()}
+    hands = {key: Hand(cards=cards[hand["cards"]], hand_id=hand["hand_id"], owner=hand["owner"]) for key, hand in wire["hands"].items()}
+
+    def room(ref) -> Room:
+        return Room(players=list(ref["players"]), decks={deck_id: decks[key] for deck_id, key in ref["decks"].items()},
+                    hands={hand_id: hands[key] for hand_id, key in ref["hands"].items()})
+
+    history = wire["history"]
+    bigroom.room = room(wire["current"])
+    bigroom.history.load(history["since"], [(since, room(ref)) for since, ref in history["past"]],
+                         [(since, room(ref)) for since, ref in history["future"]])
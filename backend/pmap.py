@@ -0,0 +1,159 @@
+from collections.abc import Mapping
+
+# Persistent hash map (a hash array mapped trie). Keys are placed by their hash,
+# BITS bits per level, and each node only has slots for the children it has,
+# found through a bitmap. Nothing is ever changed in place: set and delete copy
+# the nodes on the path to the key and share everything else with the old map,
+# so a change costs O(log n) time and memory however big the map is.
+# Keys whose whole hashes are equal share a Collision.
+
+BITS = 5
+MASK = (1 << BITS) - 1
+HASH_BITS = 64
+
+class Node:
+    __slots__ = ("bitmap", "slots")
+
+    #arg1 bit i is set if there is a child for hash bits i at this level
+    #arg2 the children, in bit order. each is a Node, a (key, value) tuple or a Collision
+    def __init__(self, bitmap, slots):
+        self.bitmap = bitmap
+        self.slots = slots
+
+class Collision:
+    __slots__ = ("hash", "pairs")
+
+    def __init__(self, hash, pairs):
+        self.hash = hash
+        self.pairs = pairs
+
+def _hash(key) -> int:
+    return hash(key) & ((1 << HASH_BITS) - 1)
+
+#a node holding two items that are different keys
+def _pair(shift, a, ha, b, hb):
+    if ha == hb:
+        pairs = (a.pairs if type(a) is Collision else (a,)) + (b.pairs if type(b) is Collision else (b,))
+        return Collision(ha, pairs)
+    ia, ib = (ha >> shift) & MASK, (hb >> shift) & MASK
+    if ia == ib:
+        return Node(1 << ia, (_pair(shift + BITS, a, ha, b, hb),))
+    return Node((1 << ia) | (1 << ib), (a, b) if ia < ib else (b, a))
+
+#returns the new node and whether a key was added
+def _set(node, shift, h, key, value):
+    bit = 1 << ((h >> shift) & MASK)
+    i = (node.bitmap & (bit - 1)).bit_count()
+    if not node.bitmap & bit:
+        return Node(node.bitmap | bit, node.slots[:i] + ((key, value),) + node.slots[i:]), True
+    child = node.slots[i]
+    if type(child) is Node:
+        new, added = _set(child, shift + BITS, h, key, value)
+    elif type(child) is tuple:
+        if child[0] == key:
+            if child[1] is value:
+                return node, False
+            new, added = (key, value), False
+        else:
+            new, added = _pair(shift + BITS, child, _hash(child[0]), (key, value), h), True
+    elif child.hash != h:
+        new, added = _pair(shift + BITS, child, child.hash, (key, value), h), True
+    else:
+        pairs = tuple(pair for pair in child.pairs if pair[0] != key)
+        new, added = Collision(h, pairs + ((key, value),)), len(pairs) == len(child.pairs)
+    return Node(node.bitmap, node.slots[:i] + (new,) + node.slots[i + 1:]), added
+
+#returns the new node, None if it's empty now, or the same node if the key isn't there
+def _delete(node, shift, h, key):
+    bit = 1 << ((h >> shift) & MASK)
+    if not node.bitmap & bit:
+        return node
+    i = (node.bitmap & (bit - 1)).bit_count()
+    child = node.slots[i]
+    if type(child) is Node:
+        new = _delete(child, shift + BITS, h, key)
+        if new is child:
+            return node
+        if type(new) is Node and len(new.slots) == 1 and type(new.slots[0]) is not Node:
+            # a single key left further down moves up to here
+            new = new.slots[0]
+    elif type(child) is tuple:
+        if child[0] != key:
+            return node
+        new = None
+    else:
+        pairs = tuple(pair for pair in child.pairs if pair[0] != key)
+        if len(pairs) == len(child.pairs):
+            return node
+        new = pairs[0] if len(pairs) == 1 else Collision(child.hash, pairs)
+    if new is not None:
+        return Node(node.bitmap, node.slots[:i] + (new,) + node.slots[i + 1:])
+    if node.bitmap == bit:
+        return None
+    return Node(node.bitmap & ~bit, node.slots[:i] + node.slots[i + 1:])
+
+def _items(node):
+    for child in node.slots:
+        if type(child) is Node:
+            yield from _items(child)
+        elif type(child) is tuple:
+            yield child
+        else:
+            yield from child.pairs
+
+EMPTY_NODE = Node(0, ())
+
+class PMap(Mapping):
+    __slots__ = ("root", "size")
+
+    def __init__(self, root=EMPTY_NODE, size=0):
+        self.root = root
+        self.size = size
+
+    #the map with key set to value
+    def set(self, key, value) -> "PMap":
+        root, added = _set(self.root, 0, _hash(key), key, value)
+        return self if root is self.root else PMap(root, self.size + added)
+
+    #the map without key. the same map if it isn't there
+    def delete(self, key) -> "PMap":
+        root = _delete(self.root, 0, _hash(key), key)
+        if root is self.root:
+            return self
+        return PMap(root or EMPTY_NODE, self.size - 1)
+
+    def get(self, key, default=None):
+        h = _hash(key)
+        node, shift = self.root, 0
+        while True:
+            bit = 1 << ((h >> shift) & MASK)
+            if not node.bitmap & bit:
+                return default
+            child = node.slots[(node.bitmap & (bit - 1)).bit_count()]
+            if type(child) is Node:
+                node, shift = child, shift + BITS
+            elif type(child) is tuple:
+                return child[1] if child[0] == key else default
+            else:
+                return next((value for k, value in child.pairs if k == key), default)
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __iter__(self):
+        return (key for key, _ in _items(self.root))
+
+    def items(self):
+        return _items(self.root)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __repr__(self) -> str:
+        return f"PMap({dict(self.items())!r})"
+
+_MISSING = object()
+EMPTY = PMap()
@@ -0,0 +1,71 @@
+# What one player is allowed to see. Sockets that join with view=player get
+# the room through here instead of the whole table:
+# - face down cards have their card_front blanked
+# - a hand owned by another player is sent with no cards, only a count
+# - the player's own hands are sent as they are, face down cards included
+#
+# Two players see the same thing unless one of them owns a hand, so views are
+# cached per visibility class (see view_class) and not per player.
+
+# card_front sent in place of a card the viewer can't see
+HIDDEN = ""
+
+# cache key for sockets that see everything
+ALL = None
+
+# viewer for spectators. they see what a player without a hand sees
+PUBLIC = ""
+
+#players that own a hand in a room
+def hand_owners(room) -> set:
+    return {hand.owner for hand in room.hands.values() if hand.owner}
+
+#the visibility class of a viewer. viewers with the same class get the same frames
+#arg1 hand_owners of the room
+#arg2 player name, or None for sockets that see everything
+def view_class(owners, viewer):
+    if viewer is None:
+        return ALL
+    return ("player", viewer if viewer in owners else None)
+
+def hide_cards(cards: list) -> list:
+    return [card if card["face_up"] else dict(card, card_front=HIDDEN) for card in cards]
+
+def project_deck(deck: dict) -> dict:
+    return dict(deck, cards=hide_cards(deck["cards"]))
+
+def project_hand(hand: dict, viewer) -> dict:
+    owner = hand.get("owner")
+    if not owner:
+        return dict(hand, cards=hide_cards(hand["cards"]))
+    if owner == viewer:
+        return hand
+    return dict(hand, cards=[], count=len(hand["cards"]))
+
+def _project_piles(piles: dict, project) -> dict:
+    return {pile_id: None if pile is None else project(pile) for pile_id, pile in piles.items()}
+
+#a wire room as seen by a visibility class
+def project_room(room: dict, cls) -> dict:
+    if cls is ALL:
+        return room
+    viewer = cls[1]
+    return dict(room,
+                decks=_project_piles(room["decks"], project_deck),
+                hands=_project_piles(room["hands"], lambda hand: project_hand(hand, viewer)))
+
+#a full state, snapshot or patch message (see delta.py) as seen by a visibility class
+def project_message(message: dict, cls) -> dict:
+    if cls is ALL:
+        return message
+    viewer = cls[1]
+    message = dict(message)
+    if "room" in message:
+        message["room"] = project_room(message["room"], cls)
+    if "state" in message:
+        message["state"] = dict(message["state"], room=project_room(message["state"]["room"], cls))
+    if "decks" in message:
+        message["decks"] = _project_piles(message["decks"], project_deck)
+    if "hands" in message:
+        message["hands"] = _project_piles(message["hands"], lambda hand: project_hand(hand, viewer))
+    return message
@@ -0,0 +1,157 @@
+from catalog import CATALOG
+from persist import WRITER
+import asyncio
+import time
+
+# Keeps track of the rooms running in a process and gets rid of the ones nobody
+# uses, so a long running server doesn't grow without limit. A room can be
+# evicted once it has no sockets, no players and nothing left to do, and either
+# - nothing has happened in it for IDLE_TTL seconds, or
+# - the rooms here take more than MEMORY_BUDGET bytes, in which case the least
+#   recently used empty rooms go first until they fit again.
+# Pinned rooms (the preset invite codes) are never evicted.
+#
+# A room saved to a data directory (see persist.py) is snapshotted before it's
+# evicted and comes back from disk the next time it's used. Without one, an
+# evicted room is gone.
+IDLE_TTL = 600
+MEMORY_BUDGET = 512 * 1024 * 1024
+SWEEP_INTERVAL = 30
+
+# Rough sizes for room_bytes. Cards are packed 4 byte codes in the rope (see
+# objects.py). Old versions kept for undo share every deck and hand they didn't
+# change, but each has its own dict of the room's decks, so bench_history.py
+# measures about VERSION_BYTES plus VERSION_DECK_BYTES per deck for each.
+ROOM_BYTES = 4096
+PILE_BYTES = 512
+CARD_BYTES = 4
+VERSION_BYTES = 1400
+VERSION_DECK_BYTES = 30
+
+#approximate bytes a room's actor holds: decks, hands, undo history and cached frames
+def room_bytes(actor) -> int:
+    room = actor.bigroom.room
+    total = ROOM_BYTES
+    for pile in (*room.decks.values(), *room.hands.values()):
+        total += PILE_BYTES + CARD_BYTES * len(pile.cards)
+    versions = len(actor.bigroom.history.past) + len(actor.bigroom.history.future)
+    total += (VERSION_BYTES + VERSION_DECK_BYTES * len(room.decks)) * versions
+    channel = actor.channel
+    total += sum(len(frame) for frame in channel.frames.values())
+    total += sum(len(frame) for _, frames in channel.history for frame in frames.values())
+    return total
+
+class RoomRegistry:
+    #arg1 makes the actor for a room id
+    #arg2 seconds an empty room is kept after its last command. None never evicts for being idle
+    #arg3 bytes the rooms can take before empty ones are evicted. None has no limit
+    #arg4 room ids that are never evicted
+    #arg5 optional. called with the room id after a room is evicted
+    #arg6 optional. called with stats() after every timed sweep
+    def __init__(self, make_actor, idle_ttl=IDLE_TTL, memory_budget=MEMORY_BUDGET, pinned=(), on_evict=None, on_sweep=None):
+        self.make_actor = make_actor
+        self.idle_ttl = idle_ttl
+        self.memory_budget = memory_budget
+        self.pinned = set(pinned)
+        self.on_evict = on_evict
+        self.on_sweep = on_sweep
+        self.actors = {}
+        self.evicted = 0
+        self.task = None
+
+    #the room's actor, set up the first time the room is used
+    def get(self, room_id):
+        if room_id not in self.actors:
+            self.actors[room_id] = self.make_actor(room_id)
+        return self.actors[room_id]
+
+    #sweeps every interval seconds, if there is anything to sweep for and a loop to do it on
+    def start(self, interval=SWEEP_INTERVAL):
+        if self.idle_ttl is None and self.memory_budget is None:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self.task = loop.create_task(self.run(interval))
+
+    #stops sweeping. saved rooms are on disk when it returns
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+        for actor in self.actors.values():
+            if actor.bigroom.log is not None:
+                actor.bigroom.log.close()
+        WRITER.drain()
+
+    async def run(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            self.sweep()
+            if self.on_sweep is not None:
+                self.on_sweep(self.stats())
+
+    #a room that can be evicted without anyone noticing
+    def evictable(self, room_id, actor) -> bool:
+        return (room_id not in self.pinned
+                and not actor.channel.connections
+                and not actor.bigroom.players
+                and not actor.mover.pending
+                and actor.loading is None
+                and actor.processed == actor.submitted)
+
+    #evicts idle rooms, then the least recently used empty rooms while over the memory budget
+    #returns the evicted room ids
+    def sweep(self, now=None) -> list:
+        now = time.monotonic() if now is None else now
+        sizes = {room_id: room_bytes(actor) for room_id, actor in self.actors.items()}
+        total = sum(sizes.values())
+        candidates = sorted(
+            (actor.last_active, room_id)
+            for room_id, actor in self.actors.items()
+            if self.evictable(room_id, actor)
+        )
+        evicted = []
+        for last_active, room_id in candidates:
+            idle = self.idle_ttl is not None and now - last_active >= self.idle_ttl
+            over = self.memory_budget is not None and total > self.memory_budget
+            if not (idle or over):
+                continue
+            self.evict(room_id)
+            total -= sizes[room_id]
+            evicted.append(room_id)
+        return evicted
+
+    def evict(self, room_id):
+        actor = self.actors.pop(room_id)
+        actor.close()
+        if actor.bigroom.log is not None:
+            # a snapshot makes the room quick to load if it comes back
+            actor.bigroom.log.snapshot(actor.bigroom)
+            actor.bigroom.log.close()
+        self.evicted += 1
+        if self.on_evict is not None:
+            self.on_evict(room_id)
+
+    #rooms, players, sockets and queue lengths right now, for /metrics (see metrics.GAUGES)
+    def gauges(self) -> dict:
+        queues = [len(connection.queue) for actor in self.actors.values() for connection in actor.channel.connections.values()]
+        return {
+            "rooms": len(self.actors),
+            "players": sum(len(actor.bigroom.players) for actor in self.actors.values()),
+            "sockets": len(queues),
+            "send_queue_frames": sum(queues),
+            "send_queue_max_frames": max(queues, default=0),
+            "command_queue_commands": sum(actor.queue.qsize() for actor in self.actors.values()),
+        }
+
+    #room counts and memory totals
+    def stats(self) -> dict:
+        return {
+            "rooms": len(self.actors),
+            "bytes": sum(room_bytes(actor) for actor in self.actors.values()),
+            "evicted": self.evicted,
+            "pinned": len(self.pinned & set(self.actors)),
+            # card faces are shared by every room in the process, so they're not in any room's bytes
+            "catalog_bytes": CATALOG.bytes,
+        }
@@ -1,6 +1,8 @@
 from dataclasses import dataclass, field
 from typing import List, Dict, Optional
-from objects import Deck, Hand, Card
+from objects import Deck, Hand, Card, CardList
+from catalog import CATALOG
+from spatial import DeckGrid
 import copy 
 
 @dataclass 
@@ -8,6 +10,13 @@ class Room:
     players: List[str] = field(default_factory=list)
     decks: Dict[str, Deck] = field(default_factory=dict)
     hands: Dict[str, Hand] = field(default_factory=dict)
+    # where the decks are on the table (see spatial.py). methods that add, remove,
+    # move or resize a deck update it with _reindex
+    grid: DeckGrid = field(default=None, repr=False, compare=False)
+
+    def __post_init__(self):
+        if self.grid is None:
+            self.grid = DeckGrid.build(self.decks)
 
     ###################
     ### Room Macros ###
@@ -23,20 +32,19 @@ class Room:
         room = copy.copy(self)
         room.decks = copy.copy(room.decks)
         room.hands = copy.copy(room.hands)
-        room.hands[hand_id] = copy.copy(room.hands[hand_id])
-        room.decks[deck_id] = copy.copy(room.decks[deck_id])
 
-        hand = room.hands[hand_id]
         deck = room.decks[deck_id]
-        for i in range(n):
-            hand = hand.add(deck.deck_peek(i, from_bottom))
-
         if from_bottom:
+            drawn = deck.cards[:n]
             room.decks[deck_id] = deck.remove_bottom(n)
         else:
+            # the top card is the last one in the deck and goes into the hand first
+            drawn = deck.cards[len(deck.cards) - n:].reversed()
             room.decks[deck_id] = deck.remove_top(n)
 
+        hand = room.hands[hand_id].add_cards(drawn)
         room.hands[hand_id] = hand
+        room._reindex(deck_id)
         return room
     
     #initializes a deck and returns a tuple of the new room and deck id
@@ -50,30 +58,24 @@ class Room:
                 room.decks = copy.copy(room.decks)
 
                 deck_id = "standard_52_" + str(len(room.decks))
-
-                def rank_to_str(rank):
-                    return {11: "J", 12: "Q", 13: "K", 14: "A"}.get(rank, str(rank))
-                
-                deck = Deck(id= deck_id, position= pos, cards=[
-                    Card(card_front=suit + rank_to_str(rank))
-                    for rank in range(2, 15)
-                    for suit in ["H", "D", "S", "C"]
-                ])
+                deck = Deck(id= deck_id, position= pos, cards=CardList(codes=CATALOG.new_deck(deck_type)))
 
                 room.decks[deck.id] = deck
+                room._reindex(deck_id)
                 return [room, deck_id]                
             case _ :
                 return [self, ""]
     #initializes a hand and returns a tuple of the new room and hand id
     #arg1 type of new hand. default empty
+    #arg2 optional. player who owns the hand. default "" (no owner)
     #returns a list where the first entry is the new room and the second entry is the new hand id
-    def initialize_hand(self, hand_type ="empty") -> ["Room", str]:
+    def initialize_hand(self, hand_type ="empty", owner = "") -> ["Room", str]:
         match hand_type:
             case "empty":
                 room = copy.copy(self)
                 room.hands = copy.copy(room.hands)
                 hand_id = "empty_" + str(len(room.hands))
-                hand = Hand(hand_id= hand_id, cards=[])
+                hand = Hand(hand_id= hand_id, cards=[], owner=owner)
                 room.hands[hand_id] = hand
                 return [room, hand_id]                
             case _ :
@@ -82,20 +84,20 @@ class Room:
     #arg1 name of deck to split
     #arg2 number of cards off the top to remove and put into a new deck 
     #arg3 position of the new deck
-    #returns a list where the first entry is the new room and the second entry is the new deck name
+    #returns a list where the first entry is the new room and the second entry is the new deck name.
+    #the room is unchanged and the name is "" if the deck has fewer than n cards
     def split_deck(self, deck_id, n, pos) -> ["Room",str]:
+        if n > len(self.decks[deck_id].cards):
+            return [self, ""]
         room = copy.copy(self)
         room.decks = copy.copy(room.decks)
-        room.decks[deck_id] = copy.copy(room.decks[deck_id])
-        room.decks[deck_id + "_copy"] = Deck(position= pos)
+        deck = room.decks[deck_id]
+        new_deck_id = deck_id + "_copy"
 
-        for i in range(n):
-            room.decks[deck_id + "_copy"].cards.append(room.decks[deck_id].deck_peek(n-i-1))
-        room.decks[deck_id] = room.decks[deck_id].remove_top(n)
-        print("\n\n")
-        print(room.decks[deck_id + "_copy"])
-        print("\n\n")
-        return [room, deck_id + "_copy"]
+        room.decks[new_deck_id] = Deck(id= new_deck_id, position= pos, cards= deck.cards[len(deck.cards) - n:])
+        room.decks[deck_id] = deck.remove_top(n)
+        room._reindex(deck_id, new_deck_id)
+        return [room, new_deck_id]
 
     ##########################
     ### Deck Manipulations ###
@@ -103,10 +105,11 @@ class Room:
     
     #shuffles a deck
     #arg1 name of deck 
-    def shuffle(self, deck_id) -> "Room":
+    #arg2 optional. seed, so the same shuffle can be repeated
+    def shuffle(self, deck_id, seed=None) -> "Room":
         room = copy.copy(self)
         room.decks = copy.copy(room.decks)
-        room.decks[deck_id] = room.decks[deck_id].shuffle()
+        room.decks[deck_id] = room.decks[deck_id].shuffle(seed)
         return room
     
     #removes top card from a deck. removes top n if given
@@ -116,6 +119,7 @@ class Room:
         room = copy.copy(self)
         room.decks = copy.copy(room.decks)
         room.decks[deck_id] = room.decks[deck_id].remove_top(n)
+        room._reindex(deck_id)
         return room
 
     #adds a card to the top of a deck.
@@ -123,7 +127,9 @@ class Room:
     #arg2 card
     def add_top(self, deck_id, card: "Card") -> "Room":
         room = copy.copy(self)
+        room.decks = copy.copy(room.decks)
         room.decks[deck_id] = room.decks[deck_id].add_top(card)
+        room._reindex(deck_id)
         return room
     
     #flips top card from a deck. flips (idx)th card if given
@@ -144,10 +150,10 @@ class Room:
         room = copy.copy(self)
         room.decks = copy.copy(room.decks) 
 
-        room.decks[deck_id] = copy.deepcopy(deck)
+        deck = room.decks[deck_id] = copy.copy(deck)
+        deck.cards = copy.copy(deck.cards)
 
-        room.decks[deck_id].cards[idx] = room.decks[deck_id].cards[idx].flip(face_up)
-        print(f"Flipped card at index {idx} in deck {deck_id}. New faceUp: {room.decks[deck_id].cards[idx].face_up}")
+        deck.cards[idx] = deck.cards[idx].flip(face_up)
 
         return room
     
@@ -169,6 +175,7 @@ class Room:
         room.decks = copy.copy(room.decks)
         room.decks[deck_id] = copy.copy(room.decks[deck_id])
         room.decks[deck_id] = room.decks[deck_id].move_deck(x, y)
+        room._reindex(deck_id)
         return room
     
     def merge_decks(self, dragged_deck_id: str, target_deck_id: str) -> "Room":
@@ -185,12 +192,11 @@ class Room:
 
         room = copy.copy(self)
         room.decks = copy.copy(room.decks)
-        room.decks[target_deck_id] = copy.deepcopy(target_deck)
-
-    
-        room.decks[target_deck_id].cards.extend(dragged_deck.cards)
+        room.decks[target_deck_id] = copy.copy(target_deck)
+        room.decks[target_deck_id].cards = target_deck.cards + dragged_deck.cards
 
         del room.decks[dragged_deck_id]
+        room._reindex(target_deck_id, dragged_deck_id)
 
         return room
     
@@ -207,12 +213,14 @@ class Room:
 
         room = copy.copy(self)
         room.decks = copy.copy(room.decks)
-        room.decks[deck_id] = copy.deepcopy(deck)
+        room.decks[deck_id] = copy.copy(deck)
+        room.decks[deck_id].cards = copy.copy(deck.cards)
 
         removed_card = room.decks[deck_id].cards.pop(card_index)
 
         if not room.decks[deck_id].cards:
             del room.decks[deck_id]
+        room._reindex(deck_id)
 
         return room, removed_card
 
@@ -222,6 +230,7 @@ class Room:
         room = copy.copy(self)
         room.decks = copy.copy(room.decks)
         room.decks[deck.id] = deck
+        room._reindex(deck.id)
         return room
     
     def combine_cards_into_deck(self, dragged_deck_id: str, dragged_card_index: int, target_deck_id: str, target_card_index: int) -> "Room":
@@ -253,6 +262,7 @@ class Room:
     #arg2 target number of card
     def remove_nth(self, hand_id, n) -> "Room":
         room = copy.copy(self)
+        room.hands = copy.copy(room.hands)
         room.hands[hand_id] = room.hands[hand_id].remove_nth(n)
         return room
 
@@ -261,6 +271,7 @@ class Room:
     #arg2 card to add
     def add_card_to_hand(self, hand_id, card: "Card") -> "Room":
         room = copy.copy(self)
+        room.hands = copy.copy(room.hands)
         room.hands[hand_id] = room.hands[hand_id].add(card)
         return room
 
@@ -270,7 +281,11 @@ class Room:
     #arg3 bool for if the card is now face_up. default to flipping to what it currently isn't
     def flip_hand_card(self, hand_id, idx, face_up = None) -> "Room":
         room = copy.copy(self)
-        room.hands[hand_id].cards[idx] = room.hands[hand_id].cards[idx].flip(face_up)
+        room.hands = copy.copy(room.hands)
+        hand = copy.copy(room.hands[hand_id])
+        hand.cards = copy.copy(hand.cards)
+        hand.cards[idx] = hand.cards[idx].flip(face_up)
+        room.hands[hand_id] = hand
         return room
 
     #############
@@ -298,3 +313,41 @@ class Room:
 
     ### Card Inquires ###
 
+    ### Table Inquires ###
+    #the top deck at a point on the table and the index of its top card there
+    #arg3 optional. deck id to skip
+    #returns (deck id, card index), or (None, None) if there's no deck there
+    def deck_at(self, x, y, exclude=None) -> tuple:
+        return self.grid.at(x, y, exclude)
+
+    #ids of the decks that reach into a rectangle, bottom to top
+    def decks_within(self, left, top, right, bottom) -> list:
+        return self.grid.within(left, top, right, bottom)
+
+    #updates the grid for decks this room copy added, removed, moved or resized
+    def _reindex(self, *deck_ids):
+        for deck_id in deck_ids:
+            if deck_id in self.decks:
+                self.grid = self.grid.put(deck_id, self.decks[deck_id])
+            else:
+                self.grid = self.grid.remove(deck_id)
+
+
+
+    #############
+    # Wire Format. the JSON shape sent to clients
+    #############
+    def to_wire(self) -> dict:
+        return {
+            "players": list(self.players),
+            "decks": {deck_id: deck.to_wire() for deck_id, deck in self.decks.items()},
+            "hands": {hand_id: hand.to_wire() for hand_id, hand in self.hands.items()},
+        }
+
+    @staticmethod
+    def from_wire(wire: dict) -> "Room":
+        return Room(
+            players=list(wire.get("players", [])),
+            decks={deck_id: Deck.from_wire(deck) for deck_id, deck in wire.get("decks", {}).items()},
+            hands={hand_id: Hand.from_wire(hand) for hand_id, hand in wire.get("hands", {}).items()},
+        )
@@ -0,0 +1,148 @@
+from array import array
+
+# Persistent sequence of packed cards (see catalog.py). A rope is either a leaf,
+# an array of up to LEAF ints, or a Node joining two ropes. Nodes are kept
+# height balanced like an AVL tree, and nothing is ever changed in place, so
+# every operation returns a new rope that shares all untouched leaves and nodes
+# with the old one. Indexing, concatenation and splitting are O(log n).
+
+LEAF = 32
+# leaves shorter than this are merged into the edge leaf they're joined to when
+# it has room, so cards added one at a time fill leaves instead of each being one
+SMALL = LEAF // 2
+EMPTY = array("I")
+
+class Node:
+    __slots__ = ("left", "right", "size", "height")
+
+    def __init__(self, left, right):
+        self.left = left
+        self.right = right
+        self.size = size(left) + size(right)
+        self.height = 1 + max(height(left), height(right))
+
+def size(rope) -> int:
+    return rope.size if type(rope) is Node else len(rope)
+
+def height(rope) -> int:
+    return rope.height if type(rope) is Node else 0
+
+#builds a balanced rope from an iterable of packed cards
+def from_codes(codes) -> "Node | array":
+    codes = array("I", codes)
+    if len(codes) <= LEAF:
+        return codes
+    leaves = [codes[i:i + LEAF] for i in range(0, len(codes), LEAF)]
+    def build(lo, hi):
+        if hi - lo == 1:
+            return leaves[lo]
+        mid = (lo + hi) // 2
+        return Node(build(lo, mid), build(mid, hi))
+    return build(0, len(leaves))
+
+#joins two ropes without checking sizes. keeps the result balanced
+def _join(a, b):
+    ha, hb = height(a), height(b)
+    if ha > hb + 1:
+        t = _join(a.right, b)
+        if height(t) <= height(a.left) + 1:
+            return Node(a.left, t)
+        if height(t.left) <= height(t.right):
+            return Node(Node(a.left, t.left), t.right)
+        return Node(Node(a.left, t.left.left), Node(t.left.right, t.right))
+    if hb > ha + 1:
+        t = _join(a, b.left)
+        if height(t) <= height(b.right) + 1:
+            return Node(t, b.right)
+        if height(t.right) <= height(t.left):
+            return Node(t.left, Node(t.right, b.right))
+        return Node(Node(t.left, t.right.left), Node(t.right.right, b.right))
+    return Node(a, b)
+
+#the rope with a leaf added to the end of its last leaf, or None if that leaf is too full.
+#copies the last leaf and the path to it
+def _merge_last(rope, leaf):
+    if type(rope) is not Node:
+        return rope + leaf if len(rope) + len(leaf) <= LEAF else None
+    right = _merge_last(rope.right, leaf)
+    return None if right is None else Node(rope.left, right)
+
+def _merge_first(leaf, rope):
+    if type(rope) is not Node:
+        return leaf + rope if len(rope) + len(leaf) <= LEAF else None
+    left = _merge_first(leaf, rope.left)
+    return None if left is None else Node(left, rope.right)
+
+#returns the rope of a followed by b
+def concat(a, b):
+    if size(a) == 0:
+        return b
+    if size(b) == 0:
+        return a
+    if type(a) is not Node and type(b) is not Node:
+        if len(a) + len(b) <= LEAF:
+            return a + b
+    elif type(b) is not Node and len(b) < SMALL:
+        merged = _merge_last(a, b)
+        if merged is not None:
+            return merged
+    elif type(a) is not Node and len(a) < SMALL:
+        merged = _merge_first(a, b)
+        if merged is not None:
+            return merged
+    return _join(a, b)
+
+#returns (first i cards, the rest)
+def split(rope, i):
+    if i <= 0:
+        return EMPTY, rope
+    if i >= size(rope):
+        return rope, EMPTY
+    if type(rope) is not Node:
+        return rope[:i], rope[i:]
+    left_size = size(rope.left)
+    if i < left_size:
+        a, b = split(rope.left, i)
+        return a, concat(b, rope.right)
+    a, b = split(rope.right, i - left_size)
+    return concat(rope.left, a), b
+
+def get(rope, i) -> int:
+    while type(rope) is Node:
+        left_size = size(rope.left)
+        if i < left_size:
+            rope = rope.left
+        else:
+            i -= left_size
+            rope = rope.right
+    return rope[i]
+
+#returns a rope with the card at i replaced. copies one leaf and the path to it
+def replace(rope, i, packed):
+    if type(rope) is not Node:
+        leaf = array("I", rope)
+        leaf[i] = packed
+        return leaf
+    left_size = size(rope.left)
+    if i < left_size:
+        return Node(replace(rope.left, i, packed), rope.right)
+    return Node(rope.left, replace(rope.right, i - left_size, packed))
+
+#yields the leaves in order
+def leaves(rope):
+    stack = [rope]
+    while stack:
+        rope = stack.pop()
+        if type(rope) is Node:
+            stack.append(rope.right)
+            stack.append(rope.left)
+        elif len(rope):
+            yield rope
+
+def to_array(rope) -> array:
+    if type(rope) is not Node:
+        return rope
+    out = array("I")
+    for leaf in leaves(rope):
+        out.extend(leaf)
+    return out
@@ -0,0 +1,376 @@
+from actor import RoomActor, new_room_actor
+from registry import RoomRegistry, IDLE_TTL, MEMORY_BUDGET
+from broadcast import SEND_QUEUE_SIZE, SLOW_CLIENT_POLICY
+from metrics import FRAMES_DROPPED, SLOW_DISCONNECTS
+from coalesce import MOVE_WINDOW
+from bisect import bisect
+from metrics import snapshot, merge, merge_gauges
+from tracing import TRACER, ProfileBusy, start_profile, profile_path
+from collections import deque
+import asyncio
+import hashlib
+import itertools
+import multiprocessing
+import os
+import threading
+
+# Sharded mode. Rooms are spread over worker processes by consistent hashing of
+# the invite code, so a busy room only slows the rooms on its own worker.
+# The process serving websockets (the front) gives each socket a connection id
+# and routes its commands to the room's shard. Each shard runs ordinary
+# RoomActors against stand-in sockets that pass frames back to the front, which
+# writes them to the real sockets.
+#
+# A stand-in socket never blocks, so a slow client's frames pile up at the
+# front, and the slow client policy (see broadcast.py) is applied there: with
+# "latest" the front drops what is queued and asks the shard for the current
+# state, with "disconnect" it closes the socket.
+#
+# Messages to a shard:
+# ("join", room id, connection id, player name, mode, encoding[, (resume epoch, resume version)[, view]])
+# ("leave", room id, connection id, player name)
+# ("action", room id, connection id, action message)
+# ("watch", room id, connection id, encoding)
+# ("unwatch", room id, connection id)
+# ("resync", room id, connection id)
+# ("error", room id, connection id, error message)
+# ("metrics", None, request id)
+# ("trace", None, None, rate, directory)
+# ("profile", room id or None, None, mode, seconds, path)
+# Messages from a shard:
+# ("send", connection id, frame)
+# ("close", connection id, close code)
+# ("evicted", room id, None)
+# ("stats", None, RoomRegistry.stats()) after every sweep
+# ("metrics", request id, (process id, metrics.snapshot(), RoomRegistry.gauges()))
+
+###
+### Hash ring
+###
+class HashRing:
+    #arg1 list of shard names
+    #arg2 points on the ring per shard. more points spread rooms more evenly
+    def __init__(self, nodes, replicas=64):
+        self.points = sorted(
+            (self.hash(f"{node}:{i}"), node)
+            for node in nodes
+            for i in range(replicas)
+        )
+        self.keys = [point for point, _ in self.points]
+
+    @staticmethod
+    def hash(key: str) -> int:
+        return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+    #shard a room lives on
+    def node_for(self, key: str):
+        i = bisect(self.keys, self.hash(key)) % len(self.keys)
+        return self.points[i][1]
+
+###
+### Shard side
+###
+# Looks like a websocket to RoomChannel, but hands frames to the front
+class RemoteSocket:
+    def __init__(self, conn_id, deliver):
+        self.conn_id = conn_id
+        self.deliver = deliver
+
+    async def send_text(self, text):
+        self.deliver(("send", self.conn_id, text))
+
+    async def send_bytes(self, data):
+        self.deliver(("send", self.conn_id, data))
+
+    async def close(self, code=1000):
+        self.deliver(("close", self.conn_id, code))
+
+# The rooms on one shard. Rooms are set up the first time they are used
+class ShardHost:
+    #arg1 callable taking a message for the front
+    def __init__(self, deliver, send_queue_size=SEND_QUEUE_SIZE, slow_client_policy=SLOW_CLIENT_POLICY, move_window=MOVE_WINDOW, data_dir=None,
+                 idle_ttl=IDLE_TTL, memory_budget=MEMORY_BUDGET, pinned=()):
+        self.deliver = deliver
+        self.send_queue_size = send_queue_size
+        self.slow_client_policy = slow_client_policy
+        self.move_window = move_window
+        self.data_dir = data_dir
+        self.rooms = RoomRegistry(self.new_actor, idle_ttl, memory_budget, pinned,
+                                  on_evict=lambda room_id: deliver(("evicted", room_id, None)),
+                                  on_sweep=lambda stats: deliver(("stats", None, stats)))
+        self.sockets = {}
+
+    @property
+    def actors(self) -> dict:
+        return self.rooms.actors
+
+    def new_actor(self, room_id) -> RoomActor:
+        return new_room_actor(room_id, self.send_queue_size, self.slow_client_policy, self.move_window, self.data_dir)
+
+    def actor(self, room_id) -> RoomActor:
+        return self.rooms.get(room_id)
+
+    def handle(self, message):
+        kind, room_id, conn_id, *args = message
+        if kind == "open":
+            self.actor(room_id).submit("open", None)
+            return
+        if kind == "metrics":
+            self.deliver(("metrics", conn_id, (os.getpid(), snapshot(), self.rooms.gauges())))
+            return
+        if kind == "trace":
+            TRACER.configure(*args)
+            return
+        if kind == "profile":
+            mode, seconds, path = args
+            try:
+                start_profile(mode, seconds, path, room_id)
+            except ProfileBusy as e:
+                # shards in the front's process share its session
+                print(f"profile {path} not started: {e}")
+            return
+        if kind in ("join", "watch"):
+            self.sockets[conn_id] = RemoteSocket(conn_id, self.deliver)
+        socket = self.sockets.get(conn_id)
+        if socket is None:
+            return
+        if kind in ("leave", "unwatch"):
+            del self.sockets[conn_id]
+        self.actor(room_id).submit(kind, socket, *args)
+
+# A shard in this process. Used in tests and when sharding is off
+class LocalShard:
+    def __init__(self, deliver, **settings):
+        self.host = ShardHost(deliver, **settings)
+
+    def start(self):
+        self.host.rooms.start()
+
+    def submit(self, message):
+        self.host.handle(message)
+
+    def stop(self):
+        self.host.rooms.stop()
+
+# reads a multiprocessing queue on a thread and hands each message to a loop
+def pump(queue, loop, handle):
+    while True:
+        message = queue.get()
+        if message is None:
+            return
+        loop.call_soon_threadsafe(handle, message)
+
+def run_worker(inbox, outbox, settings):
+    async def main():
+        host = ShardHost(outbox.put, **settings)
+        host.rooms.start()
+        done = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        thread = threading.Thread(target=lambda: (pump(inbox, loop, host.handle), loop.call_soon_threadsafe(done.set)), daemon=True)
+        thread.start()
+        await done.wait()
+        host.rooms.stop()
+    asyncio.run(main())
+
+# A shard in its own worker process
+class ProcessShard:
+    def __init__(self, deliver, **settings):
+        context = multiprocessing.get_context("spawn")
+        self.deliver = deliver
+        self.inbox = context.Queue()
+        self.outbox = context.Queue()
+        self.process = context.Process(target=run_worker, args=(self.inbox, self.outbox, settings), daemon=True)
+
+    def start(self):
+        self.process.start()
+        loop = asyncio.get_running_loop()
+        threading.Thread(target=pump, args=(self.outbox, loop, self.deliver), daemon=True).start()
+
+    def submit(self, message):
+        self.inbox.put(message)
+
+    def stop(self):
+        self.inbox.put(None)
+        self.outbox.put(None)
+        self.process.join(timeout=5)
+
+###
+### Front side
+###
+# Frames from a shard for one websocket, written in order by their own task
+# so a slow socket only delays itself
+class FrontConnection:
+    #arg3 slow client policy
+    #arg4 asks the room's shard to send this socket the current state again
+    def __init__(self, socket, max_queue, policy, resync):
+        self.socket = socket
+        self.max_queue = max_queue
+        self.policy = policy
+        self.resync = resync
+        self.queue = deque()
+        self.ready = asyncio.Event()
+        self.task = asyncio.create_task(self.writer())
+
+    def send(self, frame):
+        if len(self.queue) >= self.max_queue:
+            if self.policy == "disconnect":
+                SLOW_DISCONNECTS.inc()
+                self.close(1013)
+                return
+            # frames already on their way from the shard are still written before the new state.
+            # delta clients skip the patches that don't apply, as they would after any gap
+            FRAMES_DROPPED.inc(amount=len(self.queue))
+            self.queue.clear()
+            self.resync()
+        self.queue.append(frame)
+        self.ready.set()
+
+    async def writer(self):
+        try:
+            while True:
+                while not self.queue:
+                    self.ready.clear()
+                    await self.ready.wait()
+                frame = self.queue.popleft()
+                if isinstance(frame, bytes):
+                    await self.socket.send_bytes(frame)
+                else:
+                    await self.socket.send_text(frame)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            pass
+
+    def close(self, code=None):
+        self.task.cancel()
+        if code is not None:
+            asyncio.create_task(self.socket.close(code=code))
+
+class ShardRouter:
+    #arg1 number of shards
+    #arg2 makes a shard from a deliver callable and settings. default ProcessShard
+    #arg3 most frames waiting for one socket before the slow client policy applies. default the send_queue_size setting
+    def __init__(self, count, make_shard=ProcessShard, max_queue=None, **settings):
+        self.shards = {
+            name: make_shard(lambda message, name=name: self.deliver(message, name), **settings)
+            for name in (f"shard-{i}" for i in range(count))
+        }
+        self.ring = HashRing(list(self.shards))
+        self.max_queue = max_queue or settings.get("send_queue_size", SEND_QUEUE_SIZE)
+        self.policy = settings.get("slow_client_policy", SLOW_CLIENT_POLICY)
+        self.ids = itertools.count()
+        self.conn_ids = {}
+        self.connections = {}
+        self.on_evict = None
+        # latest stats from each shard
+        self.shard_stats = {}
+        # request id -> future for a metrics reply
+        self.metric_requests = {}
+
+    def start(self):
+        for shard in self.shards.values():
+            shard.start()
+
+    def stop(self):
+        for shard in self.shards.values():
+            shard.stop()
+
+    def shard_for(self, room_id):
+        return self.shards[self.ring.node_for(room_id)]
+
+    #same as RoomActor.submit, for the room's shard
+    def submit(self, room_id, kind, socket, *args):
+        if kind == "open":
+            self.shard_for(room_id).submit(("open", room_id, None))
+            return
+        if kind in ("join", "watch"):
+            conn_id = next(self.ids)
+            self.conn_ids[socket] = conn_id
+            # watchers always get the latest state, like RoomChannel.watch
+            policy = self.policy if kind == "join" else "latest"
+            resync = lambda room_id=room_id, conn_id=conn_id: self.shard_for(room_id).submit(("resync", room_id, conn_id))
+            self.connections[conn_id] = FrontConnection(socket, self.max_queue, policy, resync)
+        conn_id = self.conn_ids.get(socket)
+        if conn_id is None:
+            return
+        if kind in ("leave", "unwatch"):
+            del self.conn_ids[socket]
+            self.connections.pop(conn_id).close()
+        self.shard_for(room_id).submit((kind, room_id, conn_id, *args))
+
+    #rooms and memory summed over the shards, as of their last sweeps
+    def stats(self) -> dict:
+        total = {"rooms": 0, "bytes": 0, "evicted": 0, "pinned": 0, "catalog_bytes": 0}
+        for stats in self.shard_stats.values():
+            for key in total:
+                total[key] += stats[key]
+        return total
+
+    #metrics of every shard and of the front's own sockets. shards in this process
+    #share its counters, so each process is counted once. a shard that doesn't
+    #answer in time is left out
+    async def metrics(self, timeout=5) -> tuple[dict, dict]:
+        replies = await asyncio.gather(*(self.shard_metrics(shard, timeout) for shard in self.shards.values()))
+        snapshots = {os.getpid(): snapshot()}
+        gauges = []
+        for pid, snap, shard_gauges in filter(None, replies):
+            snapshots.setdefault(pid, snap)
+            gauges.append(shard_gauges)
+        queues = [len(connection.queue) for connection in self.connections.values()]
+        gauges.append({"send_queue_frames": sum(queues), "send_queue_max_frames": max(queues, default=0)})
+        return merge(snapshots.values()), merge_gauges(gauges)
+
+    async def shard_metrics(self, shard, timeout):
+        request_id = next(self.ids)
+        future = self.metric_requests[request_id] = asyncio.get_running_loop().create_future()
+        shard.submit(("metrics", None, request_id))
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            del self.metric_requests[request_id]
+
+    def trace(self, rate, directory):
+        TRACER.configure(rate, directory)
+        for shard in self.shards.values():
+            shard.submit(("trace", None, None, rate, directory))
+
+    #profiles one room on its shard, or every shard and the front if room_id is None.
+    #each process writes its own file
+    #returns the files that will be written. raises ProfileBusy if the front is already profiling
+    def profile(self, room_id, mode, seconds, directory) -> list:
+        if room_id is not None:
+            name = self.ring.node_for(room_id)
+            path = profile_path(directory, room_id, mode, f"-{name}")
+            self.shards[name].submit(("profile", room_id, None, mode, seconds, path))
+            return [path]
+        paths = [profile_path(directory, None, mode, "-front")]
+        start_profile(mode, seconds, paths[0])
+        for name, shard in self.shards.items():
+            paths.append(profile_path(directory, None, mode, f"-{name}"))
+            shard.submit(("profile", None, None, mode, seconds, paths[-1]))
+        return paths
+
+    #handles a message from a shard
+    def deliver(self, message, shard=None):
+        kind, conn_id, arg = message
+        if kind == "evicted":
+            if self.on_evict is not None:
+                self.on_evict(conn_id)
+            return
+        if kind == "stats":
+            self.shard_stats[shard] = arg
+            return
+        if kind == "metrics":
+            future = self.metric_requests.get(conn_id)
+            if future is not None and not future.done():
+                future.set_result(arg)
+            return
+        connection = self.connections.get(conn_id)
+        if connection is None:
+            return
+        if kind == "send":
+            connection.send(arg)
+        elif kind == "close":
+            connection.close(arg)
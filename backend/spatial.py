@@ -0,0 +1,165 @@
+from pmap import PMap, EMPTY
+import copy
+import math
+
+# Where decks are on the table, so the server can tell which deck something was
+# dropped on (drop_at) or which decks are in an area without looking at every
+# deck. Decks are drawn like the client draws them: each card is
+# CARD_WIDTH x CARD_HEIGHT, and card i of a deck is STACK_OFFSET * i right of
+# and below the deck's position, with later cards on top.
+#
+# The table is cut into CELL x CELL squares and each square lists the decks
+# that reach into it, so a point only has to be checked against the decks in
+# its own square. A deck tall enough to reach into more than MAX_CELLS squares
+# (hundreds of cards) is kept in a short list of wide decks that every query
+# checks instead, so updating a deck never costs more than MAX_CELLS squares.
+# Like Room, a DeckGrid is never changed in place. put and
+# remove return a new grid that shares what didn't change: everything is kept in
+# persistent maps (see pmap.py), so moving a deck only copies the paths to its
+# entries and a kept undo version costs what the action changed.
+CARD_WIDTH = 120
+CARD_HEIGHT = 168
+STACK_OFFSET = 2
+CELL = 256
+MAX_CELLS = 9
+
+#(left, top, right, bottom) of everything a deck covers, or None if it has no cards or no position
+def deck_box(deck):
+    n = len(deck.cards)
+    if n == 0 or len(deck.position) != 2:
+        return None
+    x, y = deck.position
+    spread = STACK_OFFSET * (n - 1)
+    return (x, y, x + CARD_WIDTH + spread, y + CARD_HEIGHT + spread)
+
+def _cell_range(box):
+    left, top, right, bottom = box
+    return range(math.floor(left / CELL), math.floor(right / CELL) + 1), range(math.floor(top / CELL), math.floor(bottom / CELL) + 1)
+
+def _cell_count(box) -> int:
+    xs, ys = _cell_range(box)
+    return len(xs) * len(ys)
+
+def _cells(box):
+    xs, ys = _cell_range(box)
+    for cx in xs:
+        for cy in ys:
+            yield cx, cy
+
+#index of the top card of a deck that covers a point, or None
+#arg1 deck box (see deck_box)
+#arg2 point x
+#arg3 point y
+def card_at(box, x, y):
+    left, top, right, bottom = box
+    if not (left <= x <= right and top <= y <= bottom):
+        return None
+    last = round((right - left - CARD_WIDTH) / STACK_OFFSET)
+    # card i covers the point if left + STACK_OFFSET * i <= x <= left + STACK_OFFSET * i + CARD_WIDTH, same for y
+    lo = max(0, math.ceil((x - CARD_WIDTH - left) / STACK_OFFSET), math.ceil((y - CARD_HEIGHT - top) / STACK_OFFSET))
+    hi = min(last, math.floor((x - left) / STACK_OFFSET), math.floor((y - top) / STACK_OFFSET))
+    return hi if lo <= hi else None
+
+class DeckGrid:
+    def __init__(self):
+        # deck id -> (box, z). a higher z is drawn on top
+        self.boxes = PMap()
+        # (cell x, cell y) -> PMap of deck id -> (box, z) for the decks that reach into it
+        self.cells = PMap()
+        # deck id -> (box, z) for decks that reach into more than MAX_CELLS cells
+        self.wide = PMap()
+        self.next_z = 0
+
+    #a grid of every deck in a decks dict, stacked in the dict's order
+    @staticmethod
+    def build(decks: dict) -> "DeckGrid":
+        grid = DeckGrid()
+        for deck_id, deck in decks.items():
+            grid = grid.put(deck_id, deck)
+        return grid
+
+    #the grid with a deck added or moved to where it is now. a new deck goes on top.
+    #a deck with no cards keeps its place in the stack but can't be found
+    def put(self, deck_id, deck) -> "DeckGrid":
+        box = deck_box(deck)
+        old = self.boxes.get(deck_id)
+        if old is not None and old[0] == box:
+            return self
+        grid = copy.copy(self)
+        if old is None:
+            z = grid.next_z
+            grid.next_z += 1
+            grid._move(deck_id, None, box, z)
+        else:
+            z = old[1]
+            grid._move(deck_id, old[0], box, z)
+        grid.boxes = grid.boxes.set(deck_id, (box, z))
+        return grid
+
+    def remove(self, deck_id) -> "DeckGrid":
+        old = self.boxes.get(deck_id)
+        if old is None:
+            return self
+        grid = copy.copy(self)
+        grid.boxes = grid.boxes.delete(deck_id)
+        grid._move(deck_id, old[0], None, old[1])
+        return grid
+
+    #cells a box is listed in, or None for a wide deck
+    @staticmethod
+    def _cells_of(box):
+        if box is None:
+            return set()
+        if _cell_count(box) > MAX_CELLS:
+            return None
+        return set(_cells(box))
+
+    # changes the grid in place, so only call it on a new copy.
+    # cells the deck isn't in, and the other decks in its cells, are shared with the old grid
+    def _move(self, deck_id, old_box, new_box, z):
+        old, new = self._cells_of(old_box), self._cells_of(new_box)
+        if old is None:
+            self.wide = self.wide.delete(deck_id)
+            old = set()
+        if new is None:
+            self.wide = self.wide.set(deck_id, (new_box, z))
+            new = set()
+        cells = self.cells
+        for cell in old - new:
+            decks = cells[cell].delete(deck_id)
+            cells = cells.set(cell, decks) if decks else cells.delete(cell)
+        for cell in new:
+            cells = cells.set(cell, cells.get(cell, EMPTY).set(deck_id, (new_box, z)))
+        self.cells = cells
+
+    #(deck id, (box, z)) of the decks listed in some cells and of every wide deck
+    def _candidates(self, cells):
+        for cell in cells:
+            yield from self.cells.get(cell, EMPTY).items()
+        yield from self.wide.items()
+
+    #the top deck at a point and the index of its top card there, or (None, None)
+    #arg3 optional. deck id to skip, like the deck being dragged
+    def at(self, x, y, exclude=None) -> tuple:
+        best = (None, None)
+        best_z = -1
+        for deck_id, (box, z) in self._candidates([(math.floor(x / CELL), math.floor(y / CELL))]):
+            if deck_id == exclude or z < best_z:
+                continue
+            index = card_at(box, x, y)
+            if index is not None:
+                best, best_z = (deck_id, index), z
+        return best
+
+    #ids of the decks that reach into a rectangle, bottom to top
+    def within(self, left, top, right, bottom) -> list:
+        if _cell_count((left, top, right, bottom)) > len(self.cells):
+            # bigger than the table. faster to look at every deck
+            candidates = self.boxes.items()
+        else:
+            candidates = set(self._candidates(_cells((left, top, right, bottom))))
+        found = []
+        for deck_id, (box, z) in candidates:
+            if box is not None and box[0] <= right and left <= box[2] and box[1] <= bottom and top <= box[3]:
+                found.append((z, deck_id))
+        return [deck_id for _, deck_id in sorted(found)]
@@ -0,0 +1,111 @@
+import pytest
+from actions import DISPATCHER, Dispatcher, Field, Int, Str, Bool, Position
+from bigroom import BigRoom
+from room import Room
+
+
+def test_dispatch_applies_action():
+    room, error = DISPATCHER.dispatch(Room(), {"action": "initialize_deck", "args": {"pos": [3, 4]}})
+    assert error is None
+    assert room.decks["standard_52_0"].position == [3, 4]
+
+
+def test_optional_args_get_defaults():
+    room, _ = DISPATCHER.dispatch(Room(), {"action": "initialize_deck", "args": {}})
+    room, _ = DISPATCHER.dispatch(room, {"action": "initialize_deck"})
+    assert room.decks["standard_52_1"].position == [0, 0]
+    after, error = DISPATCHER.dispatch(room, {"action": "remove_top", "args": {"deck_id": "standard_52_0"}})
+    assert error is None
+    assert len(after.decks["standard_52_0"].cards) == 51
+
+
+@pytest.mark.parametrize("message, error", [
+    ("draw", "invalid_message"),
+    ({"action": "teleport", "args": {}}, "unknown_action"),
+    ({"args": {}}, "unknown_action"),
+    ({"action": "move_deck", "args": {"deck_id": "standard_52_0", "x": 1}}, "invalid_args"),
+    ({"action": "move_deck", "args": {"deck_id": "standard_52_0", "x": "1", "y": 1}}, "invalid_args"),
+    ({"action": "move_deck", "args": {"deck_id": "standard_52_0", "x": 2**70, "y": 1}}, "invalid_args"),
+    ({"action": "move_deck", "args": {"deck_id": "standard_52_0", "x": float("nan"), "y": 1}}, "invalid_args"),
+    ({"action": "move_deck", "args": {"deck_id": "standard_52_0", "x": 1, "y": float("-inf")}}, "invalid_args"),
+    ({"action": "split_deck", "args": {"deck_id": "standard_52_0", "n": 5, "pos": [0, 1e300]}}, "invalid_args"),
+    ({"action": "remove_top", "args": {"deck_id": "standard_52_0", "n": True}}, "invalid_args"),
+    ({"action": "remove_top", "args": {"deck_id": "standard_52_0", "n": 0}}, "invalid_args"),
+    ({"action": "add_top", "args": {"deck_id": "standard_52_0", "card": {"card_front": 5}}}, "invalid_args"),
+    ({"action": "shuffle", "args": ["standard_52_0"]}, "invalid_args"),
+    ({"action": "shuffle", "args": {"deck_id": "nope"}}, "not_found"),
+])
+def test_bad_messages_are_rejected_without_changes(message, error):
+    room, _ = DISPATCHER.dispatch(Room(), {"action": "initialize_deck", "args": {}})
+    after, rejected = DISPATCHER.dispatch(room, message)
+    assert after is room
+    assert rejected["type"] == "error"
+    assert rejected["error"] == error
+
+
+def test_fields_have_to_check():
+    with pytest.raises(TypeError):
+        Field()
+
+
+def test_bigroom_only_bumps_version_on_change():
+    bigroom = BigRoom()
+    assert bigroom.updateState({"action": "shuffle", "args": {"deck_id": "nope"}})["error"] == "not_found"
+    assert bigroom.version == 0
+    assert bigroom.updateState({"action": "initialize_deck", "args": {}}) is None
+    assert bigroom.version == 1
+
+
+def test_stats_count_calls_and_errors():
+    dispatcher = Dispatcher()
+
+    @dispatcher.action("nudge", n=Int(min=0), label=Str("x"), up=Bool(None, nullable=True), at=Position([0, 0]))
+    def nudge(room, n, label, up, at):
+        return room
+
+    dispatcher.dispatch(Room(), {"action": "nudge", "args": {"n": 1}})
+    dispatcher.dispatch(Room(), {"action": "nudge", "args": {"n": -1}})
+    stats = dispatcher.stats_snapshot()["nudge"]
+    assert stats["calls"] == 2
+    assert stats["errors"] == 1
+    assert stats["seconds"] >= stats["max_seconds"] > 0
+
+
+def deal(hands, n):
+    return {"action": "batch", "args": {"actions": [
+        {"action": "draw_card", "args": {"hand_id": hand_id, "deck_id": "standard_52_0"}}
+        for _ in range(n) for hand_id in hands
+    ]}}
+
+
+def test_batch_applies_all_actions_as_one_change():
+    bigroom = BigRoom()
+    bigroom.updateState({"action": "initialize_deck"})
+    for i in range(4):
+        bigroom.room = bigroom.room.initialize_hand()[0]
+    version = bigroom.version
+    assert bigroom.updateState(deal(["empty_0", "empty_1", "empty_2", "empty_3"], 5)) is None
+    assert bigroom.version == version + 1
+    assert [len(hand.cards) for hand in bigroom.room.hands.values()] == [5, 5, 5, 5]
+    assert len(bigroom.room.decks["standard_52_0"].cards) == 32
+
+
+def test_batch_is_all_or_nothing():
+    bigroom = BigRoom()
+    bigroom.updateState({"action": "initialize_deck"})
+    bigroom.room = bigroom.room.initialize_hand()[0]
+    before, version = bigroom.room, bigroom.version
+    error = bigroom.updateState(deal(["empty_0", "missing"], 1))
+    assert error["action"] == "batch"
+    assert error["error"] == "not_found"
+    assert error["index"] == 1
+    assert bigroom.room is before
+    assert bigroom.version == version
+
+
+def test_batch_rejects_nesting_and_bad_envelopes():
+    room = Room()
+    _, error = DISPATCHER.dispatch(room, {"action": "batch", "args": {"actions": [{"action": "batch", "args": {"actions": []}}]}})
+    assert error["error"] == "invalid_args"
+    _, error = DISPATCHER.dispatch(room, {"action": "batch", "args": {"actions": {"action": "shuffle"}}})
+    assert error["error"] == "invalid_args"
@@ -0,0 +1,107 @@
+import asyncio
+import json
+import pytest
+from actor import RoomActor
+from bigroom import BigRoom
+from broadcast import RoomChannel
+from test_broadcast import FakeSocket, drain
+
+
+def make_actor(move_window=0.01):
+    bigroom = BigRoom()
+    return RoomActor(bigroom, RoomChannel(bigroom), move_window)
+
+
+@pytest.mark.asyncio
+async def test_commands_apply_in_order_with_increasing_versions():
+    actor = make_actor()
+    socket = FakeSocket()
+    actor.submit("join", socket, "Evan", "full", "json")
+    actor.submit("action", socket, {"action": "initialize_deck"})
+    for _ in range(10):
+        actor.submit("action", socket, {"action": "remove_top", "args": {"deck_id": "standard_52_0"}})
+    await actor.idle()
+    await drain(actor.channel)
+    versions = [json.loads(text)["version"] for text in socket.sent]
+    assert versions == sorted(versions) == list(range(versions[0], versions[0] + 12))
+    assert len(actor.bigroom.room.decks["standard_52_0"].cards) == 42
+
+
+@pytest.mark.asyncio
+async def test_submit_does_not_wait_for_the_room():
+    actor = make_actor()
+    socket = FakeSocket()
+    actor.submit("join", socket, "Evan", "full", "json")
+    actor.submit("action", socket, {"action": "initialize_deck"})
+    assert actor.bigroom.version == 0
+    await actor.idle()
+    assert actor.bigroom.version == 2
+
+
+@pytest.mark.asyncio
+async def test_errors_and_leaves_go_through_the_queue():
+    actor = make_actor()
+    sender, other = FakeSocket(), FakeSocket()
+    actor.submit("join", sender, "Evan", "full", "json")
+    actor.submit("join", other, "Ben", "full", "json")
+    actor.submit("action", sender, {"action": "shuffle", "args": {"deck_id": "missing"}})
+    await actor.idle()
+    await drain(actor.channel)
+    assert json.loads(sender.sent[-1])["error"] == "not_found"
+    assert len(other.sent) == 1
+
+    actor.submit("leave", sender, "Evan")
+    actor.submit("resync", sender)
+    await actor.idle()
+    assert actor.bigroom.players == ["Ben"]
+    assert sender not in actor.channel.connections
+
+
+@pytest.mark.asyncio
+async def test_held_moves_are_applied_by_the_actor():
+    actor = make_actor()
+    socket = FakeSocket()
+    actor.submit("join", socket, "Evan", "full", "json")
+    actor.submit("action", socket, {"action": "initialize_deck"})
+    for x in range(5):
+        actor.submit("action", socket, {"action": "move_deck", "args": {"deck_id": "standard_52_0", "x": x, "y": x}})
+    await actor.idle()
+    assert actor.bigroom.room.decks["standard_52_0"].position == [0, 0]
+    await asyncio.sleep(0.03)
+    await actor.idle()
+    assert actor.bigroom.room.decks["standard_52_0"].position == [4, 4]
+
+
+@pytest.mark.asyncio
+async def test_bad_command_does_not_stop_the_room():
+    actor = make_actor()
+    socket = FakeSocket()
+    actor.submit("leave", socket, "nobody")
+    actor.submit("join", socket, "Evan", "full", "json")
+    await actor.idle()
+    assert actor.bigroom.players == ["Evan"]
+
+
+@pytest.mark.asyncio
+async def test_spectators_are_not_players_and_share_one_frame():
+    actor = make_actor()
+    player = FakeSocket()
+    spectators = [FakeSocket() for _ in range(100)]
+    actor.submit("join", player, "Evan", "full", "json")
+    for socket in spectators:
+        actor.submit("watch", socket, "json")
+    actor.submit("action", player, {"action": "initialize_deck"})
+    actor.submit("action", player, {"action": "initialize_hand", "args": {"owner": "Evan"}})
+    actor.submit("action", player, {"action": "draw_card", "args": {"hand_id": "empty_0", "deck_id": "standard_52_0"}})
+    await actor.idle()
+    await drain(actor.channel)
+
+    assert actor.bigroom.players == ["Evan"]
+    assert all(socket.sent[-1] is spectators[0].sent[-1] for socket in spectators)
+    room = json.loads(spectators[0].sent[-1])["room"]
+    assert room["hands"]["empty_0"] == {"cards": [], "hand_id": "empty_0", "owner": "Evan", "count": 1}
+    assert all(card["card_front"] == "" for card in room["decks"]["standard_52_0"]["cards"])
+
+    actor.submit("unwatch", spectators[0])
+    await actor.idle()
+    assert spectators[0] not in actor.channel.connections
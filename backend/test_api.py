@@ -1,3 +1,4 @@
+import main
 from main import app
 from fastapi.testclient import TestClient
 
@@ -41,4 +42,16 @@ def test_good_join():
     assert response.status_code == 200
     data2 = response.json()
     assert "code" in data2
-    assert data["code"] == data2["code"]
\ No newline at end of file
+    assert data["code"] == data2["code"]
+def test_only_admins_can_see_the_whole_table(monkeypatch):
+    monkeypatch.setattr(main, "admin_token", "secret")
+    with TestClient(app) as client:
+        with client.websocket_connect("/ws/mcI5j0Ky?view=all") as ws:
+            ws.send_text("Ma")
+            assert ws.receive_json() == {"status": "error"}
+        with client.websocket_connect("/ws/mcI5j0Ky?view=all", headers={"X-Admin-Token": "wrong"}) as ws:
+            ws.send_text("Ma")
+            assert ws.receive_json() == {"status": "error"}
+        with client.websocket_connect("/ws/mcI5j0Ky?view=all", headers={"X-Admin-Token": "secret"}) as ws:
+            ws.send_text("Ma")
+            assert ws.receive_json()["players"] == ["Ma"]
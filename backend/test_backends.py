@@ -0,0 +1,235 @@
+import asyncio
+import json
+import pytest
+from actions import stamp
+from backends import Broker, BrokerBackend, InMemoryBackend
+from test_broadcast import FakeSocket
+
+
+async def settle(*backends):
+    for _ in range(20):
+        await asyncio.sleep(0.01)
+        for backend in backends:
+            for actor in backend.actors.values():
+                await actor.idle()
+
+
+def state(backend, room_id):
+    bigroom = backend.actors[room_id].bigroom
+    return {"players": bigroom.players, "room": bigroom.room.to_wire()}
+
+
+@pytest.mark.asyncio
+async def test_in_memory_backend_runs_rooms_here():
+    backend = InMemoryBackend()
+    socket = FakeSocket()
+    backend.submit("room", "join", socket, "Evan", "full", "json")
+    backend.submit("room", "action", socket, {"action": "initialize_deck"})
+    await settle(backend)
+    assert json.loads(socket.sent[-1])["room"]["decks"]["standard_52_0"]["position"] == [0, 0]
+
+
+@pytest.mark.asyncio
+async def test_servers_sharing_a_broker_see_the_same_room():
+    broker = Broker()
+    await broker.start()
+    east, west = BrokerBackend("127.0.0.1", broker.port), BrokerBackend("127.0.0.1", broker.port)
+    east.start()
+    west.start()
+    try:
+        evan, ben = FakeSocket(), FakeSocket()
+        east.submit("room", "join", evan, "Evan", "full", "json")
+        await settle(east, west)
+        west.submit("room", "join", ben, "Ben", "full", "json")
+        east.submit("room", "action", evan, {"action": "initialize_deck"})
+        await settle(east, west)
+        west.submit("room", "action", ben, {"action": "shuffle", "args": {"deck_id": "standard_52_0"}})
+        east.submit("room", "action", evan, {"action": "move_card", "args": {"deck_id": "standard_52_0", "card_index": 3, "new_position": [9, 9]}})
+        west.submit("room", "action", ben, {"action": "teleport"})
+        await settle(east, west)
+
+        assert state(east, "room") == state(west, "room")
+        assert state(east, "room")["players"] == ["Evan", "Ben"]
+        assert len(state(east, "room")["room"]["decks"]) == 2
+        evan_frames = [json.loads(text) for text in evan.sent]
+        ben_frames = [json.loads(text) for text in ben.sent]
+        assert [f for f in ben_frames if f.get("type") == "error"][0]["error"] == "unknown_action"
+        assert not any(f.get("type") == "error" for f in evan_frames)
+        assert evan_frames[-1]["room"] == [f for f in ben_frames if "room" in f][-1]["room"]
+
+        # a server that joins the room late replays everything so far
+        late, nathan = BrokerBackend("127.0.0.1", broker.port), FakeSocket()
+        late.start()
+        late.submit("room", "join", nathan, "Nathan", "full", "json")
+        east.submit("room", "leave", evan, "Evan")
+        await settle(east, west, late)
+        assert state(late, "room") == state(west, "room")
+        assert state(late, "room")["players"] == ["Ben", "Nathan"]
+        late.stop()
+    finally:
+        east.stop()
+        west.stop()
+        await broker.stop()
+
+
+@pytest.mark.asyncio
+async def test_moves_are_coalesced_before_they_are_published():
+    broker = Broker()
+    await broker.start()
+    east, west = BrokerBackend("127.0.0.1", broker.port), BrokerBackend("127.0.0.1", broker.port)
+    east.start()
+    west.start()
+    try:
+        evan = FakeSocket()
+        east.submit("room", "join", evan, "Evan", "full", "json")
+        east.submit("room", "action", evan, {"action": "initialize_deck"})
+        for x in range(10):
+            east.submit("room", "action", evan, {"action": "move_deck", "args": {"deck_id": "standard_52_0", "x": x, "y": x}})
+        await settle(east, west)
+        # rooms apply every move as it comes, so every server applies the same ones
+        assert east.actors["room"].mover.window == 0
+        moves = [command for command in broker.rooms["room"].commands if command[0] == "action" and command[2]["action"] == "move_deck"]
+        assert len(moves) == 1
+        assert state(east, "room")["room"]["decks"]["standard_52_0"]["position"] == [9, 9]
+    finally:
+        east.stop()
+        west.stop()
+        await broker.stop()
+
+
+@pytest.mark.asyncio
+async def test_broker_keeps_a_state_instead_of_every_command():
+    broker = Broker(compact_every=5)
+    await broker.start()
+    east = BrokerBackend("127.0.0.1", broker.port)
+    east.start()
+    late = BrokerBackend("127.0.0.1", broker.port)
+    try:
+        evan = FakeSocket()
+        east.submit("room", "join", evan, "Evan", "full", "json")
+        for _ in range(6):
+            east.submit("room", "action", evan, {"action": "initialize_deck"})
+            await settle(east)
+        east.submit("room", "action", evan, {"action": "undo"})
+        east.submit("room", "action", evan, {"action": "flip_deck", "args": {"deck_id": "standard_52_0"}})
+        await settle(east)
+        room = broker.rooms["room"]
+        assert room.first == 5
+        assert len(room.commands) == 4
+
+        # a late server starts from the state, undo history and all
+        late.start()
+        nathan = FakeSocket()
+        late.submit("room", "join", nathan, "Nathan", "full", "json", None, "all")
+        await settle(east, late)
+        assert state(late, "room") == state(east, "room")
+        late.submit("room", "action", nathan, {"action": "undo"})
+        late.submit("room", "action", nathan, {"action": "undo"})
+        await settle(east, late)
+        assert state(late, "room") == state(east, "room")
+        assert len(state(late, "room")["room"]["decks"]) == 4
+        assert json.loads(nathan.sent[-1])["room"] == state(late, "room")["room"]
+    finally:
+        east.stop()
+        late.stop()
+        await broker.stop()
+
+
+@pytest.mark.asyncio
+async def test_broker_turns_away_servers_without_its_token():
+    broker = Broker(token="secret")
+    await broker.start()
+    good, bad = BrokerBackend("127.0.0.1", broker.port, "secret"), BrokerBackend("127.0.0.1", broker.port, "guess")
+    good.start()
+    bad.start()
+    try:
+        evan, ben = FakeSocket(), FakeSocket()
+        good.submit("room", "join", evan, "Evan", "full", "json")
+        bad.submit("other", "join", ben, "Ben", "full", "json")
+        await settle(good, bad)
+        assert state(good, "room")["players"] == ["Evan"]
+        assert "other" not in broker.rooms
+        assert not bad.actors
+    finally:
+        good.stop()
+        bad.stop()
+        await broker.stop()
+
+
+@pytest.mark.asyncio
+async def test_servers_reconnect_and_catch_up():
+    broker = Broker()
+    await broker.start()
+    east, west = BrokerBackend("127.0.0.1", broker.port), BrokerBackend("127.0.0.1", broker.port)
+    east.start()
+    west.start()
+    try:
+        evan, ben = FakeSocket(), FakeSocket()
+        east.submit("room", "join", evan, "Evan", "full", "json")
+        west.submit("room", "join", ben, "Ben", "full", "json")
+        await settle(east, west)
+        for writer in list(broker.rooms["room"].subscribers):
+            writer.close()
+        # sent while the connections are down
+        east.submit("room", "action", evan, {"action": "initialize_deck"})
+        west.submit("room", "action", ben, {"action": "initialize_deck"})
+        for _ in range(5):
+            await settle(east, west)
+        assert len(broker.rooms["room"].subscribers) == 2
+        assert state(east, "room") == state(west, "room")
+        assert len(state(east, "room")["room"]["decks"]) == 2
+        # everything was applied once, even though both servers were sent the room again
+        assert east.actors["room"].bigroom.version == 4
+    finally:
+        east.stop()
+        west.stop()
+        await broker.stop()
+
+
+@pytest.mark.asyncio
+async def test_rooms_opened_on_one_server_can_be_joined_on_another():
+    broker = Broker()
+    await broker.start()
+    east, west = BrokerBackend("127.0.0.1", broker.port), BrokerBackend("127.0.0.1", broker.port)
+    codes = {east: [], west: []}
+    east.on_open, west.on_open = codes[east].append, codes[west].append
+    east.start()
+    west.start()
+    try:
+        await settle(east, west)
+        east.submit("ABCD1234", "open", None)
+        await settle(east, west)
+        assert codes == {east: [], west: ["ABCD1234"]}
+
+        evan, ben = FakeSocket(), FakeSocket()
+        west.submit("ABCD1234", "join", ben, "Ben", "full", "json")
+        east.submit("ABCD1234", "join", evan, "Evan", "full", "json")
+        await settle(east, west)
+        assert state(east, "ABCD1234")["players"] == ["Ben", "Evan"]
+
+        # a server that starts later is told every code so far
+        late = BrokerBackend("127.0.0.1", broker.port)
+        opened = []
+        late.on_open = opened.append
+        late.start()
+        await settle(late)
+        assert opened == ["ABCD1234"]
+        late.stop()
+    finally:
+        east.stop()
+        west.stop()
+        await broker.stop()
+
+def test_rooms_cant_be_saved_with_a_broker(tmp_path):
+    with pytest.raises(ValueError):
+        BrokerBackend("127.0.0.1", 9000, data_dir=str(tmp_path))
+
+def test_stamp_fills_random_choices_once():
+    shuffle = {"action": "shuffle", "args": {"deck_id": "d"}}
+    stamped = stamp(shuffle)
+    assert "seed" not in shuffle["args"]
+    assert isinstance(stamped["args"]["seed"], int)
+    batch = stamp({"action": "batch", "args": {"actions": [shuffle, {"action": "move_card", "args": {}}]}})
+    assert "seed" in batch["args"]["actions"][0]["args"]
+    assert batch["args"]["actions"][1]["args"]["new_deck_id"].startswith("card_")
+    assert stamp("junk") == "junk"
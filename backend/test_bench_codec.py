@@ -0,0 +1,16 @@
+import json
+from dataclasses_serialization.json import JSONSerializer
+import bench_codec
+from codec import dumps
+
+
+def test_benchmark_runs():
+    results = bench_codec.run(sizes=[1, 2], repeat=2)
+    assert set(results) == {1, 2}
+    assert all(time > 0 for result in results.values() for time in result.values())
+
+
+def test_old_and_new_encode_the_same_room():
+    bigroom = bench_codec.make_room(2)
+    old = JSONSerializer.deserialize(bench_codec.OldBigRoom, bigroom.to_wire())
+    assert json.loads(json.dumps(JSONSerializer.serialize(old))) == json.loads(dumps(bigroom.to_wire()))
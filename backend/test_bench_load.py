@@ -0,0 +1,27 @@
+import asyncio
+import pytest
+import bench_load
+
+# Runs a short load against the app on a thread, so it needs no server running
+# beforehand. Every player's actions have to come back to it, in both modes.
+# How many actions fit in the time depends on the machine, so it's a bench test.
+
+
+@pytest.mark.bench
+@pytest.mark.parametrize("mode", ["delta", "full"])
+def test_every_action_comes_back(mode):
+    results = asyncio.run(bench_load.load(bench_load.ThreadServer(), rooms=2, players=3, seconds=1, rate=40, mode=mode))
+    assert results["actions"] > 50
+    assert results["timeouts"] == 0
+    assert results["errors"] == 0
+    assert {"drag", "shuffle", "draw", "split", "merge"} <= set(results["latency"])
+    # drags from the same room can share a broadcast, but everyone in it gets each one
+    assert results["messages_per_sec"] >= results["actions_per_sec"]
+    assert results["server_cpu"] > 0
+
+
+def test_percentile():
+    assert bench_load.percentile([], 50) is None
+    assert bench_load.percentile(list(range(100)), 50) == 50
+    assert bench_load.percentile(list(range(100)), 99) == 99
+    assert bench_load.percentile([3, 1, 2], 99) == 3
@@ -0,0 +1,25 @@
+import pytest
+import bench_room
+
+# Guards against Room operations going back to copying whole decks. Deck sizes
+# grow 100x between the smallest and the largest room, so anything that copies
+# the deck slows down by far more than the allowed factor.
+MAX_SLOWDOWN = 8
+
+
+@pytest.mark.bench
+def test_room_operations_do_not_scale_with_deck_size():
+    operations = {name: op for name, op in bench_room.OPERATIONS.items() if name not in bench_room.LINEAR}
+    results = bench_room.run(sizes=[52, 5200], repeat=50, operations=operations)
+    slow = {name: times[5200] / times[52] for name, times in results.items() if times[5200] > times[52] * MAX_SLOWDOWN}
+    assert slow == {}
+
+
+def test_benchmarked_operations_return_new_rooms():
+    room = bench_room.make_room(520)
+    before = room.to_wire()
+    for name, op in bench_room.OPERATIONS.items():
+        result = op(room)
+        new_room = result[0] if isinstance(result, (list, tuple)) else result
+        assert new_room is not room, name
+    assert room.to_wire() == before
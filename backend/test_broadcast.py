@@ -0,0 +1,282 @@
+import asyncio
+import json
+import pytest
+import broadcast
+from bigroom import BigRoom
+from broadcast import RoomChannel
+from delta import apply_patch
+
+
+class FakeSocket:
+    def __init__(self):
+        self.sent = []
+        self.closed_with = None
+
+    async def send_text(self, text):
+        self.sent.append(text)
+
+    async def close(self, code=1000):
+        self.closed_with = code
+
+
+    async def send_bytes(self, data):
+        self.sent.append(data)
+
+
+class StalledSocket(FakeSocket):
+    def __init__(self):
+        super().__init__()
+        self.release = asyncio.Event()
+
+    async def send_text(self, text):
+        await self.release.wait()
+        self.sent.append(text)
+
+
+async def drain(channel):
+    for _ in range(100):
+        await asyncio.sleep(0)
+        if not any(c.queue for c in channel.connections.values()):
+            break
+    await asyncio.sleep(0)
+
+
+def move(bigroom, x):
+    bigroom.updateState({"action": "move_deck", "args": {"deck_id": "standard_52_0", "x": x, "y": x}})
+
+
+@pytest.mark.asyncio
+async def test_broadcast_serializes_once_for_all_sockets(monkeypatch):
+    calls = []
+    encode = broadcast.encode
+    monkeypatch.setattr(broadcast, "encode", lambda message, encoding: calls.append(message) or encode(message, encoding))
+
+    bigroom = BigRoom()
+    channel = RoomChannel(bigroom)
+    sockets = [FakeSocket() for _ in range(10)]
+    for socket in sockets:
+        channel.add(socket)
+    await drain(channel)
+    calls.clear()
+
+    bigroom.updateState({"action": "initialize_deck", "args": {}})
+    channel.broadcast()
+    await drain(channel)
+
+    assert len(calls) == 1
+    assert all(socket.sent[-1] is sockets[0].sent[-1] for socket in sockets)
+    assert len(json.loads(sockets[0].sent[-1])["room"]["decks"]["standard_52_0"]["cards"]) == 52
+
+
+@pytest.mark.asyncio
+async def test_frame_cache_refreshes_after_change():
+    bigroom = BigRoom()
+    channel = RoomChannel(bigroom)
+    first = channel.full_frame()
+    assert channel.full_frame() is first
+    bigroom.addPlayer("Evan")
+    assert json.loads(channel.full_frame())["players"] == ["Evan"]
+
+
+@pytest.mark.asyncio
+async def test_delta_and_full_sockets_get_their_own_frames():
+    bigroom = BigRoom()
+    channel = RoomChannel(bigroom)
+    full, delta = FakeSocket(), FakeSocket()
+    channel.add(full)
+    channel.add(delta, "delta")
+    await drain(channel)
+
+    bigroom.updateState({"action": "initialize_deck", "args": {}})
+    channel.broadcast()
+    move(bigroom, 1)
+    channel.broadcast()
+    await drain(channel)
+
+    state = json.loads(delta.sent[0])["state"]
+    for text in delta.sent[1:]:
+        state = apply_patch(state, json.loads(text))
+    assert state == json.loads(full.sent[-1])
+    assert json.loads(delta.sent[-1])["deck_moves"] == {"standard_52_0": [1, 1]}
+
+
+@pytest.mark.asyncio
+async def test_join_broadcast_skips_full_sockets():
+    bigroom = BigRoom()
+    channel = RoomChannel(bigroom)
+    full, delta = FakeSocket(), FakeSocket()
+    channel.add(full)
+    channel.add(delta, "delta")
+    await drain(channel)
+    bigroom.addPlayer("Ben")
+    channel.broadcast(to_full=False)
+    await drain(channel)
+    assert len(full.sent) == 1
+    assert json.loads(delta.sent[-1])["players"] == ["Ben"]
+
+
+@pytest.mark.asyncio
+async def test_stalled_socket_does_not_delay_others():
+    bigroom = BigRoom()
+    bigroom.updateState({"action": "initialize_deck", "args": {}})
+    channel = RoomChannel(bigroom, max_queue=4)
+    fast, slow = FakeSocket(), StalledSocket()
+    channel.add(fast)
+    channel.add(slow)
+    for x in range(20):
+        move(bigroom, x)
+        channel.broadcast()
+        await asyncio.sleep(0)
+    await drain(channel)
+    assert len(fast.sent) == 21
+    assert slow.sent == []
+
+    slow.release.set()
+    await drain(channel)
+    assert channel.connections[slow].dropped > 0
+    assert len(slow.sent) < 21
+    assert json.loads(slow.sent[-1]) == json.loads(fast.sent[-1])
+
+
+@pytest.mark.asyncio
+async def test_stalled_delta_socket_gets_snapshot_then_resumes_patches():
+    bigroom = BigRoom()
+    bigroom.updateState({"action": "initialize_deck", "args": {}})
+    channel = RoomChannel(bigroom, max_queue=4)
+    slow = StalledSocket()
+    channel.add(slow, "delta")
+    for x in range(10):
+        move(bigroom, x)
+        channel.broadcast()
+    slow.release.set()
+    await drain(channel)
+    move(bigroom, 99)
+    channel.broadcast()
+    await drain(channel)
+
+    messages = [json.loads(text) for text in slow.sent]
+    snapshots = [i for i, m in enumerate(messages) if m["type"] == "snapshot"]
+    state = messages[snapshots[-1]]["state"]
+    for message in messages[snapshots[-1] + 1:]:
+        state = apply_patch(state, message)
+    assert state["room"]["decks"]["standard_52_0"]["position"] == [99, 99]
+
+
+@pytest.mark.asyncio
+async def test_disconnect_policy_closes_slow_socket():
+    bigroom = BigRoom()
+    bigroom.updateState({"action": "initialize_deck", "args": {}})
+    channel = RoomChannel(bigroom, max_queue=4, policy="disconnect")
+    slow = StalledSocket()
+    channel.add(slow)
+    for x in range(10):
+        move(bigroom, x)
+        channel.broadcast()
+    await drain(channel)
+    assert channel.connections[slow].closed
+    assert slow.closed_with == 1013
+
+
+@pytest.mark.asyncio
+async def test_msgpack_and_json_sockets_share_frames_per_encoding():
+    pytest.importorskip("msgpack")
+    from codec import decode
+    bigroom = BigRoom()
+    channel = RoomChannel(bigroom)
+    text_sockets = [FakeSocket() for _ in range(3)]
+    binary_sockets = [FakeSocket() for _ in range(3)]
+    for socket in text_sockets:
+        channel.add(socket)
+    for socket in binary_sockets:
+        channel.add(socket, "full", "msgpack")
+    bigroom.updateState({"action": "initialize_deck", "args": {}})
+    channel.broadcast()
+    await drain(channel)
+
+    assert all(socket.sent[-1] is binary_sockets[0].sent[-1] for socket in binary_sockets)
+    assert isinstance(binary_sockets[0].sent[-1], bytes)
+    assert decode(binary_sockets[0].sent[-1], "msgpack") == json.loads(text_sockets[0].sent[-1])
+
+
+@pytest.mark.asyncio
+async def test_send_to_reaches_only_one_socket():
+    bigroom = BigRoom()
+    channel = RoomChannel(bigroom)
+    sender, other = FakeSocket(), FakeSocket()
+    channel.add(sender, "delta")
+    channel.add(other)
+    await drain(channel)
+    error = bigroom.updateState({"action": "teleport"})
+    channel.send_to(sender, error)
+    await drain(channel)
+    assert json.loads(sender.sent[-1])["error"] == "unknown_action"
+    assert len(other.sent) == 1
+
+
+@pytest.mark.asyncio
+async def test_reconnecting_delta_socket_gets_only_missed_patches():
+    bigroom = BigRoom()
+    bigroom.updateState({"action": "initialize_deck", "args": {}})
+    channel = RoomChannel(bigroom, history=8)
+    first = FakeSocket()
+    channel.add(first, "delta")
+    await drain(channel)
+    snapshot = json.loads(first.sent[0])
+    state, epoch = snapshot["state"], snapshot["epoch"]
+    channel.remove(first)
+    for x in range(5):
+        move(bigroom, x)
+        channel.broadcast()
+
+    again = FakeSocket()
+    channel.add(again, "delta", resume=(epoch, state["version"]))
+    await drain(channel)
+    messages = [json.loads(text) for text in again.sent]
+    assert [m["type"] for m in messages] == ["patch"] * 5
+    assert all(m["epoch"] == epoch for m in messages)
+    for message in messages:
+        state = apply_patch(state, message)
+    assert state == bigroom.to_wire()
+
+    current = FakeSocket()
+    channel.add(current, "delta", resume=(epoch, bigroom.version))
+    await drain(channel)
+    assert current.sent == []
+
+
+@pytest.mark.asyncio
+async def test_resume_falls_back_to_snapshot():
+    bigroom = BigRoom()
+    bigroom.updateState({"action": "initialize_deck", "args": {}})
+    channel = RoomChannel(bigroom, history=4)
+    old = bigroom.version
+    for x in range(10):
+        move(bigroom, x)
+        channel.broadcast()
+    epoch = channel.tracker.epoch
+    behind, unknown, other_epoch, no_epoch = FakeSocket(), FakeSocket(), FakeSocket(), FakeSocket()
+    channel.add(behind, "delta", resume=(epoch, old))
+    channel.add(unknown, "delta", resume=(epoch, bigroom.version + 7))
+    # the same version from before the room was reloaded
+    channel.add(other_epoch, "delta", resume=(RoomChannel(bigroom).tracker.epoch, bigroom.version))
+    channel.add(no_epoch, "delta", resume=(None, bigroom.version))
+    await drain(channel)
+    for socket in (behind, unknown, other_epoch, no_epoch):
+        assert [json.loads(text)["type"] for text in socket.sent] == ["snapshot"]
+
+
+@pytest.mark.asyncio
+async def test_stalled_spectator_only_gets_the_latest_state():
+    bigroom = BigRoom()
+    bigroom.updateState({"action": "initialize_deck", "args": {}})
+    channel = RoomChannel(bigroom)
+    spectator = StalledSocket()
+    channel.watch(spectator)
+    for x in range(10):
+        move(bigroom, x)
+        channel.broadcast()
+    assert len(channel.connections[spectator].queue) <= 1
+    spectator.release.set()
+    await drain(channel)
+    assert json.loads(spectator.sent[-1])["version"] == bigroom.version
+    assert len(spectator.sent) <= 2
@@ -0,0 +1,65 @@
+import asyncio
+import json
+import pytest
+from bigroom import BigRoom
+from broadcast import RoomChannel
+from coalesce import MoveCoalescer
+from test_broadcast import FakeSocket, drain
+
+
+def move(deck_id, x):
+    return {"action": "move_deck", "args": {"deck_id": deck_id, "x": x, "y": x}}
+
+
+def setup(window=0.01):
+    bigroom = BigRoom()
+    bigroom.updateState({"action": "initialize_deck"})
+    bigroom.updateState({"action": "initialize_deck"})
+    channel = RoomChannel(bigroom)
+    socket = FakeSocket()
+    channel.add(socket)
+    return bigroom, channel, MoveCoalescer(bigroom, channel, window), socket
+
+
+@pytest.mark.asyncio
+async def test_moves_in_a_window_become_one_broadcast():
+    bigroom, channel, mover, socket = setup()
+    await drain(channel)
+    version = bigroom.version
+    for x in range(50):
+        assert mover.add(socket, move("standard_52_0", x))
+        mover.add(socket, move("standard_52_1", -x))
+    await asyncio.sleep(0.03)
+    await drain(channel)
+    assert bigroom.version == version + 2
+    assert len(socket.sent) == 2
+    decks = json.loads(socket.sent[-1])["room"]["decks"]
+    assert decks["standard_52_0"]["position"] == [49, 49]
+    assert decks["standard_52_1"]["position"] == [-49, -49]
+
+
+@pytest.mark.asyncio
+async def test_other_actions_flush_pending_moves_first():
+    bigroom, channel, mover, socket = setup(window=10)
+    mover.add(socket, move("standard_52_0", 5))
+    assert not mover.add(socket, {"action": "shuffle", "args": {"deck_id": "standard_52_0"}})
+    assert mover.flush()
+    assert bigroom.room.decks["standard_52_0"].position == [5, 5]
+    assert mover.timer is None
+    assert not mover.flush()
+
+
+@pytest.mark.asyncio
+async def test_rejected_move_errors_go_to_sender():
+    bigroom, channel, mover, socket = setup(window=10)
+    await drain(channel)
+    mover.add(socket, move("missing", 1))
+    assert not mover.flush()
+    await drain(channel)
+    assert json.loads(socket.sent[-1])["error"] == "not_found"
+
+
+@pytest.mark.asyncio
+async def test_zero_window_does_not_hold_moves():
+    bigroom, channel, mover, socket = setup(window=0)
+    assert not mover.add(socket, move("standard_52_0", 1))
@@ -0,0 +1,111 @@
+import importlib
+import json
+import sys
+import pytest
+from objects import Deck, Hand, Card
+from room import Room
+from bigroom import BigRoom
+import codec
+from codec import dumps, loads, compact, expand, negotiate
+from delta import DeltaTracker, make_snapshot
+from dataclasses_serialization.json import JSONSerializer
+
+
+def make_bigroom():
+    bigroom = BigRoom(players=["Evan", "Ben"])
+    bigroom.updateState({"action": "initialize_deck", "args": {"pos": [2, 2]}})
+    bigroom.updateState({"action": "flip_deck_card", "args": {"deck_id": "standard_52_0", "idx": 3, "face_up": True}})
+    bigroom.room, hand_id = bigroom.room.initialize_hand()
+    bigroom.room = bigroom.room.add_card_to_hand(hand_id, Card(card_front="lala", card_back="zaza", face_up=True))
+    return bigroom
+
+
+def test_to_wire_shape():
+    bigroom = BigRoom(players=["Evan"], room=Room(
+        decks={"d": Deck(id="d", position=[1, 2], cards=[Card(card_front="H2", face_up=True)])},
+        hands={"h": Hand(hand_id="h", cards=[Card(card_front="lala", card_back="zaza")])},
+    ))
+    assert bigroom.to_wire() == {
+        "players": ["Evan"],
+        "room": {
+            "players": [],
+            "decks": {"d": {"id": "d", "position": [1, 2], "cards": [{"card_front": "H2", "card_back": "", "face_up": True}]}},
+            "hands": {"h": {"cards": [{"card_front": "lala", "card_back": "zaza", "face_up": False}], "hand_id": "h"}},
+        },
+        "version": 0,
+    }
+
+
+def test_from_wire_round_trip():
+    bigroom = make_bigroom()
+    assert BigRoom.from_wire(bigroom.to_wire()) == bigroom
+    assert BigRoom.from_wire(loads(dumps(bigroom.to_wire()))) == bigroom
+    assert JSONSerializer.deserialize(BigRoom, loads(dumps(bigroom.to_wire()))) == bigroom
+
+
+def test_dumps_matches_send_json_format():
+    message = make_bigroom().to_wire()
+    message["players"].append("Zoë")
+    assert dumps(message) == json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+
+
+def test_card_from_wire_defaults_and_validation():
+    assert Card.from_wire({"card_front": "H2"}) == Card(card_front="H2")
+    with pytest.raises(ValueError):
+        Card.from_wire({"card_front": 2})
+    with pytest.raises(ValueError):
+        Card.from_wire({"card_front": "H2", "face_up": "yes"})
+
+
+def test_compact_round_trip():
+    bigroom = make_bigroom()
+    tracker = DeltaTracker(bigroom)
+    bigroom.updateState({"action": "remove_top", "args": {"deck_id": "standard_52_0", "n": 2}})
+    for message in [bigroom.to_wire(), make_snapshot(bigroom), tracker.advance(bigroom)]:
+        assert expand(compact(message)) == message
+
+
+def test_compact_uses_card_codes():
+    message = compact(make_bigroom().to_wire())
+    cards = message["room"]["decks"]["standard_52_0"]["cards"]
+    assert all(isinstance(card, int) for card in cards)
+    assert len(message["faces"]) == 53
+    assert message["faces"][cards[3] >> 1] == ["C2", ""]
+    assert cards[3] & 1 == 1
+
+
+def test_negotiate_prefers_subprotocol_then_query():
+    assert negotiate("json", []) == ("json", None)
+    assert negotiate("bogus", []) == ("json", None)
+    if "msgpack" in codec.ENCODINGS:
+        assert negotiate("msgpack", []) == ("msgpack", None)
+        assert negotiate("json", ["chat", "msgpack"]) == ("msgpack", "msgpack")
+
+
+@pytest.fixture
+def without_msgpack(monkeypatch):
+    monkeypatch.setitem(sys.modules, "msgpack", None)
+    yield importlib.reload(codec)
+    monkeypatch.undo()
+    importlib.reload(codec)
+
+
+def test_json_only_without_msgpack(without_msgpack):
+    assert without_msgpack.ENCODINGS == ["json"]
+    assert without_msgpack.negotiate("msgpack", ["msgpack"]) == ("json", None)
+    assert without_msgpack.decode_action(b'{"action": "shuffle"}') == {"action": "shuffle"}
+
+
+def test_msgpack_frames_are_smaller():
+    pytest.importorskip("msgpack")
+    message = make_bigroom().to_wire()
+    frame = codec.encode(message, "msgpack")
+    assert isinstance(frame, bytes)
+    assert len(frame) < len(dumps(message).encode()) / 3
+    assert codec.decode(frame, "msgpack") == message
+
+
+def test_dumps_falls_back_for_values_orjson_refuses():
+    message = {"position": [2**70, 1]}
+    assert dumps(message) == json.dumps(message, separators=(",", ":"))
+    assert loads(dumps(message)) == message
@@ -0,0 +1,84 @@
+import pytest
+from objects import Deck, Hand, Card
+from room import Room
+from bigroom import BigRoom
+from delta import diff_rooms, make_snapshot, apply_patch, DeltaTracker
+
+
+def test_diff_unchanged_room_is_empty():
+    room = Room(decks={"main": Deck(id="main", cards=[Card(card_front="A")])})
+    assert diff_rooms(room, room) == {}
+
+
+def test_diff_only_sends_changed_deck():
+    room = Room(decks={
+        "a": Deck(id="a", cards=[Card(card_front="A")]),
+        "b": Deck(id="b", cards=[Card(card_front="K")]),
+    })
+    new_room = room.remove_top("a")
+    patch = diff_rooms(room, new_room)
+    assert list(patch["decks"]) == ["a"]
+    assert patch["decks"]["a"]["cards"] == []
+    assert "hands" not in patch
+
+
+def test_diff_move_deck_sends_position_only():
+    room = Room(decks={"a": Deck(id="a", position=[0, 0], cards=[Card(card_front=str(i)) for i in range(52)])})
+    new_room = room.move_deck("a", 10, 20)
+    patch = diff_rooms(room, new_room)
+    assert patch == {"deck_moves": {"a": [10, 20]}}
+
+
+def test_diff_removed_deck_and_changed_hand():
+    room = Room(
+        decks={"a": Deck(id="a", cards=[Card(card_front="A")])},
+        hands={"h": Hand(hand_id="h", cards=[])},
+    )
+    new_room = room.draw_card("h", "a")
+    patch = diff_rooms(room, new_room)
+    assert patch["hands"]["h"]["cards"][0]["card_front"] == "A"
+
+    new_room, _ = room.remove_card_from_deck("a", 0)
+    assert diff_rooms(room, new_room) == {"decks": {"a": None}}
+
+
+def test_hand_changes_do_not_leak_into_old_room():
+    room = Room(hands={"h": Hand(hand_id="h", cards=[Card(card_front="3")])})
+    new_room = room.flip_hand_card("h", 0)
+    new_room = new_room.add_card_to_hand("h", Card(card_front="4"))
+    assert room.hands["h"].cards[0].face_up is False
+    assert len(room.hands["h"].cards) == 1
+    assert "h" in diff_rooms(room, new_room)["hands"]
+
+
+def test_patches_rebuild_full_state():
+    bigroom = BigRoom()
+    tracker = DeltaTracker(bigroom)
+    client = make_snapshot(bigroom)["state"]
+
+    bigroom.addPlayer("Evan")
+    bigroom.updateState({"action": "initialize_deck", "args": {"pos": [2, 2]}})
+    client = apply_patch(client, tracker.advance(bigroom))
+    bigroom.updateState({"action": "move_deck", "args": {"deck_id": "standard_52_0", "x": 5, "y": 6}})
+    client = apply_patch(client, tracker.advance(bigroom))
+    bigroom.updateState({"action": "remove_top", "args": {"deck_id": "standard_52_0", "n": 3}})
+    client = apply_patch(client, tracker.advance(bigroom))
+
+    assert client == bigroom.to_wire()
+
+
+def test_no_patch_when_action_changes_nothing():
+    bigroom = BigRoom()
+    tracker = DeltaTracker(bigroom)
+    bigroom.updateState({"action": "shuffle", "args": {"deck_id": "missing"}})
+    assert tracker.advance(bigroom) is None
+
+
+def test_apply_patch_rejects_wrong_base():
+    bigroom = BigRoom()
+    tracker = DeltaTracker(bigroom)
+    bigroom.addPlayer("Evan")
+    bigroom.addPlayer("Ben")
+    patch = tracker.advance(bigroom)
+    with pytest.raises(ValueError):
+        apply_patch({"version": 1, "players": [], "room": {}}, patch)
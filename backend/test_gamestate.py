@@ -1,5 +1,8 @@
 import pytest
-from objects import Deck, Hand, Card
+from objects import Deck, Hand, Card, CardList
+from actions import DISPATCHER
+from catalog import CATALOG, CardCatalog, CatalogFull
+import copy
 from room import Room
 
 
@@ -339,3 +342,139 @@ def test_room_initialize_hand():
 
     assert len(new_room.hands) == 1
     assert hand_id in new_room.hands
+
+
+def test_card_catalog_interns_faces():
+    assert CATALOG.code("H2") == CATALOG.code("H2")
+    assert CATALOG.code("H2") != CATALOG.code("H2", "red")
+    packed = CATALOG.pack("lala", "zaza", True)
+    assert CATALOG.face(packed) == ("lala", "zaza")
+    assert packed & 1 == 1
+
+
+def test_card_catalog_is_bounded(monkeypatch):
+    catalog = CardCatalog(max_faces=2)
+    catalog.code("H2")
+    catalog.code("H3")
+    with pytest.raises(CatalogFull):
+        catalog.code("H4")
+    assert catalog.code("H2") == 0
+    with pytest.raises(ValueError):
+        CardCatalog().code("x" * 65)
+    assert catalog.bytes > 0
+
+    monkeypatch.setattr(CATALOG, "max_faces", len(CATALOG.faces))
+    room, deck_id = Room().initialize_deck()
+    _, error = DISPATCHER.dispatch(room, {"action": "add_top", "args": {"deck_id": deck_id, "card": {"card_front": "never seen"}}})
+    assert error["error"] == "invalid_args"
+    room, error = DISPATCHER.dispatch(room, {"action": "add_top", "args": {"deck_id": deck_id, "card": {"card_front": "H2"}}})
+    assert error is None
+
+
+def test_deck_stores_packed_cards():
+    room, deck_id = Room().initialize_deck()
+    cards = room.decks[deck_id].cards
+    assert isinstance(cards, CardList)
+    assert cards.codes.itemsize == 4
+    assert cards[0] == Card(card_front="H2")
+    assert cards == [Card(card_front=c.card_front) for c in cards]
+
+
+def test_card_list_copy_is_independent():
+    cards = CardList([Card(card_front="A"), Card(card_front="K")])
+    copied = copy.copy(cards)
+    copied.append(Card(card_front="Q", face_up=True))
+    copied[0] = copied[0].flip()
+    assert [c.card_front for c in cards] == ["A", "K"]
+    assert cards[0].face_up is False
+    assert copied[2] == Card(card_front="Q", face_up=True)
+    assert copied.pop() == Card(card_front="Q", face_up=True)
+    assert len(copied) == 2
+
+
+def test_card_list_copy_shares_storage():
+    room, deck_id = Room().initialize_deck()
+    cards = room.decks[deck_id].cards
+    assert copy.copy(cards).rope is cards.rope
+    drawn = room.initialize_hand()[0].draw_card("empty_0", deck_id, 5)
+    assert [c.card_front for c in drawn.hands["empty_0"].cards] == [c.card_front for c in cards[-5:]][::-1]
+    assert len(drawn.decks[deck_id].cards) == 47
+    assert len(room.decks[deck_id].cards) == 52
+
+
+def test_card_list_slices_and_pop_like_a_list():
+    fronts = [str(i) for i in range(100)]
+    cards = CardList([Card(card_front=f) for f in fronts])
+    assert [c.card_front for c in cards[10:60]] == fronts[10:60]
+    assert [c.card_front for c in cards[-3:]] == fronts[-3:]
+    assert [c.card_front for c in cards[::10]] == fronts[::10]
+    assert cards[-1].card_front == "99"
+    assert cards.pop(50).card_front == "50"
+    assert [c.card_front for c in cards] == fronts[:50] + fronts[51:]
+    assert [c.card_front for c in cards.reversed()][:2] == ["99", "98"]
+
+
+def test_room_changes_do_not_copy_untouched_decks():
+    room = Room(decks={"main": Deck(id="main", cards=[Card(card_front=str(i)) for i in range(100)]),
+                       "other": Deck(id="other", cards=[Card(card_front="X")])})
+    flipped = room.flip_deck_card("main", 50)
+    assert flipped.decks["other"] is room.decks["other"]
+    assert flipped.decks["main"].cards[50].face_up is True
+    assert room.decks["main"].cards[50].face_up is False
+
+    merged = room.merge_decks("other", "main")
+    assert [c.card_front for c in merged.decks["main"].cards][-2:] == ["99", "X"]
+    assert len(room.decks["main"].cards) == 100
+
+    removed, card = room.remove_card_from_deck("main", 0)
+    assert card.card_front == "0"
+    assert len(removed.decks["main"].cards) == 99
+    assert len(room.decks["main"].cards) == 100
+
+
+def test_split_deck_names_new_deck():
+    room = Room(decks={"main": Deck(id="main", cards=[Card(card_front=str(i)) for i in range(6)])})
+    new_room, new_deck_id = room.split_deck("main", 2, [5, 5])
+    assert new_room.decks[new_deck_id].id == new_deck_id
+    assert new_room.decks[new_deck_id].position == [5, 5]
+
+
+def test_split_deck_needs_enough_cards():
+    room = Room(decks={"main": Deck(id="main", cards=[Card(card_front=str(i)) for i in range(4)])})
+    assert room.split_deck("main", 6, [5, 5]) == [room, ""]
+    new_room, new_deck_id = room.split_deck("main", 4, [5, 5])
+    assert [c.card_front for c in new_room.decks[new_deck_id].cards] == ["0", "1", "2", "3"]
+    assert len(new_room.decks["main"].cards) == 0
+
+
+def test_flip_deck_is_lazy_and_honored_everywhere():
+    fronts = [str(i) for i in range(10)]
+    room = Room(decks={"main": Deck(id="main", cards=[Card(card_front=f) for f in fronts])}, hands={"h": Hand(hand_id="h")})
+    flipped = room.flip_deck("main")
+    cards = flipped.decks["main"].cards
+    assert cards.rope is room.decks["main"].cards.rope
+    assert [c.card_front for c in cards] == fronts[::-1]
+    assert all(c.face_up for c in cards)
+    assert flipped.deck_peek("main").card_front == "0"
+    assert flipped.deck_peek("main", 0, True).card_front == "9"
+
+    drawn = flipped.draw_card("h", "main", 2)
+    assert [c.card_front for c in drawn.hands["h"].cards] == ["0", "1"]
+    assert drawn.decks["main"].to_wire()["cards"][0] == {"card_front": "9", "card_back": "", "face_up": True}
+    assert [c.card_front for c in flipped.decks["main"].remove_bottom(3).cards] == ["6", "5", "4", "3", "2", "1", "0"]
+
+    added = flipped.add_top("main", Card(card_front="new"))
+    assert added.deck_peek("main") == Card(card_front="new")
+    assert added.flip_deck("main").decks["main"].cards[0] == Card(card_front="new", face_up=True)
+    assert flipped.flip_deck("main").decks["main"].cards == room.decks["main"].cards
+
+
+def test_merging_flipped_and_upright_decks():
+    up = Deck(id="up", cards=[Card(card_front=str(i)) for i in range(5)])
+    down = Deck(id="down", cards=[Card(card_front=str(i)) for i in range(5, 8)]).flip_deck()
+    room = Room(decks={"up": up, "down": down})
+    merged = room.merge_decks("down", "up")
+    assert [(c.card_front, c.face_up) for c in merged.decks["up"].cards] == \
+        [(str(i), False) for i in range(5)] + [("7", True), ("6", True), ("5", True)]
+    merged = room.merge_decks("up", "down")
+    assert [c.card_front for c in merged.decks["down"].cards] == ["7", "6", "5", "0", "1", "2", "3", "4"]
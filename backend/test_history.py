@@ -0,0 +1,119 @@
+import pytest
+import bench_history
+from codec import loads
+from bigroom import BigRoom
+from history import RoomHistory
+from persist import RoomLog, WRITER
+
+
+def setup():
+    bigroom = BigRoom()
+    bigroom.updateState({"action": "initialize_deck"})
+    bigroom.updateState({"action": "move_deck", "args": {"deck_id": "standard_52_0", "x": 1, "y": 1}})
+    bigroom.updateState({"action": "flip_deck", "args": {"deck_id": "standard_52_0"}})
+    return bigroom
+
+
+def test_undo_and_redo_put_back_the_same_rooms():
+    bigroom = setup()
+    rooms = [past for _, past in bigroom.history.past] + [bigroom.room]
+    assert bigroom.updateState({"action": "undo"}) is None
+    assert bigroom.room is rooms[2]
+    bigroom.updateState({"action": "undo"})
+    assert bigroom.room is rooms[1]
+    assert bigroom.version == 5
+    bigroom.updateState({"action": "redo"})
+    assert bigroom.room is rooms[2]
+    bigroom.updateState({"action": "redo"})
+    assert bigroom.room is rooms[3]
+    assert bigroom.updateState({"action": "redo"})["error"] == "no_history"
+
+
+def test_new_action_drops_redo():
+    bigroom = setup()
+    bigroom.updateState({"action": "undo"})
+    bigroom.updateState({"action": "initialize_deck"})
+    assert bigroom.updateState({"action": "redo"})["error"] == "no_history"
+    assert len(bigroom.history.past) == 3
+
+
+def test_jump_to_version_goes_both_ways():
+    bigroom = setup()
+    moved = bigroom.history.past[-1][1]
+    assert bigroom.updateState({"action": "jump_to_version", "args": {"version": 2}}) is None
+    assert bigroom.room is moved
+    assert bigroom.updateState({"action": "jump_to_version", "args": {"version": 0}}) is None
+    assert bigroom.room.decks == {}
+    bigroom.updateState({"action": "jump_to_version", "args": {"version": 3}})
+    assert bigroom.room.decks["standard_52_0"].cards[0].face_up
+    for version in (-1, 99):
+        error = bigroom.updateState({"action": "jump_to_version", "args": {"version": version}})
+        assert error["error"] in ("invalid_args", "no_history")
+
+
+def test_oldest_versions_are_dropped_first():
+    history = RoomHistory(size=2)
+    bigroom = BigRoom(history=history)
+    for _ in range(4):
+        bigroom.updateState({"action": "initialize_deck"})
+    assert [version for version, _ in history.past] == [2, 3]
+    bigroom.updateState({"action": "undo"})
+    bigroom.updateState({"action": "undo"})
+    assert len(bigroom.room.decks) == 2
+    assert bigroom.updateState({"action": "undo"})["message"] == "nothing to undo"
+
+
+def play_with_history(bigroom):
+    bigroom.updateState({"action": "initialize_deck"})
+    bigroom.updateState({"action": "initialize_deck"})
+    bigroom.addPlayer("Evan")
+    bigroom.updateState({"action": "undo"})
+    bigroom.updateState({"action": "flip_deck", "args": {"deck_id": "standard_52_0"}})
+    bigroom.updateState({"action": "shuffle", "args": {"deck_id": "standard_52_0", "seed": 3}})
+    bigroom.updateState({"action": "undo"})
+    bigroom.log.close()
+
+
+@pytest.mark.parametrize("snapshot_every", [1000, 3])
+def test_undo_history_is_saved(tmp_path, snapshot_every):
+    bigroom = RoomLog(tmp_path, "room", fsync_interval=0, snapshot_every=snapshot_every).recover()
+    play_with_history(bigroom)
+    if snapshot_every == 1000:
+        # undo is a log entry like any other action
+        assert len((tmp_path / "room.log").read_bytes().splitlines()) == 6
+    recovered = RoomLog(tmp_path, "room").recover()
+    assert recovered.version == bigroom.version
+    assert recovered.room.to_wire() == bigroom.room.to_wire()
+    bigroom.log = recovered.log = None
+    for action in ({"action": "redo"}, {"action": "undo"}, {"action": "undo"}, {"action": "jump_to_version", "args": {"version": 4}},
+                   {"action": "undo"}, {"action": "undo"}):
+        assert recovered.updateState(action) == bigroom.updateState(action)
+        assert recovered.room.to_wire() == bigroom.room.to_wire()
+        assert recovered.version == bigroom.version
+
+
+def test_snapshots_write_shared_piles_once(tmp_path):
+    bigroom = RoomLog(tmp_path, "room", fsync_interval=0).recover()
+    for i in range(10):
+        bigroom.updateState({"action": "initialize_deck"})
+    for i in range(10):
+        bigroom.updateState({"action": "move_deck", "args": {"deck_id": "standard_52_0", "x": i, "y": i}})
+    bigroom.log.snapshot(bigroom)
+    bigroom.log.close()
+    WRITER.drain()
+    snapshot = loads((tmp_path / "room.snap").read_bytes())
+    assert len(snapshot["history"]["past"]) == 20
+    assert len(snapshot["decks"]) == 20
+    # moving a deck doesn't copy its cards
+    assert len(snapshot["cards"]) == 10
+    assert len(snapshot["faces"]) == 52
+    recovered = RoomLog(tmp_path, "room").recover()
+    first, last = recovered.history.past[-1][1], recovered.room
+    assert first.decks["standard_52_0"] is not last.decks["standard_52_0"]
+    assert first.decks["standard_52_0"].cards is last.decks["standard_52_0"].cards
+    assert first.decks["standard_52_1"] is last.decks["standard_52_1"]
+
+
+def test_kept_versions_share_unchanged_decks():
+    result = bench_history.run(100)
+    assert result["bytes_per_version"] < result["room_bytes"] / 4
@@ -0,0 +1,172 @@
+import asyncio
+import pytest
+import metrics
+from actions import DISPATCHER
+from backends import InMemoryBackend
+from broadcast import encode_frame
+from fastapi.testclient import TestClient
+from main import app
+from metrics import Counter, Histogram, snapshot, merge, merge_gauges, render
+from room import Room
+from shard import LocalShard, ProcessShard, ShardRouter
+from test_broadcast import FakeSocket, StalledSocket
+from test_shard import settle
+
+
+@pytest.fixture
+def fresh():
+    # the metrics each test makes are dropped again after it
+    before = list(metrics.METRICS)
+    yield
+    metrics.METRICS[:] = before
+
+
+def value(snap, name, *labels):
+    return snap[metrics.PREFIX + name].get(labels)
+
+
+#observations in a histogram snapshot value
+def count(snap, name, *labels):
+    return sum((value(snap, name, *labels) or [0])[:-1])
+
+
+def test_render_counters_and_histograms(fresh):
+    metrics.METRICS.clear()
+    calls = Counter("calls_total", "Calls", ("kind",))
+    latency = Histogram("latency_seconds", "Latency", ("kind",), buckets=(0.1, 1.0))
+    calls.inc("a")
+    calls.inc("a", amount=2)
+    calls.inc('say "hi"')
+    for seconds in (0.05, 0.1, 0.5, 3):
+        latency.observe(seconds, "a")
+    text = render(snapshot(), {"rooms": 2})
+    assert text.splitlines() == [
+        "# HELP sandbox_calls_total Calls",
+        "# TYPE sandbox_calls_total counter",
+        'sandbox_calls_total{kind="a"} 3',
+        'sandbox_calls_total{kind="say \\"hi\\""} 1',
+        "# HELP sandbox_latency_seconds Latency",
+        "# TYPE sandbox_latency_seconds histogram",
+        'sandbox_latency_seconds_bucket{kind="a",le="0.1"} 2',
+        'sandbox_latency_seconds_bucket{kind="a",le="1.0"} 3',
+        'sandbox_latency_seconds_bucket{kind="a",le="+Inf"} 4',
+        'sandbox_latency_seconds_sum{kind="a"} 3.65',
+        'sandbox_latency_seconds_count{kind="a"} 4',
+        *[line for name, (help, _) in metrics.GAUGES.items()
+          for line in (f"# HELP sandbox_{name} {help}", f"# TYPE sandbox_{name} gauge", f"sandbox_{name} {2 if name == 'rooms' else 0}")],
+    ]
+
+
+def test_snapshots_and_gauges_merge(fresh):
+    metrics.METRICS.clear()
+    calls = Counter("calls_total", "Calls")
+    latency = Histogram("latency_seconds", "Latency", buckets=(1.0,))
+    calls.inc()
+    latency.observe(0.5)
+    one = snapshot()
+    calls.inc()
+    latency.observe(2)
+    total = merge([one, snapshot()])
+    assert value(total, "calls_total") == 3
+    assert value(total, "latency_seconds") == [2, 1, 3.0]
+    gauges = merge_gauges([{"rooms": 1, "send_queue_max_frames": 4}, {"rooms": 2, "send_queue_max_frames": 3}])
+    assert gauges["rooms"] == 3
+    assert gauges["send_queue_max_frames"] == 4
+    assert gauges["sockets"] == 0
+
+
+def test_actions_are_timed_and_errors_counted():
+    before = snapshot()
+    room, _ = DISPATCHER.dispatch(Room(), {"action": "initialize_deck", "args": {}})
+    DISPATCHER.dispatch(room, {"action": "shuffle", "args": {"deck_id": "nope"}})
+    DISPATCHER.dispatch(room, {"action": "made_up"})
+    after = snapshot()
+    assert count(after, "action_seconds", "initialize_deck") == count(before, "action_seconds", "initialize_deck") + 1
+    assert value(after, "action_errors_total", "shuffle", "not_found") == (value(before, "action_errors_total", "shuffle", "not_found") or 0) + 1
+    assert value(after, "action_errors_total", "", "unknown_action") == (value(before, "action_errors_total", "", "unknown_action") or 0) + 1
+    assert ("made_up",) not in after[metrics.PREFIX + "action_seconds"]
+
+
+def test_batches_are_one_observation():
+    before = snapshot()
+    DISPATCHER.dispatch(Room(), {"action": "batch", "args": {"actions": [
+        {"action": "initialize_deck"},
+        {"action": "initialize_deck"},
+        {"action": "shuffle", "args": {"deck_id": "nope"}},
+    ]}})
+    after = snapshot()
+    assert count(after, "action_seconds", "batch") == count(before, "action_seconds", "batch") + 1
+    assert count(after, "action_seconds", "initialize_deck") == count(before, "action_seconds", "initialize_deck")
+    assert value(after, "action_errors_total", "batch", "not_found") == (value(before, "action_errors_total", "batch", "not_found") or 0) + 1
+    assert value(after, "action_errors_total", "shuffle", "not_found") == value(before, "action_errors_total", "shuffle", "not_found")
+
+
+def test_frame_sizes_are_bytes():
+    before = snapshot()
+    frame = encode_frame({"players": ["Zoë" * 100]}, "json", "full")
+    after = snapshot()
+    sizes = value(after, "frame_bytes", "full", "json")[-1] - (value(before, "frame_bytes", "full", "json") or [0])[-1]
+    assert sizes == len(frame.encode()) > len(frame)
+
+
+@pytest.mark.asyncio
+async def test_backend_gauges_and_frame_sizes():
+    backend = InMemoryBackend(send_queue_size=2, idle_ttl=None, memory_budget=None)
+    before = snapshot()
+    fast, slow = FakeSocket(), StalledSocket()
+    backend.submit("room", "join", fast, "Evan", "delta", "json")
+    backend.submit("room", "join", slow, "Ben", "full", "json")
+    for _ in range(5):
+        backend.submit("room", "action", fast, {"action": "initialize_deck"})
+    await backend.actor("room").idle()
+    await asyncio.sleep(0)
+
+    snap, gauges = await backend.metrics()
+    assert gauges["rooms"] == 1 and gauges["players"] == 2 and gauges["sockets"] == 2
+    # the stalled socket's queue was cut back to one resync
+    assert gauges["send_queue_max_frames"] == gauges["send_queue_frames"] == 1
+    assert value(snap, "frames_dropped_total") > (value(before, "frames_dropped_total") or 0)
+    assert count(snap, "frame_bytes", "patch", "json") >= count(before, "frame_bytes", "patch", "json") + 5
+    assert count(snap, "encode_seconds", "full", "json") > count(before, "encode_seconds", "full", "json")
+    slow.release.set()
+
+
+@pytest.mark.asyncio
+async def test_router_counts_each_process_once():
+    router = ShardRouter(2, make_shard=LocalShard, idle_ttl=None, memory_budget=None)
+    for i in range(4):
+        router.submit(f"room{i}", "join", FakeSocket(), "Evan", "full", "json")
+    await settle(router)
+    snap, gauges = await router.metrics()
+    assert snap == merge([snapshot()])
+    assert gauges["rooms"] == 4 and gauges["sockets"] == 4 and gauges["players"] == 4
+
+
+@pytest.mark.asyncio
+async def test_router_collects_metrics_from_worker_processes():
+    router = ShardRouter(2, make_shard=ProcessShard, idle_ttl=None, memory_budget=None)
+    router.start()
+    try:
+        here = count(snapshot(), "action_seconds", "initialize_deck")
+        socket = FakeSocket()
+        router.submit("room", "join", socket, "Evan", "full", "json")
+        router.submit("room", "action", socket, {"action": "initialize_deck"})
+        for _ in range(200):
+            snap, gauges = await router.metrics()
+            if count(snap, "action_seconds", "initialize_deck") > here and gauges["players"] == 1:
+                break
+            await asyncio.sleep(0.02)
+        # counted in the worker, not here
+        assert count(snap, "action_seconds", "initialize_deck") == here + 1
+        assert count(snapshot(), "action_seconds", "initialize_deck") == here
+        assert gauges["rooms"] == 1 and gauges["sockets"] == 1
+    finally:
+        router.stop()
+
+
+def test_metrics_endpoint():
+    response = TestClient(app).get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert "# TYPE sandbox_action_seconds histogram" in response.text
+    assert "sandbox_rooms " in response.text
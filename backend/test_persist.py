@@ -0,0 +1,162 @@
+import asyncio
+import os
+import threading
+import pytest
+from actions import stamp
+from actor import new_room_actor
+from backends import InMemoryBackend
+from bigroom import BigRoom
+from persist import RoomLog, WRITER, saved_rooms
+from test_broadcast import FakeSocket
+
+
+def play(bigroom):
+    bigroom.updateState({"action": "initialize_deck"})
+    bigroom.updateState(stamp({"action": "shuffle", "args": {"deck_id": "standard_52_0"}}))
+    bigroom.updateState({"action": "remove_top", "args": {"deck_id": "standard_52_0", "n": 3}})
+    bigroom.updateState(stamp({"action": "move_card", "args": {"deck_id": "standard_52_0", "card_index": 2, "new_position": [5, 5]}}))
+    bigroom.updateState({"action": "flip_deck", "args": {"deck_id": "standard_52_0"}})
+    # rejected actions aren't saved
+    bigroom.updateState({"action": "flip_deck", "args": {"deck_id": "nope"}})
+
+
+def test_recover_replays_the_log(tmp_path):
+    bigroom = RoomLog(tmp_path, "room", fsync_interval=0).recover()
+    play(bigroom)
+    bigroom.log.close()
+
+    recovered = RoomLog(tmp_path, "room").recover()
+    assert recovered.version == bigroom.version == 5
+    assert recovered.room.to_wire() == bigroom.room.to_wire()
+
+
+def test_snapshot_empties_the_log(tmp_path):
+    bigroom = RoomLog(tmp_path, "room", fsync_interval=0, snapshot_every=3).recover()
+    play(bigroom)
+    bigroom.log.close()
+    WRITER.drain()
+    assert (tmp_path / "room.snap").exists()
+    assert not (tmp_path / "room.log.old").exists()
+    assert len((tmp_path / "room.log").read_bytes().splitlines()) == 2
+
+    recovered = RoomLog(tmp_path, "room").recover()
+    assert recovered.version == 5
+    assert recovered.room.to_wire() == bigroom.room.to_wire()
+
+
+def test_torn_last_line_is_dropped(tmp_path):
+    bigroom = RoomLog(tmp_path, "room", fsync_interval=0).recover()
+    play(bigroom)
+    bigroom.log.close()
+    with open(tmp_path / "room.log", "ab") as f:
+        f.write(b'{"version": 6, "action": {"act')
+
+    recovered = RoomLog(tmp_path, "room", fsync_interval=0).recover()
+    assert recovered.version == 5
+    recovered.updateState({"action": "initialize_deck"})
+    recovered.log.close()
+    assert RoomLog(tmp_path, "room").recover().room.to_wire() == recovered.room.to_wire()
+
+
+@pytest.mark.asyncio
+async def test_appends_are_synced_in_groups(tmp_path):
+    bigroom = RoomLog(tmp_path, "room", fsync_interval=0.01).recover()
+    bigroom.updateState({"action": "initialize_deck"})
+    timer = bigroom.log.timer
+    bigroom.updateState({"action": "initialize_deck"})
+    assert timer is not None and bigroom.log.timer is timer
+    await asyncio.sleep(0.02)
+    assert bigroom.log.timer is None
+    assert len((tmp_path / "room.log").read_bytes().splitlines()) == 2
+
+
+@pytest.mark.asyncio
+async def test_backend_loads_saved_rooms(tmp_path):
+    for room_id in ("a", "b"):
+        bigroom = RoomLog(tmp_path, room_id, fsync_interval=0).recover()
+        bigroom.updateState({"action": "initialize_deck"})
+        bigroom.log.close()
+    (tmp_path / "notes.txt").write_text("")
+    assert saved_rooms(tmp_path) == ["a", "b"]
+    assert saved_rooms(tmp_path / "missing") == []
+
+    backend = InMemoryBackend(data_dir=tmp_path)
+    backend.start()
+    assert sorted(backend.actors) == ["a", "b"]
+    await backend.actors["a"].idle()
+    assert backend.actors["a"].bigroom.version == 1
+    backend.stop()
+
+
+@pytest.mark.asyncio
+async def test_rooms_load_off_the_event_loop(tmp_path, monkeypatch):
+    bigroom = RoomLog(tmp_path, "room", fsync_interval=0).recover()
+    play(bigroom)
+    bigroom.log.close()
+    threads = []
+    recover = RoomLog.recover
+    monkeypatch.setattr(RoomLog, "recover", lambda log: (threads.append(threading.get_ident()), recover(log))[1])
+
+    actor = new_room_actor("room", data_dir=tmp_path)
+    socket = FakeSocket()
+    # queued while the room loads, and applied to the loaded room
+    actor.submit("join", socket, "Evan", "full", "json")
+    actor.submit("action", socket, {"action": "flip_deck", "args": {"deck_id": "standard_52_0"}})
+    await actor.idle()
+    assert threads and threading.get_ident() not in threads
+    assert actor.bigroom.players == ["Evan"]
+    assert actor.bigroom.version == bigroom.version + 2
+    assert actor.channel.bigroom is actor.bigroom
+    actor.bigroom.log.close()
+    assert RoomLog(tmp_path, "room").recover().room.to_wire() == actor.bigroom.room.to_wire()
+
+def test_bad_room_ids_are_not_saved(tmp_path):
+    with pytest.raises(ValueError):
+        RoomLog(tmp_path, "../escape")
+    assert BigRoom().log is None
+
+
+def test_disk_writes_are_off_the_calling_thread(tmp_path, monkeypatch):
+    threads = []
+    fsync = os.fsync
+    monkeypatch.setattr(os, "fsync", lambda fd: (threads.append(threading.get_ident()), fsync(fd)))
+    bigroom = RoomLog(tmp_path, "room", fsync_interval=0, snapshot_every=3).recover()
+    play(bigroom)
+    bigroom.log.close()
+    WRITER.drain()
+    assert threads and threading.get_ident() not in threads
+
+
+def test_unfinished_snapshot_is_finished_on_recovery(tmp_path):
+    bigroom = RoomLog(tmp_path, "room", fsync_interval=0).recover()
+    play(bigroom)
+    bigroom.log.close()
+    WRITER.drain()
+    # as if the process died after a snapshot started a new log but before it was written
+    (tmp_path / "room.log").rename(tmp_path / "room.log.old")
+    bigroom.log = RoomLog(tmp_path, "room", fsync_interval=0)
+    bigroom.log.file = open(tmp_path / "room.log", "ab")
+    bigroom.updateState({"action": "flip_deck", "args": {"deck_id": "standard_52_0"}})
+    bigroom.log.close()
+    assert saved_rooms(tmp_path) == ["room"]
+
+    recovered = RoomLog(tmp_path, "room").recover()
+    assert recovered.version == 6
+    assert recovered.room.to_wire() == bigroom.room.to_wire()
+    assert not (tmp_path / "room.log.old").exists()
+    assert (tmp_path / "room.log").read_bytes() == b""
+    recovered.log.close()
+    assert RoomLog(tmp_path, "room").recover().room.to_wire() == bigroom.room.to_wire()
+
+
+def test_one_snapshot_at_a_time(tmp_path):
+    bigroom = RoomLog(tmp_path, "room", fsync_interval=0, snapshot_every=1).recover()
+    bigroom.log.snapshotting = True
+    bigroom.updateState({"action": "initialize_deck"})
+    bigroom.updateState({"action": "initialize_deck"})
+    assert len((tmp_path / "room.log").read_bytes().splitlines()) == 2
+    bigroom.log.snapshotting = False
+    assert bigroom.log.snapshot(bigroom)
+    bigroom.log.close()
+    WRITER.drain()
+    assert RoomLog(tmp_path, "room").recover().version == 2
@@ -0,0 +1,59 @@
+import random
+from pmap import PMap, Node
+
+
+class SameHash:
+    def __init__(self, name):
+        self.name = name
+
+    def __hash__(self):
+        return 7
+
+    def __eq__(self, other):
+        return isinstance(other, SameHash) and other.name == self.name
+
+
+def test_matches_a_dict():
+    rng = random.Random(3)
+    expected, pmap = {}, PMap()
+    for _ in range(5000):
+        key = rng.randrange(800)
+        if rng.random() < 0.3:
+            expected.pop(key, None)
+            pmap = pmap.delete(key)
+        else:
+            expected[key] = rng.random()
+            pmap = pmap.set(key, expected[key])
+        assert len(pmap) == len(expected)
+    assert dict(pmap.items()) == expected
+    assert all(pmap[key] == value for key, value in expected.items())
+    assert pmap.get(-1) is None and -1 not in pmap
+
+
+def test_old_maps_are_unchanged():
+    first = PMap().set("a", 1).set("b", 2)
+    second = first.set("a", 3).delete("b")
+    assert dict(first.items()) == {"a": 1, "b": 2}
+    assert dict(second.items()) == {"a": 3}
+    assert first.delete("missing") is first
+    assert first.set("b", first["b"]) is first
+
+
+def test_changes_share_the_rest_of_the_map():
+    pmap = PMap()
+    for i in range(1000):
+        pmap = pmap.set(i, i)
+    changed = pmap.set(500, -1)
+    shared = [a is b for a, b in zip(pmap.root.slots, changed.root.slots)]
+    assert shared.count(False) == 1
+    assert all(type(slot) is Node for slot in pmap.root.slots)
+
+
+def test_equal_hashes():
+    a, b, c = SameHash("a"), SameHash("b"), SameHash("c")
+    pmap = PMap().set(a, 1).set(b, 2).set(c, 3).set(b, 4)
+    assert len(pmap) == 3
+    assert (pmap[a], pmap[b], pmap[c]) == (1, 4, 3)
+    pmap = pmap.delete(a).delete(c)
+    assert dict(pmap.items()) == {b: 4}
+    assert pmap.delete(b) == PMap()
@@ -0,0 +1,92 @@
+import json
+import pytest
+import broadcast
+from actor import RoomActor
+from bigroom import BigRoom
+from broadcast import RoomChannel
+from delta import apply_patch
+from test_broadcast import FakeSocket, drain
+
+
+def setup():
+    bigroom = BigRoom()
+    bigroom.updateState({"action": "initialize_deck"})
+    bigroom.updateState({"action": "initialize_hand", "args": {"owner": "Evan"}})
+    bigroom.updateState({"action": "initialize_hand", "args": {"owner": "Ben"}})
+    bigroom.updateState({"action": "draw_card", "args": {"hand_id": "empty_0", "deck_id": "standard_52_0", "n": 2}})
+    bigroom.updateState({"action": "draw_card", "args": {"hand_id": "empty_1", "deck_id": "standard_52_0", "n": 3}})
+    bigroom.updateState({"action": "flip_deck_card", "args": {"deck_id": "standard_52_0", "idx": 0}})
+    return bigroom
+
+
+@pytest.mark.asyncio
+async def test_players_see_own_hand_and_counts_of_others():
+    bigroom = setup()
+    channel = RoomChannel(bigroom)
+    evan, everything = FakeSocket(), FakeSocket()
+    channel.add(evan, viewer="Evan")
+    channel.add(everything)
+    await drain(channel)
+
+    room = json.loads(evan.sent[-1])["room"]
+    assert room["hands"]["empty_0"] == bigroom.room.hands["empty_0"].to_wire()
+    assert room["hands"]["empty_1"]["cards"] == []
+    assert room["hands"]["empty_1"]["count"] == 3
+    cards = room["decks"]["standard_52_0"]["cards"]
+    assert cards[0]["face_up"] and cards[0]["card_front"] != ""
+    assert all(card["card_front"] == "" for card in cards[1:])
+    assert json.loads(everything.sent[-1]) == bigroom.to_wire()
+
+
+@pytest.mark.asyncio
+async def test_views_are_encoded_once_per_visibility_class(monkeypatch):
+    calls = []
+    encode = broadcast.encode
+    monkeypatch.setattr(broadcast, "encode", lambda message, encoding: calls.append(message) or encode(message, encoding))
+    bigroom = setup()
+    channel = RoomChannel(bigroom)
+    for name in ["Evan", "Ben", "Ann", "Joe", "Sue"]:
+        channel.add(FakeSocket(), viewer=name)
+    await drain(channel)
+    calls.clear()
+
+    bigroom.updateState({"action": "move_deck", "args": {"deck_id": "standard_52_0", "x": 4, "y": 4}})
+    channel.broadcast()
+    await drain(channel)
+    # Evan, Ben, and everyone without a hand
+    assert len(calls) == 3
+
+
+@pytest.mark.asyncio
+async def test_projected_patches_follow_projected_snapshot():
+    bigroom = setup()
+    channel = RoomChannel(bigroom)
+    ben = FakeSocket()
+    channel.add(ben, "delta", viewer="Ben")
+    bigroom.updateState({"action": "draw_card", "args": {"hand_id": "empty_0", "deck_id": "standard_52_0"}})
+    channel.broadcast()
+    bigroom.updateState({"action": "draw_card", "args": {"hand_id": "empty_1", "deck_id": "standard_52_0"}})
+    channel.broadcast()
+    await drain(channel)
+
+    messages = [json.loads(text) for text in ben.sent]
+    state = messages[0]["state"]
+    for patch in messages[1:]:
+        state = apply_patch(state, patch)
+    assert state["room"]["hands"]["empty_0"]["count"] == 3
+    assert len(state["room"]["hands"]["empty_1"]["cards"]) == 4
+    assert state["room"]["hands"]["empty_1"] == bigroom.room.hands["empty_1"].to_wire()
+
+
+#main.py only lets a connection ask for view "all" with the admin token
+@pytest.mark.asyncio
+async def test_only_the_all_view_sees_everything():
+    bigroom = setup()
+    actor = RoomActor(bigroom, RoomChannel(bigroom), move_window=0)
+    player, everything = FakeSocket(), FakeSocket()
+    actor.submit("join", player, "Nathan", "full", "json")
+    actor.submit("join", everything, "Zoe", "full", "json", None, "all")
+    await actor.idle()
+    await drain(actor.channel)
+    assert json.loads(player.sent[-1])["room"]["hands"]["empty_0"]["cards"] == []
+    assert json.loads(everything.sent[-1]) == bigroom.to_wire()
@@ -0,0 +1,84 @@
+import pytest
+import bench_history
+from backends import InMemoryBackend
+from registry import room_bytes, VERSION_BYTES, VERSION_DECK_BYTES
+from shard import LocalShard, ShardRouter
+from test_broadcast import FakeSocket
+
+
+async def setup(backend, room_ids, decks=1):
+    for room_id in room_ids:
+        socket = FakeSocket()
+        backend.submit(room_id, "join", socket, "Evan", "full", "json")
+        for _ in range(decks):
+            backend.submit(room_id, "action", socket, {"action": "initialize_deck"})
+        backend.submit(room_id, "leave", socket, "Evan")
+        await backend.actor(room_id).idle()
+
+
+@pytest.mark.asyncio
+async def test_idle_empty_rooms_are_evicted():
+    backend = InMemoryBackend(idle_ttl=60, memory_budget=None, pinned=["pinned"])
+    evicted = []
+    backend.on_evict = evicted.append
+    await setup(backend, ["old", "pinned", "busy"])
+    backend.submit("busy", "join", FakeSocket(), "Ben", "full", "json")
+    await backend.actor("busy").idle()
+    now = backend.actor("old").last_active
+
+    assert backend.rooms.sweep(now + 30) == []
+    assert backend.rooms.sweep(now + 61) == ["old"]
+    assert evicted == ["old"]
+    assert sorted(backend.actors) == ["busy", "pinned"]
+    assert backend.stats()["evicted"] == 1
+
+
+@pytest.mark.asyncio
+async def test_least_recently_used_rooms_go_first_over_budget():
+    backend = InMemoryBackend(idle_ttl=None, memory_budget=None)
+    await setup(backend, ["a", "b", "c"], decks=3)
+    sizes = {room_id: room_bytes(actor) for room_id, actor in backend.actors.items()}
+    backend.actor("a").submit("open", None)
+    await backend.actor("a").idle()
+
+    backend.rooms.memory_budget = sum(sizes.values()) - 1
+    assert backend.rooms.sweep() == ["b"]
+    assert backend.stats()["bytes"] == sizes["a"] + sizes["c"]
+    assert backend.stats()["rooms"] == 2
+
+
+@pytest.mark.asyncio
+async def test_saved_rooms_come_back_after_eviction(tmp_path):
+    backend = InMemoryBackend(data_dir=tmp_path, idle_ttl=1, memory_budget=None)
+    await setup(backend, ["room"], decks=2)
+    wire = backend.actor("room").bigroom.room.to_wire()
+    assert backend.rooms.sweep(backend.actor("room").last_active + 2) == ["room"]
+    await backend.actor("room").idle()
+    assert backend.actor("room").bigroom.room.to_wire() == wire
+    assert (tmp_path / "room.snap").exists()
+    backend.stop()
+
+
+@pytest.mark.asyncio
+async def test_shards_report_evictions_and_stats():
+    router = ShardRouter(2, make_shard=LocalShard, idle_ttl=1, memory_budget=None)
+    evicted = []
+    router.on_evict = evicted.append
+    for room_id in ["a", "b", "c"]:
+        router.submit(room_id, "open", None)
+    hosts = [shard.host for shard in router.shards.values()]
+    for host in hosts:
+        for actor in list(host.actors.values()):
+            await actor.idle()
+            actor.last_active -= 5
+        host.rooms.sweep()
+        host.rooms.on_sweep(host.rooms.stats())
+    assert sorted(evicted) == ["a", "b", "c"]
+    assert router.stats()["evicted"] == 3
+    assert router.stats()["rooms"] == 0
+
+
+@pytest.mark.parametrize("decks", [5, 50, 500])
+def test_version_bytes_match_bench_history(decks):
+    measured = bench_history.run(200, decks)["bytes_per_version"]
+    assert 0.75 < (VERSION_BYTES + VERSION_DECK_BYTES * decks) / measured < 1.25
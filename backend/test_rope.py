@@ -0,0 +1,75 @@
+import random
+import rope
+from array import array
+
+
+def check_balanced(node):
+    if type(node) is not rope.Node:
+        assert len(node) <= rope.LEAF
+        return
+    assert abs(rope.height(node.left) - rope.height(node.right)) <= 1
+    assert node.size == rope.size(node.left) + rope.size(node.right)
+    check_balanced(node.left)
+    check_balanced(node.right)
+
+
+def test_from_codes_round_trip():
+    for n in [0, 1, rope.LEAF, rope.LEAF + 1, 5200]:
+        codes = array("I", range(n))
+        node = rope.from_codes(codes)
+        check_balanced(node)
+        assert rope.to_array(node) == codes
+        assert rope.size(node) == n
+
+
+def test_split_and_concat_match_list():
+    rng = random.Random(7)
+    expected = list(range(1000))
+    node = rope.from_codes(expected)
+    for _ in range(300):
+        i = rng.randint(0, len(expected))
+        left, right = rope.split(node, i)
+        assert list(rope.to_array(left)) == expected[:i]
+        assert list(rope.to_array(right)) == expected[i:]
+        # move a random chunk to the front
+        j = rng.randint(0, len(expected) - i)
+        middle, rest = rope.split(right, j)
+        node = rope.concat(rope.concat(middle, left), rest)
+        expected = expected[i:i + j] + expected[:i] + expected[i + j:]
+        check_balanced(node)
+    assert list(rope.to_array(node)) == expected
+    assert [rope.get(node, i) for i in range(0, 1000, 37)] == expected[::37]
+
+
+def test_operations_share_untouched_leaves():
+    node = rope.from_codes(range(5200))
+    old_leaves = {id(leaf) for leaf in rope.leaves(node)}
+    changed = rope.replace(node, 2600, 1)
+    new_leaves = [id(leaf) for leaf in rope.leaves(changed)]
+    assert len([leaf for leaf in new_leaves if leaf not in old_leaves]) == 1
+    assert rope.get(node, 2600) == 2600
+    assert rope.get(changed, 2600) == 1
+
+    top, _ = rope.split(node, 5190)
+    assert len([leaf for leaf in rope.leaves(top) if id(leaf) not in old_leaves]) <= 1
+    assert rope.height(top) <= rope.height(node)
+
+
+def test_cards_added_one_at_a_time_fill_leaves():
+    back, front = rope.EMPTY, rope.EMPTY
+    for i in range(1000):
+        back = rope.concat(back, array("I", [i]))
+        front = rope.concat(array("I", [i]), front)
+    for node, expected in ((back, list(range(1000))), (front, list(range(999, -1, -1)))):
+        check_balanced(node)
+        assert list(rope.to_array(node)) == expected
+        assert len(list(rope.leaves(node))) == -(-1000 // rope.LEAF)
+
+
+def test_popping_doesnt_leave_tiny_leaves_behind():
+    node = rope.from_codes(range(1000))
+    for i in range(0, 500, 3):
+        before, rest = rope.split(node, i)
+        node = rope.concat(before, rope.split(rest, 1)[1])
+    check_balanced(node)
+    assert len(list(rope.leaves(node))) <= 2 * -(-rope.size(node) // rope.LEAF)
@@ -0,0 +1,119 @@
+import asyncio
+import json
+import pytest
+from shard import HashRing, LocalShard, ProcessShard, ShardRouter
+from test_broadcast import FakeSocket, StalledSocket
+
+
+def test_hash_ring_spreads_and_keeps_rooms():
+    rooms = [f"room{i}" for i in range(2000)]
+    ring = HashRing(["a", "b", "c", "d"])
+    placed = {room: ring.node_for(room) for room in rooms}
+    counts = {node: list(placed.values()).count(node) for node in "abcd"}
+    assert min(counts.values()) > 300
+    assert placed == {room: ring.node_for(room) for room in rooms}
+
+    # adding a shard only moves the rooms that land on it
+    bigger = HashRing(["a", "b", "c", "d", "e"])
+    moved = [room for room in rooms if bigger.node_for(room) != placed[room]]
+    assert all(bigger.node_for(room) == "e" for room in moved)
+    assert len(moved) < len(rooms) / 3
+
+
+async def settle(router):
+    for _ in range(200):
+        await asyncio.sleep(0)
+    for shard in router.shards.values():
+        host = getattr(shard, "host", None)
+        if host is not None:
+            for actor in host.actors.values():
+                await actor.idle()
+    for _ in range(200):
+        await asyncio.sleep(0)
+
+
+@pytest.mark.asyncio
+async def test_router_sends_each_room_to_one_shard():
+    router = ShardRouter(3, make_shard=LocalShard)
+    router.start()
+    sockets = {}
+    for room_id in ["mcI5j0Kw", "mcI5j0Kx", "mcI5j0Ky", "mcI5j0Kz"]:
+        for name in ["Evan", "Ben"]:
+            socket = sockets[room_id, name] = FakeSocket()
+            router.submit(room_id, "join", socket, name, "full", "json")
+        router.submit(room_id, "action", sockets[room_id, "Evan"], {"action": "initialize_deck"})
+    await settle(router)
+
+    for room_id in ["mcI5j0Kw", "mcI5j0Kx", "mcI5j0Ky", "mcI5j0Kz"]:
+        hosts = [shard.host for shard in router.shards.values() if room_id in shard.host.actors]
+        assert hosts == [router.shard_for(room_id).host]
+        state = json.loads(sockets[room_id, "Ben"].sent[-1])
+        assert state["players"] == ["Evan", "Ben"]
+        assert len(state["room"]["decks"]["standard_52_0"]["cards"]) == 52
+
+
+@pytest.mark.asyncio
+async def test_router_leave_and_errors():
+    router = ShardRouter(2, make_shard=LocalShard)
+    evan, ben = FakeSocket(), FakeSocket()
+    router.submit("room", "join", evan, "Evan", "full", "json")
+    router.submit("room", "join", ben, "Ben", "full", "json")
+    router.submit("room", "action", evan, {"action": "teleport"})
+    await settle(router)
+    assert json.loads(evan.sent[-1])["error"] == "unknown_action"
+    assert len(ben.sent) == 1
+
+    router.submit("room", "leave", evan, "Evan")
+    router.submit("room", "action", evan, {"action": "initialize_deck"})
+    await settle(router)
+    assert router.shard_for("room").host.actors["room"].bigroom.players == ["Ben"]
+    assert evan not in router.conn_ids
+
+
+@pytest.mark.asyncio
+async def test_front_resyncs_slow_sockets():
+    router = ShardRouter(1, make_shard=LocalShard, max_queue=4)
+    evan, slow = FakeSocket(), StalledSocket()
+    router.submit("room", "join", evan, "Evan", "full", "json")
+    router.submit("room", "join", slow, "Ben", "full", "json")
+    for x in range(20):
+        router.submit("room", "action", evan, {"action": "initialize_deck", "args": {"pos": [x, 0]}})
+        await settle(router)
+    assert slow.closed_with is None
+    assert len(router.connections[router.conn_ids[slow]].queue) <= 4
+    slow.release.set()
+    await settle(router)
+    # the last frame is the whole room as it is now
+    assert len(slow.sent) <= 5
+    assert json.loads(slow.sent[-1]) == json.loads(evan.sent[-1])
+    assert len(json.loads(slow.sent[-1])["room"]["decks"]) == 20
+
+
+@pytest.mark.asyncio
+async def test_front_disconnects_slow_sockets():
+    router = ShardRouter(1, make_shard=LocalShard, max_queue=4, slow_client_policy="disconnect")
+    evan, slow = FakeSocket(), StalledSocket()
+    router.submit("room", "join", evan, "Evan", "full", "json")
+    router.submit("room", "join", slow, "Ben", "full", "json")
+    for x in range(20):
+        router.submit("room", "action", evan, {"action": "initialize_deck", "args": {"pos": [x, 0]}})
+        await settle(router)
+    assert slow.closed_with == 1013
+    assert evan.closed_with is None
+
+
+@pytest.mark.asyncio
+async def test_process_shard_round_trip():
+    router = ShardRouter(1, make_shard=ProcessShard)
+    router.start()
+    try:
+        socket = FakeSocket()
+        router.submit("room", "join", socket, "Evan", "full", "json")
+        router.submit("room", "action", socket, {"action": "initialize_deck"})
+        for _ in range(500):
+            await asyncio.sleep(0.01)
+            if len(socket.sent) >= 2:
+                break
+        assert json.loads(socket.sent[-1])["room"]["decks"]["standard_52_0"]["id"] == "standard_52_0"
+    finally:
+        router.stop()
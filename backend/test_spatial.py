@@ -0,0 +1,117 @@
+import contextlib
+import io
+import random
+from actions import DISPATCHER
+from objects import Deck, CardList
+from catalog import CATALOG
+from room import Room
+from spatial import DeckGrid, card_at, deck_box
+
+
+def table(n, rng):
+    decks = {}
+    for i in range(n):
+        size = rng.choice([1, 5, 52, 400])
+        codes = (CATALOG.new_deck("standard52") * 8)[:size]
+        decks[f"d{i}"] = Deck(id=f"d{i}", position=[rng.uniform(-500, 3000), rng.uniform(-500, 3000)], cards=CardList(codes=codes))
+    return Room(decks=decks)
+
+
+def cell_boxes(grid):
+    return {cell: {deck_id: box for deck_id, (box, _) in decks.items()} for cell, decks in grid.cells.items()}
+
+
+#what the client does: every card of every deck, top first
+def scan(room, x, y, exclude=None):
+    for deck_id, deck in reversed(list(room.decks.items())):
+        if deck_id == exclude:
+            continue
+        for i in reversed(range(len(deck.cards))):
+            left, top = deck.position[0] + 2 * i, deck.position[1] + 2 * i
+            if left <= x <= left + 120 and top <= y <= top + 168:
+                return deck_id, i
+    return None, None
+
+
+def test_deck_at_matches_a_scan_of_every_card():
+    rng = random.Random(4)
+    room = table(200, rng)
+    for _ in range(500):
+        x, y = rng.uniform(-600, 3500), rng.uniform(-600, 3500)
+        assert room.deck_at(x, y) == scan(room, x, y)
+    x, y = room.decks["d7"].position
+    assert room.deck_at(x + 1, y + 1, exclude="d7")[0] != "d7"
+
+
+def test_decks_within_a_rectangle():
+    rng = random.Random(5)
+    room = table(200, rng)
+    for _ in range(200):
+        left, top = rng.uniform(-600, 3000), rng.uniform(-600, 3000)
+        right, bottom = left + rng.uniform(0, 800), top + rng.uniform(0, 800)
+        expected = [deck_id for deck_id, deck in room.decks.items()
+                    if (box := deck_box(deck)) and box[0] <= right and left <= box[2] and box[1] <= bottom and top <= box[3]]
+        assert room.decks_within(left, top, right, bottom) == expected
+    assert room.decks_within(-10**6, -10**6, 10**6, 10**6) == list(room.decks)
+
+
+def test_grid_stays_in_step_with_the_decks():
+    rng = random.Random(6)
+    room = Room()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i in range(300):
+            ids = list(room.decks)
+            choice = rng.randrange(7) if ids else 0
+            deck_id = rng.choice(ids) if ids else None
+            message = [
+                {"action": "initialize_deck", "args": {"pos": [rng.randrange(2000), rng.randrange(2000)]}},
+                {"action": "move_deck", "args": {"deck_id": deck_id, "x": rng.randrange(2000), "y": rng.randrange(2000)}},
+                {"action": "split_deck", "args": {"deck_id": deck_id, "n": 1, "pos": [rng.randrange(2000), 5]}},
+                {"action": "remove_top", "args": {"deck_id": deck_id, "n": 3}},
+                {"action": "merge_decks", "args": {"dragged_deck_id": deck_id, "target_deck_id": rng.choice(ids or [None])}},
+                {"action": "move_card", "args": {"deck_id": deck_id, "card_index": 0, "new_position": [9, 9], "new_deck_id": f"c{i}"}},
+                {"action": "drop_at", "args": {"deck_id": deck_id, "x": rng.randrange(2000), "y": rng.randrange(2000)}},
+            ][choice]
+            room, _ = DISPATCHER.dispatch(room, message)
+            assert {k: v[0] for k, v in room.grid.boxes.items()} == {k: deck_box(d) for k, d in room.decks.items()}
+            # stacked in the order the client draws them
+            assert sorted(room.grid.boxes, key=lambda k: room.grid.boxes[k][1]) == list(room.decks)
+            # z only has to keep the order, so cells are compared by deck and box
+            assert cell_boxes(room.grid) == cell_boxes(DeckGrid.build(room.decks))
+
+
+def test_drop_at_merges_combines_or_moves():
+    room = Room()
+    room, _ = DISPATCHER.dispatch(room, {"action": "initialize_deck", "args": {"pos": [0, 0]}})
+    room, _ = DISPATCHER.dispatch(room, {"action": "initialize_deck", "args": {"pos": [1000, 0]}})
+
+    moved, error = DISPATCHER.dispatch(room, {"action": "drop_at", "args": {"deck_id": "standard_52_1", "x": 500, "y": 500}})
+    assert error is None and moved.decks["standard_52_1"].position == [500, 500]
+
+    merged, _ = DISPATCHER.dispatch(room, {"action": "drop_at", "args": {"deck_id": "standard_52_1", "x": 30, "y": 30}})
+    assert list(merged.decks) == ["standard_52_0"]
+    assert len(merged.decks["standard_52_0"].cards) == 104
+
+    combined, _ = DISPATCHER.dispatch(room, {"action": "drop_at", "args": {"deck_id": "standard_52_1", "card_index": 0, "x": 10, "y": 10}})
+    assert len(combined.decks["standard_52_0"].cards) == 53
+    assert combined.decks["standard_52_0"].cards[-1] == room.decks["standard_52_1"].cards[0]
+
+    alone, _ = DISPATCHER.dispatch(room, {"action": "drop_at", "args": {"deck_id": "standard_52_1", "card_index": 0, "x": 400, "y": 400, "new_deck_id": "c"}})
+    assert alone.decks["c"].position == [400, 400]
+    assert alone.deck_at(450, 450) == ("c", 0)
+
+
+def test_card_at_picks_the_top_card():
+    box = (0, 0, 120 + 2 * 51, 168 + 2 * 51)
+    assert card_at(box, 1, 1) == 0
+    assert card_at(box, 150, 200) == 51
+    assert card_at(box, 221, 1) is None
+
+
+def test_moving_a_deck_shares_the_rest_of_the_grid():
+    room = table(500, random.Random(2))
+    grid = room.grid
+    moved = room.move_deck("d0", 10, 10).grid
+    for old, new in ((grid.boxes, moved.boxes), (grid.cells, moved.cells)):
+        changed = sum(a is not b for a, b in zip(old.root.slots, new.root.slots))
+        assert changed <= 4
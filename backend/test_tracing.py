@@ -0,0 +1,138 @@
+import json
+import os
+import pstats
+import time
+import pytest
+import main
+import tracing
+from actor import new_room_actor
+from fastapi.testclient import TestClient
+from tracing import TRACER, ProfileBusy, start_profile, stop_profile
+from test_broadcast import FakeSocket
+
+
+@pytest.fixture
+def traced(tmp_path):
+    TRACER.configure(1.0, str(tmp_path))
+    yield tmp_path
+    TRACER.configure(0.0)
+    TRACER.close()
+
+
+def busy(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def read_traces(directory):
+    return [json.loads(line) for path in directory.glob("traces-*.jsonl") for line in path.read_text().splitlines()]
+
+
+@pytest.mark.asyncio
+async def test_sampled_actions_are_timed_through_each_step(traced):
+    actor = new_room_actor("room", move_window=0)
+    socket = FakeSocket()
+    actor.submit("join", socket, "Evan", "delta", "json")
+    actor.submit("action", socket, {"action": "initialize_deck"}, tracing.received(time.perf_counter()))
+    actor.submit("action", socket, {"action": "shuffle", "args": {"deck_id": "nope"}})
+    await actor.idle()
+    deck, missing = read_traces(traced)
+    assert deck["room"] == "room" and deck["action"] == "initialize_deck"
+    assert list(deck["spans"]) == list(tracing.SPANS)
+    assert deck["total"] == pytest.approx(sum(deck["spans"].values()))
+    # rejected before it was applied or broadcast, and not received from a socket
+    assert missing["error"] == "not_found"
+    assert list(missing["spans"]) == ["validate", "apply"]
+    assert tracing.current is None
+
+
+@pytest.mark.asyncio
+async def test_nothing_is_traced_by_default(tmp_path):
+    TRACER.configure(0.0, str(tmp_path))
+    actor = new_room_actor("room")
+    actor.submit("action", None, {"action": "initialize_deck"})
+    await actor.idle()
+    assert read_traces(tmp_path) == []
+    TRACER.close()
+
+
+@pytest.mark.asyncio
+async def test_room_profile_only_sees_that_room(tmp_path):
+    rooms = {room_id: new_room_actor(room_id) for room_id in ("a", "b")}
+    for actor in rooms.values():
+        actor.submit("action", None, {"action": "initialize_deck"})
+        await actor.idle()
+    path = str(tmp_path / "a.prof")
+    start_profile("cprofile", 60, path, room_id="a")
+    with pytest.raises(ProfileBusy):
+        start_profile("sample", 60, str(tmp_path / "other.folded"))
+    rooms["a"].submit("action", None, {"action": "shuffle", "args": {"deck_id": "standard_52_0"}})
+    rooms["b"].submit("action", None, {"action": "flip_deck", "args": {"deck_id": "standard_52_0"}})
+    for actor in rooms.values():
+        await actor.idle()
+    stop_profile()
+    functions = {name for _, _, name in pstats.Stats(path).stats}
+    assert "shuffle" in functions
+    assert "flip_deck" not in functions
+
+
+@pytest.mark.asyncio
+async def test_sampler_writes_folded_stacks_for_its_room(tmp_path):
+    path = tmp_path / "a.folded"
+    start_profile("sample", 60, str(path), room_id="a")
+    tracing.enter("b")
+    busy(0.05)
+    tracing.leave("b")
+    tracing.enter("a")
+    busy(0.05)
+    tracing.leave("a")
+    stop_profile()
+    stacks = path.read_text().splitlines()
+    assert stacks
+    assert all("test_tracing.py:busy" in line and "test_tracing.py:test_sampler" in line for line in stacks)
+    assert sum(int(line.rsplit(" ", 1)[1]) for line in stacks) > 3
+
+
+def test_admin_endpoints_need_the_token(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "admin_token", "secret")
+    monkeypatch.setattr(main, "profile_dir", str(tmp_path))
+    client = TestClient(main.app)
+    assert client.post("/admin/trace", params={"rate": 0.5}).status_code == 403
+    assert client.post("/admin/trace", params={"rate": 0.5}, headers={"X-Admin-Token": "wrong"}).status_code == 403
+    monkeypatch.setattr(main, "admin_token", None)
+    assert client.post("/admin/trace", params={"rate": 0.5}, headers={"X-Admin-Token": ""}).status_code == 403
+
+
+def test_admin_trace_and_profile(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "admin_token", "secret")
+    monkeypatch.setattr(main, "profile_dir", str(tmp_path))
+    headers = {"X-Admin-Token": "secret"}
+    with TestClient(main.app) as client:
+        assert client.post("/admin/trace", params={"rate": 2}, headers=headers).status_code == 400
+        assert client.post("/admin/trace", params={"rate": 0.25}, headers=headers).json() == {"rate": 0.25, "directory": str(tmp_path)}
+        assert TRACER.rate == 0.25
+        client.post("/admin/trace", params={"rate": 0}, headers=headers)
+
+        assert client.post("/admin/profile", params={"mode": "perf"}, headers=headers).status_code == 400
+        assert client.post("/admin/profile", params={"room_id": "BADCODE"}, headers=headers).status_code == 400
+        response = client.post("/admin/profile", params={"seconds": 0.1, "room_id": "mcI5j0Kw"}, headers=headers)
+        assert response.status_code == 200
+        assert client.post("/admin/profile", params={"seconds": 0.1}, headers=headers).status_code == 409
+        file, = response.json()["files"]
+        for _ in range(100):
+            if tracing.active is None:
+                break
+            time.sleep(0.02)
+        assert tracing.active is None
+        assert os.path.exists(file)
+    TRACER.close()
+
+
+def test_queue_span_starts_after_decoding():
+    at, decode = tracing.received(time.perf_counter() - 0.5)
+    assert decode == pytest.approx(0.5, abs=0.05)
+    assert time.time() - at == pytest.approx(0.5, abs=0.05)
+    trace = tracing.Trace("room", "shuffle", (time.time() - 1.0, 0.25))
+    assert trace.spans["receive"] == 0.25
+    assert trace.spans["queue"] == pytest.approx(0.75, abs=0.05)
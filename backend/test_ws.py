@@ -25,6 +25,9 @@ async def test_single_connection_with_request():
         assert room.numPlayers()==1
         request = {"action": "initialize_deck", "args":{"pos":[2, 2]}}
         await websocket.send(json.dumps(request))
+        await websocket.recv()
+        request = {"action": "flip_deck", "args":{"deck_id":"standard_52_0"}}
+        await websocket.send(json.dumps(request))
         state = await websocket.recv()
         json_room = json.loads(state)
         assert "standard_52_0" in json_room["room"]["decks"]
@@ -51,7 +54,7 @@ async def test_single_connection_with_complex_request():
         request = {"action":"remove_top", "args":{"deck_id":"standard_52_0", "n":51}}
         await websocket.send(json.dumps(request))
         await websocket.recv()
-        request = {"action":"add_top", "args":{"deck_id": "standard_52_0", "card":{"card_front":"lala", "card_back":"zaza", "face_up":False}}}
+        request = {"action":"add_top", "args":{"deck_id": "standard_52_0", "card":{"card_front":"lala", "card_back":"zaza", "face_up":True}}}
         await websocket.send(json.dumps(request))
         state = await websocket.recv()
         json_room = json.loads(state)
@@ -144,7 +147,7 @@ async def test_multiple_connects_with_add_and_remove():
             await websocket.send(name)
             for i in range(10):
                 await websocket.recv()
-                request = {"action":"add_top", "args":{"deck_id": "standard_52_0", "card":{"card_front":"lala", "card_back":"zaza", "face_up":False}}}
+                request = {"action":"add_top", "args":{"deck_id": "standard_52_0", "card":{"card_front":"lala", "card_back":"zaza", "face_up":True}}}
                 await websocket.send(json.dumps(request))
     async def subtract(name):
         async with websockets.connect("ws://127.0.0.1:8000/ws/mcI5j0Kz") as websocket:
@@ -0,0 +1,217 @@
+import asyncio
+import cProfile
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from collections import deque
+
+# Opt-in tracing and profiling, for finding where a slow room spends its time.
+# Both are off unless asked for, and cost a None check per command when off.
+#
+# Tracing: a sampled share of actions (TRACER.rate) are timed through each
+# step and written as a line of JSON to PROFILE_DIR/traces-{process id}.jsonl:
+#   receive   decoding the websocket frame
+#   queue     waiting for the room's actor
+#   validate  checking the args
+#   apply     the action's Room method
+#   encode    serializing the frames it's broadcast in
+#   fanout    the rest of the broadcast: the patch and queueing frames for every socket
+# move_deck actions held to be coalesced (see coalesce.py) aren't traced.
+#
+# Profiling: one session at a time per process, for a number of seconds, of the
+# whole process or of one room's commands only. "cprofile" writes a .prof file
+# for pstats or snakeviz. "sample" looks at the room's thread every
+# SAMPLE_INTERVAL seconds and writes a .folded file of stacks and counts, the
+# input flamegraph.pl and speedscope take. Sampling costs the room nothing.
+TRACE_SAMPLE = 0.0
+PROFILE_DIR = "profiles"
+PROFILE_SECONDS = 10
+MAX_PROFILE_SECONDS = 300
+PROFILE_MODES = ["cprofile", "sample"]
+SAMPLE_INTERVAL = 0.005
+SPANS = ("receive", "queue", "validate", "apply", "encode", "fanout")
+
+# the trace of the action being handled right now, or None. set by RoomActor.apply
+current = None
+# the room whose command is being handled right now, or None
+current_room = None
+# the profile session running in this process, or None
+active = None
+
+#wall clock time a frame came in and seconds spent decoding it, passed along
+#with the action so its trace can include them
+#arg1 time.perf_counter() from before the frame was decoded. call this right after
+def received(start) -> tuple:
+    decode = time.perf_counter() - start
+    return time.time() - decode, decode
+
+class Trace:
+    #arg3 optional. (wall clock time, decode seconds) from received()
+    def __init__(self, room_id, action, received=None):
+        self.room_id = room_id
+        self.action = action
+        self.time = time.time()
+        self.spans = {}
+        self.error = None
+        if received is not None:
+            at, decode = received
+            self.spans["receive"] = decode
+            # at is from before decoding, so the rest of the wait is the queue
+            self.spans["queue"] = max(0.0, self.time - at - decode)
+
+    def set(self, span, seconds):
+        self.spans[span] = seconds
+
+    def add(self, span, seconds):
+        self.spans[span] = self.spans.get(span, 0.0) + seconds
+
+    def to_wire(self) -> dict:
+        spans = {span: self.spans[span] for span in SPANS if span in self.spans}
+        wire = {"time": self.time, "room": self.room_id, "action": self.action, "spans": spans, "total": sum(spans.values())}
+        if self.error is not None:
+            wire["error"] = self.error
+        return wire
+
+class Tracer:
+    #arg1 share of actions traced, 0 to 1
+    #arg2 directory the traces file is written to
+    def __init__(self, rate=TRACE_SAMPLE, directory=PROFILE_DIR):
+        self.rate = rate
+        self.directory = directory
+        self.file = None
+        self.written = 0
+
+    def configure(self, rate, directory=None):
+        self.rate = rate
+        if directory is not None and directory != self.directory:
+            self.close()
+            self.directory = directory
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.directory, f"traces-{os.getpid()}.jsonl")
+
+    #a new trace if this action is sampled, otherwise None
+    def start(self, room_id, action, received=None):
+        if self.rate <= 0 or random.random() >= self.rate:
+            return None
+        return Trace(room_id, action.get("action") if isinstance(action, dict) else None, received)
+
+    def finish(self, trace):
+        if self.file is None:
+            os.makedirs(self.directory, exist_ok=True)
+            self.file = open(self.path, "a", buffering=1)
+        self.file.write(json.dumps(trace.to_wire()) + "\n")
+        self.written += 1
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+TRACER = Tracer()
+
+###
+### Profiling
+###
+class ProfileBusy(RuntimeError):
+    pass
+
+# cProfile of the whole thread, or only while one room's commands run
+class CProfileSession:
+    def __init__(self, path, room_id=None):
+        self.path = path
+        self.room_id = room_id
+        self.profiler = cProfile.Profile()
+        if room_id is None:
+            self.profiler.enable()
+
+    def enter(self):
+        self.profiler.enable()
+
+    def leave(self):
+        self.profiler.disable()
+
+    def stop(self):
+        self.profiler.disable()
+        self.profiler.dump_stats(self.path)
+
+# stacks of the thread that started it, looked at every interval from another thread
+class SamplerSession:
+    def __init__(self, path, room_id=None, interval=SAMPLE_INTERVAL):
+        self.path = path
+        self.room_id = room_id
+        self.interval = interval
+        self.thread_id = threading.get_ident()
+        self.stacks = Counter()
+        self.done = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while not self.done.wait(self.interval):
+            if self.room_id is not None and current_room != self.room_id:
+                continue
+            frame = sys._current_frames().get(self.thread_id)
+            stack = deque()
+            while frame is not None:
+                stack.appendleft(f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}")
+                frame = frame.f_back
+            self.stacks[";".join(stack)] += 1
+
+    def enter(self):
+        pass
+
+    def leave(self):
+        pass
+
+    def stop(self):
+        self.done.set()
+        self.thread.join()
+        with open(self.path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+#file a profile is written to
+#arg4 optional. added to the name, like the shard it's from
+def profile_path(directory, room_id, mode, suffix="") -> str:
+    stamp = time.strftime("%Y%m%d-%H%M%S")
+    extension = ".prof" if mode == "cprofile" else ".folded"
+    return os.path.join(directory, f"profile-{room_id or 'all'}-{stamp}{suffix}{extension}")
+
+#starts a profile session that stops and writes its file after some seconds.
+#must be called on the thread running the rooms
+#arg1 "cprofile" or "sample"
+#arg4 optional. only profile this room's commands
+#raises ProfileBusy if a session is already running here
+def start_profile(mode, seconds, path, room_id=None):
+    global active
+    if active is not None:
+        raise ProfileBusy(f"already writing {active.path}")
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    active = CProfileSession(path, room_id) if mode == "cprofile" else SamplerSession(path, room_id)
+    asyncio.get_running_loop().call_later(seconds, stop_profile)
+    return active
+
+def stop_profile():
+    global active
+    if active is not None:
+        session, active = active, None
+        session.stop()
+
+#called by RoomActor around every command it handles
+def enter(room_id):
+    global current_room
+    current_room = room_id
+    if active is not None and active.room_id is not None and active.room_id == room_id:
+        active.enter()
+
+def leave(room_id):
+    global current_room
+    current_room = None
+    if active is not None and active.room_id is not None and active.room_id == room_id:
+        active.leave()
@@ -216,7 +216,12 @@ const App: React.FC = () => {
       newWs.onmessage = (event: MessageEvent) => {
         if (newWs !== ws.current) return;
         try {
-          setGameState(JSON.parse(event.data as string));
+          const message = JSON.parse(event.data as string);
+          if (message?.type === "error") {
+            console.warn("Action rejected by server:", message);
+            return;
+          }
+          setGameState(message);
         } catch (error) {
           console.error("Failed to parse message:", event.data, error);
         }